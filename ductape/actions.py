@@ -113,9 +113,8 @@ def dPhenomeAdd(project, orgID, filename):
     
     filename = os.path.abspath(filename)
     
-    bparser = BiologParser(filename, 
-                           set([x.plate_id
-                                for x in biolog.getPlates()]))
+    plates = set([x.plate_id for x in biolog.getPlates()])
+    bparser = BiologParser(filename, plates)
     bparser.parse()
     
     if len(bparser.plates) == 0:
@@ -173,7 +172,7 @@ def dPhenomeAdd(project, orgID, filename):
     dPlates={}
     for plate in bparser.plates:
         # Check if some plateIDs are unknown
-        if not biolog.isPlate(plate.plate_id):
+        if plate.plate_id not in plates:
             logger.warning('Plate ID (%s) not present in the project, skipping this plate'%plate.plate_id)
             logger.warning('Or you can import your custom plate with the import-plates command')
             bparser.plates.remove(plate)
@@ -195,37 +194,28 @@ def dPhenomeAdd(project, orgID, filename):
         for w in wells:
             w.strain = orgID
     
-    biolog.addWells(wells, clustered=False)
     # If we have parsed a yaml/json we may have the parameters as well
-    biolog.addWells(wells, clustered=True, imported=True)
+    biolog.importWells(wells)
     
     logger.info('Added phenome %s, having %d biolog plates (%d wells)'%
                 (orgID, len(bparser.plates), len(wells)))
     
     return True
 
-def dPhenomeMultiAdd(project, filename):
+def getMultiPhenome(biolog, filename, plates, orgs):
     '''
-    Add a single phenomic file with multiple organisms in it
+    Parse a single phenomic file with multiple organisms in it
+    plates and orgs are the sets of known plate and organism IDs
+    Returns a list of (orgID, plates, wells) tuples (None on errors)
     '''
     from ductape.phenome.biolog import BiologParser, Plate
     
-    if not os.path.exists(filename):
-        logger.error('Phenomic file %s may not be present'%(filename))
-        return False
-    
-    # Add to the project
-    biolog = Biolog(project)
-    
-    filename = os.path.abspath(filename)
-    
-    bparser = BiologParser(filename, set([x.plate_id
-                                          for x in biolog.getPlates()]))
+    bparser = BiologParser(filename, plates)
     bparser.parse()
     
     if len(bparser.plates) == 0:
         logger.warning('No biolog data was found!')
-        return False
+        return None
     
     # Check the organism ids inside the biolog files
     # Assuming the names are correct AND stored inside the strainName field
@@ -238,7 +228,7 @@ def dPhenomeMultiAdd(project, filename):
     
     if len(strainNames) == 0:
         logger.warning('''Field strainName ("Field 3" in new CSV version) doesn't contain any value (%s)'''%filename)
-        return False
+        return None
         
     logger.info('Found the following organism IDs: %s'%' '.join(strainNames))
     
@@ -247,11 +237,9 @@ def dPhenomeMultiAdd(project, filename):
     
     # TODO: regular expressions verification
     
-    orgs = strainNames
-    
-    for orgID in orgs:
-        org = Organism(project)
-        if not org.isOrg(orgID):
+    phenomes = []
+    for orgID in strainNames:
+        if orgID not in orgs:
             logger.warning('Organism %s is not present yet! Skipping...'%orgID)
             continue
         
@@ -261,7 +249,7 @@ def dPhenomeMultiAdd(project, filename):
         for plate in bparser.plates:
             if plate.strain == orgID:
                 # Check if some plateIDs are unknown
-                if not biolog.isPlate(plate.plate_id):
+                if plate.plate_id not in plates:
                     logger.warning('Plate ID (%s) not present in the project, skipping this plate'%plate.plate_id)
                     logger.warning('Or you can import your custom plate with the import-plates command')
                     bparser.plates.remove(plate)
@@ -279,12 +267,37 @@ def dPhenomeMultiAdd(project, filename):
         wells = [w for plate in list(dPlates.values()) 
                  for w in plate.getWells()]
         
-        biolog.addWells(wells, clustered=False)
-        # If we have parsed a yaml/json we may have the parameters as well
-        biolog.addWells(wells, clustered=True, imported=True)
-        
+        phenomes.append( (orgID, len(dPlates), wells) )
+    
+    return phenomes
+
+def dPhenomeMultiAdd(project, filename):
+    '''
+    Add a single phenomic file with multiple organisms in it
+    '''
+    if not os.path.exists(filename):
+        logger.error('Phenomic file %s may not be present'%(filename))
+        return False
+    
+    # Add to the project
+    biolog = Biolog(project)
+    
+    filename = os.path.abspath(filename)
+    
+    phenomes = getMultiPhenome(biolog, filename,
+                               set([x.plate_id for x in biolog.getPlates()]),
+                               set([x.org_id
+                                    for x in Organism(project).getAll()]))
+    if phenomes is None:
+        return False
+    
+    # If we have parsed a yaml/json we may have the parameters as well
+    biolog.importWells([w for orgID, nplates, wells in phenomes
+                        for w in wells])
+    
+    for orgID, nplates, wells in phenomes:
         logger.info('Added phenome %s, having %d biolog plates (%d wells)'%
-                    (orgID, len(dPlates), len(wells)))
+                    (orgID, nplates, len(wells)))
     
     return True
 
@@ -425,19 +438,33 @@ def dPhenomeDirAdd(project, folder, extension):
     else:
         logger.info('Looking for files with extension %s'%extension)
         
+        biolog = Biolog(project)
+        plates = set([x.plate_id for x in biolog.getPlates()])
+        orgs = set([x.org_id for x in Organism(project).getAll()])
+        
         added = 0
+        phenomes = []
         for infile in os.listdir(folder):
             if infile.split('.')[-1] != extension:
                 logger.debug('Skipping file %s'%infile)
                 continue
             
-            filename = os.path.join(folder, infile)
+            filename = os.path.abspath(os.path.join(folder, infile))
             if os.path.isdir(filename):
                 continue
             
-            if dPhenomeMultiAdd(project, filename):
+            res = getMultiPhenome(biolog, filename, plates, orgs)
+            if res is not None:
+                phenomes += res
                 added += 1
         
+        # All the files are added at once
+        biolog.importWells([w for orgID, nplates, wells in phenomes
+                            for w in wells])
+        for orgID, nplates, wells in phenomes:
+            logger.info('Added phenome %s, having %d biolog plates (%d wells)'%
+                        (orgID, nplates, len(wells)))
+        
         if added > 0:
             logger.info('Added %d phenomic data files from %s'%
                     (added, folder))
@@ -619,7 +646,8 @@ def dPhenomeTrim(project, trimTime = None):
 
     If trimTime is provided, that time will be used for the trim
     '''
-    from ductape.phenome.biolog import getPlates, Experiment
+    from ductape.phenome.biolog import Experiment
+    from ductape.phenome.matrix import PhenomeMatrix
     
     biolog = Biolog(project)
     
@@ -627,25 +655,24 @@ def dPhenomeTrim(project, trimTime = None):
         logger.warning('No phenotypic data available!')
         return False
     
-    sigs = [s for s in biolog.getAllSignals()]
-    plates = [p for p in getPlates(sigs, nonmean=True)]
+    matrix = PhenomeMatrix.fromSignals(biolog.getAllSignals())
     isZero = biolog.atLeastOneZeroSubtracted()
 
-    if len(plates) == 0:
+    if len(matrix) == 0:
         logger.warning('No phenomic data available, skipping trimming')
         return True
     else:
-        logger.info('Trimming %d phenomic plates'%len(plates))
+        logger.info('Trimming %d phenomic plates'%len(matrix.plates))
     
     if trimTime is not None:
         logger.info('Trimming plates at %f'%trimTime)
 
     zeroPlates = [x.plate_id for x in biolog.getZeroSubtractablePlates()]
     
-    exp = Experiment(plates=plates, zero=isZero, zeroPlates=zeroPlates)
+    exp = Experiment(matrix=matrix, zero=isZero, zeroPlates=zeroPlates)
     mtime = exp.trim(trimTime)
     
-    logger.info('Trimmed %d plates at %f'%(len(plates), mtime))
+    logger.info('Trimmed %d plates at %f'%(len(matrix.plates), mtime))
     
     logger.info('Updating the plates')
     # Add to the project
@@ -658,29 +685,26 @@ def dPhenomeTrim(project, trimTime = None):
     return True
 
 def dPhenomePurge(project, policy, delta=1, filterplates=[], replica=None):
-    from ductape.phenome.biolog import getPlates, Experiment
+    from ductape.phenome.biolog import Experiment
+    from ductape.phenome.matrix import PhenomeMatrix
     
     biolog = Biolog(project)
     
-    sigs = [s for s in biolog.getAllWells()]
-    plates = [p for p in getPlates(sigs, nonmean=True)]
     # The user may want to purge only some plates
-    if len(filterplates) > 0:
-        for p in plates:
-            if p.plate_id not in filterplates:
-                while p in plates:
-                    plates.remove(p)
+    wells = [w for w in biolog.getAllWells()
+             if len(filterplates) == 0 or w.plate_id in filterplates]
+    matrix = PhenomeMatrix.fromSignals(wells)
     isZero = biolog.atLeastOneZeroSubtracted()
 
-    if len(plates) == 0:
+    if len(matrix) == 0:
         logger.warning('No phenomic data available, skipping purging')
         return True
     else:
-        logger.info('Purging %d phenomic plates'%len(plates))
+        logger.info('Purging %d phenomic plates'%len(matrix.plates))
 
     zeroPlates = [x.plate_id for x in biolog.getZeroSubtractablePlates()]
     
-    exp = Experiment(plates=plates, zero=isZero, zeroPlates=zeroPlates)
+    exp = Experiment(matrix=matrix, zero=isZero, zeroPlates=zeroPlates)
     
     if delta >= exp.getMaxActivity():
         logger.warning('The delta activity threshold is higher than the maximum '+
@@ -1030,7 +1054,8 @@ def dGenomeStats(project, svg=False, doPrint=True):
     return True
 
 def dPhenomeStats(project, activity=5, delta=3, svg=False, doPrint=True):
-    from ductape.phenome.biolog import getPlates, Experiment
+    from ductape.phenome.biolog import Experiment
+    from ductape.phenome.matrix import PhenomeMatrix
     from itertools import combinations
     
     # Which project are we talking about?
@@ -1044,8 +1069,8 @@ def dPhenomeStats(project, activity=5, delta=3, svg=False, doPrint=True):
     
     logger.info('Overall plots')
     # Setup an experiment
-    sigs = [s for s in biolog.getAllSignals()]
-    plates = [p for p in getPlates(sigs)]
+    # (read-only: the Well objects are not kept)
+    matrix = PhenomeMatrix.fromSignals(biolog.getAllSignals(), cache=False)
     
     isZero = biolog.atLeastOneZeroSubtracted()
     
@@ -1063,7 +1088,7 @@ def dPhenomeStats(project, activity=5, delta=3, svg=False, doPrint=True):
     
     zeroPlates = [x.plate_id for x in biolog.getZeroSubtractablePlates()]
     
-    exp = Experiment(plates=plates, zero=isZero,
+    exp = Experiment(matrix=matrix, zero=isZero,
                      category=category, categorder=categorder,
                      zeroPlates=zeroPlates)
     
@@ -1782,7 +1807,8 @@ def dPhenomeStats(project, activity=5, delta=3, svg=False, doPrint=True):
 
 def dPhenomeRings(project, delta=1, difforg=None, svg=False,
         param='activity'):
-    from ductape.phenome.biolog import getPlates, Experiment
+    from ductape.phenome.biolog import Experiment
+    from ductape.phenome.matrix import PhenomeMatrix
     
     # Which project are we talking about?
     kind = dSetKind(project)
@@ -1801,8 +1827,8 @@ def dPhenomeRings(project, delta=1, difforg=None, svg=False,
     biolog = Biolog(project)
     
     # Setup an experiment
-    sigs = [s for s in biolog.getAllSignals()]
-    plates = [p for p in getPlates(sigs)]
+    # (just the parameters are needed, the Well objects are not kept)
+    matrix = PhenomeMatrix.fromSignals(biolog.getAllWells(), cache=False)
     
     isZero = biolog.atLeastOneZeroSubtracted()
     
@@ -1820,7 +1846,7 @@ def dPhenomeRings(project, delta=1, difforg=None, svg=False,
     
     zeroPlates = [x.plate_id for x in biolog.getZeroSubtractablePlates()]
     
-    exp = Experiment(plates=plates, zero=isZero,
+    exp = Experiment(matrix=matrix, zero=isZero,
                      category=category, categorder=categorder,
                      zeroPlates=zeroPlates)
     
@@ -2669,12 +2695,9 @@ def getTotalNet(project, path_id=None):
     else:
         logger.debug('Building total metabolic network')
     
-    from ductape.kegg.net import MetabolicNet
+    from ductape.kegg.net import getGlobalNet
     
-    kegg = Kegg(project)
-
-    return MetabolicNet(kegg.getAllCompounds(path_id),
-                        kegg.getAllRPairsReacts(path_id=path_id))
+    return getGlobalNet(project).getNet(path_id)
 
 def getOrgNet(project, org_id, path_id=None, category=None):
     '''
@@ -2686,20 +2709,19 @@ def getOrgNet(project, org_id, path_id=None, category=None):
     else:
         logger.debug('Building total metabolic network for %s'%org_id)
         
-    from ductape.kegg.net import MetabolicNet, Compound
+    from ductape.kegg.net import getGlobalNet, Compound
     
     kegg = Kegg(project)
     
-    net = MetabolicNet(kegg.getAllCompounds(path_id),
-                       kegg.getAllRPairsReacts(org_id, path_id))
+    glob = getGlobalNet(project)
+    net = glob.getNet(path_id,
+                      reacts=glob.getOrgReacts(kegg.getReactMatrix(), org_id))
     
     if category:
         logger.debug('Fetching metabolic activity for category %s'%category)
         
         biolog = Biolog(project)
         vmax = biolog.getMaxActivity()
-
-        corg = {}
         
         # Filter by path?
         path_co = []
@@ -2709,23 +2731,15 @@ def getOrgNet(project, org_id, path_id=None, category=None):
                         if 'cpd:'+w.co_id in path_co]
         else:
             wells = [w for w in biolog.getAllCoByCateg(category)]
+        
+        # Mean activity of each compound (over its wells)
+        activity = biolog.getCoActivityMatrix(category, orgs=[org_id])
+        corg = {}
         for well in wells:
-            act = biolog.getAvgActivity(well.plate_id, well.well_id, org_id)
-            if act is not None:
-                # Some co_ids are present more than once
-                if well.co_id not in corg:
-                    corg[well.co_id] = []
-                corg[well.co_id].append(act)
-    
-        toremove = set()
-        for k, v in list(corg.items()):
-            mean = np.array(v).mean()
-            if not math.isnan(float(mean)):
-                corg[k] = mean
-            else:
-                toremove.add(k)
-        for k in toremove:
-            del corg[k]
+            act = activity.get(org_id, well.co_id)
+            # Some co_ids are present more than once
+            if act is not None and well.co_id not in corg:
+                corg[well.co_id] = act
         
         compounds = [Compound('cpd:'+k,kegg.getCompound('cpd:'+k).name,v,vmax) for k,v in list(corg.items())]
         net.addNodes(compounds)
@@ -2743,20 +2757,17 @@ def getMutNet(project, mut_id, mut_rpairs, path_id=None, category=None):
     else:
         logger.debug('Building total metabolic network for %s'%mut_id)
         
-    from ductape.kegg.net import MetabolicNet, Compound
+    from ductape.kegg.net import getGlobalNet, Compound
     
     kegg = Kegg(project)
     
-    net = MetabolicNet(kegg.getAllCompounds(path_id),
-                       mut_rpairs)
+    net = getGlobalNet(project).getNet(path_id, edges=mut_rpairs)
     
     if category:
         logger.debug('Fetching metabolic activity for category %s'%category)
         
         biolog = Biolog(project)
         vmax = biolog.getMaxActivity()
-
-        corg = {}
         
         # Filter by path?
         path_co = []
@@ -2766,23 +2777,15 @@ def getMutNet(project, mut_id, mut_rpairs, path_id=None, category=None):
                         if 'cpd:'+w.co_id in path_co]
         else:
             wells = [w for w in biolog.getAllCoByCateg(category)]
+        
+        # Mean activity of each compound (over its wells)
+        activity = biolog.getCoActivityMatrix(category, orgs=[mut_id])
+        corg = {}
         for well in wells:
-            act = biolog.getAvgActivity(well.plate_id, well.well_id, mut_id)
-            if act is not None:
-                # Some co_ids are present more than once
-                if well.co_id not in corg:
-                    corg[well.co_id] = []
-                corg[well.co_id].append(act)
-    
-        toremove = set()
-        for k, v in list(corg.items()):
-            mean = np.array(v).mean()
-            if not math.isnan(float(mean)):
-                corg[k] = mean
-            else:
-                toremove.add(k)
-        for k in toremove:
-            del corg[k]
+            act = activity.get(mut_id, well.co_id)
+            # Some co_ids are present more than once
+            if act is not None and well.co_id not in corg:
+                corg[well.co_id] = act
         
         compounds = [Compound('cpd:'+k,kegg.getCompound('cpd:'+k).name,v,vmax) for k,v in list(corg.items())]
         net.addNodes(compounds)
@@ -2809,13 +2812,12 @@ def getPanGenomeNet(project, dpangenome, pangenome='all', path_id=None, category
     else:
         logger.debug('Building total metabolic network for %s'%pangenome)
         
-    from ductape.kegg.net import MetabolicNet, Compound
+    from ductape.kegg.net import getGlobalNet, Compound
     from itertools import combinations
     
     kegg = Kegg(project)
     
-    net = MetabolicNet(kegg.getAllCompounds(path_id),
-                       dpangenome[pangenome])
+    net = getGlobalNet(project).getNet(path_id, edges=dpangenome[pangenome])
     
     if category:
         logger.debug('Fetching metabolic activity for category %s'%category)
@@ -2834,11 +2836,20 @@ def getPanGenomeNet(project, dpangenome, pangenome='all', path_id=None, category
         else:
             wells = [w for w in biolog.getAllCoByCateg(category)]
         
+        # Mean activity of each well (all the organisms at once)
+        if path_id:
+            activity = biolog.getWellActivityMatrix(category,
+                                        co_ids=[w.co_id for w in wells])
+        else:
+            activity = biolog.getWellActivityMatrix(category)
+        
         for well in wells:
-            acts = [x.avgact 
-                    for x in
-                    biolog.getAvgActivityEachOrg(well.plate_id,
-                                                 well.well_id)]
+            j = activity.keyIndex.get((well.plate_id, well.well_id))
+            if j is None:
+                continue
+            acts = [float(x) for x, n in zip(activity.values[:,j],
+                                             activity.counts[:,j])
+                    if n > 0]
             if len(acts) <= 1:
                 continue
             
@@ -2869,19 +2880,6 @@ def getPanGenomeNet(project, dpangenome, pangenome='all', path_id=None, category
         
     return net
 
-def writeNet(net, path, name):
-    '''
-    Save a network as a gml file in the desired location
-    '''
-    import networkx as nx
-    try:
-        nx.write_gml(net.net, os.path.join(path,name),
-                     nx.readwrite.gml.literal_stringizer)
-    except AttributeError:
-        # old version of networkx
-        nx.write_gml(net.net, os.path.join(path,name))
-    logger.debug('Saved network %s to %s'%(name, path))
-
 def writeCombinedPanGenome(dvalues):
     '''
     Write down the table with the combined pangenome data
@@ -2956,12 +2954,15 @@ def writeCombined(dvalues, orgs):
     fout.close()
     logger.info('Saved combined informations (%s)'%fname)
 
-def dNet(project, allorgs=False, allpaths=False):
+def dNet(project, allorgs=False, allpaths=False, formats=('npz',), ncpus=1):
     '''
     Metabolic network reconstruction and analysis
+    The networks are saved in the desired formats (npz and/or gml)
+    by ncpus worker processes
     '''
     from ductape.common.utils import makeRoom
     from ductape.kegg.kegg import avoidedPaths
+    from ductape.kegg.net import NetExporter
     
     kind = dSetKind(project)
     
@@ -2985,6 +2986,8 @@ def dNet(project, allorgs=False, allpaths=False):
         logger.warning('Phenome parametrization has not yet been performed!')
         phenome = False
     
+    exporter = NetExporter(formats, ncpus)
+    
     logger.info('Saving overall metabolic network')
     aNet = getTotalNet(project)
     dapNet = {}
@@ -2994,12 +2997,12 @@ def dNet(project, allorgs=False, allpaths=False):
         
     # Write
     npath = makeRoom('', 'metNet', 'KEGG')
-    writeNet(aNet, npath, 'ALL.gml')
+    exporter.write(aNet, npath, 'ALL')
     for k,v in list(dapNet.items()):
         if ':' in k:
             k = k.split(':')[1]
         if allpaths:
-            writeNet(v, npath, '%s.gml'%k)
+            exporter.write(v, npath, '%s'%k)
         
     if proj.isPanGenome() and kind == 'pangenome' and not allorgs:
         orgs = ['conserved', 'variable']
@@ -3042,7 +3045,7 @@ def dNet(project, allorgs=False, allpaths=False):
         for org in orgs:
             oNet[org] = getPanGenomeNet(project, dpangenome, org)
             npath = makeRoom('', 'metNet', org)
-            writeNet(oNet[org], npath, '%s.gml'%org)
+            exporter.write(oNet[org], npath, '%s'%org)
         
             
         flen.write('\t'.join( ['All', ''] +
@@ -3066,7 +3069,7 @@ def dNet(project, allorgs=False, allpaths=False):
                                        'all',
                                        category=categ.category)
                 npath = makeRoom('', 'metNet', 'all', scateg)
-                writeNet(oNet, npath, '%s_%s.gml'%('all', scateg))
+                exporter.write(oNet, npath, '%s_%s'%('all', scateg))
                 
                 fact.write('\t'.join( ['All', '', scateg] +
                               [str(oNet.mean())] + [str(oNet.std())]) + '\n')
@@ -3102,7 +3105,7 @@ def dNet(project, allorgs=False, allpaths=False):
                                                org_id, path.path_id)
                 if allpaths and not skip:
                     npath = makeRoom('', 'metNet', org_id)
-                    writeNet(oNet[org_id], npath, '%s_%s.gml'%(org_id, spath))
+                    exporter.write(oNet[org_id], npath, '%s_%s'%(org_id, spath))
             
             iAll = len(dapNet[path.path_id])
             iDisp = len(oNet['variable'].getDistinctReactions())
@@ -3155,8 +3158,8 @@ def dNet(project, allorgs=False, allpaths=False):
                     
                     if allpaths:
                         npath = makeRoom('', 'metNet', 'all', scateg)
-                        writeNet(oNet, npath,
-                                 '%s_%s_%s.gml'%('all', scateg, spath))
+                        exporter.write(oNet, npath,
+                                      '%s_%s_%s'%('all', scateg, spath))
                     
                     fact.write('\t'.join( [path.path_id, path.name, scateg] +
                                   [str(oNet.mean())] + [str(oNet.std())]) + '\n')
@@ -3226,7 +3229,7 @@ def dNet(project, allorgs=False, allpaths=False):
         for org_id in orgs:
             oNet[org_id] = getOrgNet(project, org_id)
             npath = makeRoom('', 'metNet', org_id)
-            writeNet(oNet[org_id], npath, '%s.gml'%org_id)
+            exporter.write(oNet[org_id], npath, '%s'%org_id)
             
         flen.write('\t'.join( ['All', ''] +
                               [str(len(aNet.getDistinctReactions()))] +
@@ -3257,7 +3260,7 @@ def dNet(project, allorgs=False, allpaths=False):
                                              org_id,
                                              category=categ.category)
                     npath = makeRoom('', 'metNet', org_id, scateg)
-                    writeNet(oNet[org_id], npath, '%s_%s.gml'%(org_id, scateg))
+                    exporter.write(oNet[org_id], npath, '%s_%s'%(org_id, scateg))
                 
                 fact.write('\t'.join( ['All', '', scateg] +
                               [str(oNet[x].mean()) for x in orgs] +
@@ -3294,7 +3297,7 @@ def dNet(project, allorgs=False, allpaths=False):
                 
                 if allpaths:
                     npath = makeRoom('', 'metNet', org_id)
-                    writeNet(oNet[org_id], npath, '%s_%s.gml'%(org_id, spath))
+                    exporter.write(oNet[org_id], npath, '%s_%s'%(org_id, spath))
             
             skip = False
             if sum( [len(oNet[x]) for x in oNet] ) == 0:
@@ -3353,8 +3356,8 @@ def dNet(project, allorgs=False, allpaths=False):
                                      %(path.path_id, org_id, scateg))
                                 continue
                             npath = makeRoom('', 'metNet', org_id, scateg)
-                            writeNet(oNet[org_id], npath,
-                                     '%s_%s_%s.gml'%(org_id, scateg, spath))
+                            exporter.write(oNet[org_id], npath,
+                                          '%s_%s_%s'%(org_id, scateg, spath))
                     
                     check = set([oNet[x].hasNodesWeight() for x in oNet])
                     if len(check) == 1 and check.pop() == False:
@@ -3432,13 +3435,13 @@ def dNet(project, allorgs=False, allpaths=False):
             
             oNet[ref_id] = getOrgNet(project, ref_id)
             npath = makeRoom('', 'metNet', ref_id)
-            writeNet(oNet[ref_id], npath, '%s.gml'%ref_id)
+            exporter.write(oNet[ref_id], npath, '%s'%ref_id)
             
             for mut_id in muts:
                 oNet[mut_id] = getMutNet(project, mut_id,
                                          list(ref_rpairs[ref_id][mut_id].values()))
                 npath = makeRoom('', 'metNet', mut_id)
-                writeNet(oNet[mut_id], npath, '%s.gml'%mut_id)
+                exporter.write(oNet[mut_id], npath, '%s'%mut_id)
             
         flen.write('\t'.join( ['All', ''] +
                               [str(len(aNet.getDistinctReactions()))] +
@@ -3470,7 +3473,7 @@ def dNet(project, allorgs=False, allpaths=False):
                     oNet[ref_id] = getOrgNet(project, ref_id,
                                              category=categ.category)
                     npath = makeRoom('', 'metNet', ref_id, scateg)
-                    writeNet(oNet[ref_id], npath, '%s_%s.gml'%(ref_id, scateg))
+                    exporter.write(oNet[ref_id], npath, '%s_%s'%(ref_id, scateg))
                     
                     for mut_id in muts:
                         oNet[mut_id] = getMutNet(project,
@@ -3478,7 +3481,7 @@ def dNet(project, allorgs=False, allpaths=False):
                                                  list(ref_rpairs[ref_id][mut_id].values()),
                                                  category=categ.category)
                         npath = makeRoom('', 'metNet', mut_id, scateg)
-                        writeNet(oNet[mut_id], npath, '%s_%s.gml'%(mut_id, scateg))
+                        exporter.write(oNet[mut_id], npath, '%s_%s'%(mut_id, scateg))
                 
                 fact.write('\t'.join( ['All', '', scateg] +
                               [str(oNet[x].mean()) for x in orgs] +
@@ -3521,7 +3524,7 @@ def dNet(project, allorgs=False, allpaths=False):
                 
                 if allpaths and not skip:
                     npath = makeRoom('', 'metNet', ref_id)
-                    writeNet(oNet[ref_id], npath, '%s_%s.gml'%(ref_id, spath))
+                    exporter.write(oNet[ref_id], npath, '%s_%s'%(ref_id, spath))
             
                 for mut_id in muts:
                     oNet[mut_id] = getMutNet(project,
@@ -3541,7 +3544,7 @@ def dNet(project, allorgs=False, allpaths=False):
                     
                     if allpaths and not skip:
                         npath = makeRoom('', 'metNet', mut_id)
-                        writeNet(oNet[mut_id], npath, '%s_%s.gml'%(mut_id, spath))
+                        exporter.write(oNet[mut_id], npath, '%s_%s'%(mut_id, spath))
             
             skip = False
             if sum( [len(oNet[x]) for x in oNet] ) == 0:
@@ -3609,8 +3612,8 @@ def dNet(project, allorgs=False, allpaths=False):
                             
                             if not skip:
                                 npath = makeRoom('', 'metNet', ref_id, scateg)
-                                writeNet(oNet[ref_id], npath,
-                                         '%s_%s_%s.gml'%(ref_id, scateg, spath))
+                                exporter.write(oNet[ref_id], npath,
+                                              '%s_%s_%s'%(ref_id, scateg, spath))
                         
                         for mut_id in muts:
                             oNet[mut_id] = getMutNet(project,
@@ -3631,8 +3634,8 @@ def dNet(project, allorgs=False, allpaths=False):
                                          %(path.path_id, mut_id, scateg))
                                     continue
                                 npath = makeRoom('', 'metNet', mut_id, scateg)
-                                writeNet(oNet[mut_id], npath,
-                                         '%s_%s_%s.gml'%(mut_id, scateg, spath))
+                                exporter.write(oNet[mut_id], npath,
+                                              '%s_%s_%s'%(mut_id, scateg, spath))
                     
                     check = set([oNet[x].hasNodesWeight() for x in oNet])
                     if len(check) == 1 and check.pop() == False:
@@ -3662,6 +3665,12 @@ def dNet(project, allorgs=False, allpaths=False):
     if phenome:
         logger.info('Metabolic network activity stats saved to %s'%sact)
     
+    if not exporter.close():
+        logger.warning('Some metabolic networks could not be saved')
+        return False
+    logger.info('Saved %d metabolic networks (%s)'%(exporter.written,
+                                                    ', '.join(formats)))
+    
     logger.info('Saving combined metrics and stats')
     if proj.isPanGenome() and kind == 'pangenome' and not allorgs:
         writeCombinedPanGenome(dPaths)
@@ -3669,60 +3678,167 @@ def dNet(project, allorgs=False, allpaths=False):
         writeCombined(dPaths, orgs)
     return True
 
-def getCombinedMatrix(phenome, genome, matrix, pthresh, gthresh):
+def getCompPathMatrix(kegg, paths):
     '''
-    Given a phenomic data and genomic data vectors and a data dictionary
-    return a plottable matrix w/ compounds on y-axis and w/ pathways on x-axis
+    Sparse compounds x pathways incidence matrix, restricted to the
+    provided pathways (columns, in the same order)
     
-    Labels are returned as well
+    Returns the compounds index (co_id --> row) and the matrix
+    '''
+    from scipy import sparse
     
-    thresholds are inclusive
+    pathIndex = dict([(p, j) for j, p in enumerate(paths)])
+    
+    coIndex = {}
+    links = set()
+    for link in kegg.getPathComps():
+        if link.path_id not in pathIndex:
+            continue
+        i = coIndex.setdefault(link.co_id, len(coIndex))
+        links.add((i, pathIndex[link.path_id]))
+    
+    rows = np.array([x[0] for x in links], dtype=np.int64)
+    cols = np.array([x[1] for x in links], dtype=np.int64)
+    matrix = sparse.csr_matrix((np.ones(len(links), dtype=bool),
+                                (rows, cols)),
+                               shape=(len(coIndex), len(paths)))
+    
+    return coIndex, matrix
+
+def getOrgsPathsContent(project, kegg, orgs):
+    '''
+    Organisms x pathways genomic content array (number of distinct reaction
+    IDs, -1 if the pathway has no reaction mapped in the organism)
+    
+    Returns the pathways (sorted), their names and the array
+    '''
+    from ductape.kegg.kegg import avoidedPaths
+    
+    mapped = [set([x.path_id for x in kegg.getMappedPathways(org_id)])
+              for org_id in orgs]
+    
+    paths = sorted(set().union(*mapped) - set(avoidedPaths))
+    pathIndex = dict([(p, j) for j, p in enumerate(paths)])
+    pnames = [kegg.getPathway(p).name for p in paths]
+    
+    content = np.empty((len(orgs), len(paths)), dtype=np.int64)
+    content.fill(-1)
+    for i, org_id in enumerate(orgs):
+        for p in mapped[i]:
+            if p not in pathIndex:
+                continue
+            content[i, pathIndex[p]] = len(getOrgNet(project, org_id,
+                                              path_id=p).getDistinctReactions())
+    
+    return paths, pnames, content
+
+def getCompoundsActivity(co_ids, values):
+    '''
+    Given the co_ids of a series of wells and an organisms x wells array
+    (NaN: not available), return the compounds and the organisms x compounds
+    mean value (NaN: no well available)
+    
+    The position of the first available well of each compound/organism
+    is returned as well, to keep the compounds in the wells order
     '''
-    import numpy as np
+    compounds = []
+    coIndex = {}
+    for co_id in co_ids:
+        if co_id not in coIndex:
+            coIndex[co_id] = len(compounds)
+            compounds.append(co_id)
+    idx = np.array([coIndex[x] for x in co_ids], dtype=np.int64)
+    
+    values = np.atleast_2d(values)
+    norgs, nwells = values.shape
+    size = norgs * len(compounds)
+    
+    org, well = np.nonzero(~np.isnan(values))
+    flat = org * len(compounds) + idx[well]
+    
+    sums = np.bincount(flat, weights=values[org, well], minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    first = np.empty(size, dtype=np.int64)
+    first.fill(nwells)
+    np.minimum.at(first, flat, well)
+    
+    means = np.empty(size)
+    means.fill(np.nan)
+    found = counts > 0
+    means[found] = sums[found] / counts[found]
+    
+    return (compounds, means.reshape(norgs, len(compounds)),
+            first.reshape(norgs, len(compounds)))
 
-    phenome = sorted([x for x in phenome if x[3] >= pthresh],
-                     key=lambda x: x[3], reverse=True)
-    pnames = [(x[1]+' '+x[0], x[2]) for x in phenome]
+def getCombinedPhenome(compounds, means, first, scateg, cnames):
+    '''
+    Phenomic data vector (co_id, category, name, value) of a single
+    organism, from the output of getCompoundsActivity
+    '''
+    found = np.nonzero(~np.isnan(means))[0]
+    found = found[np.argsort(first[found], kind='mergesort')]
+    
+    return [(compounds[j], scateg, cnames.get(compounds[j]), means[j])
+            for j in found]
+
+def getCombinedIncidence(phenome, coIndex, compPaths):
+    '''
+    Given a phenomic data vector and a compounds x pathways matrix
+    (see getCompPathMatrix) return only those compounds with at least one
+    pathway, together with their compounds x pathways incidence matrix
+    '''
+    rows = np.array([coIndex.get(x[0], -1) for x in phenome], dtype=np.int64)
+    known = np.nonzero(rows >= 0)[0]
     
-    genome = sorted([x for x in genome if x[2] >= 0],
-                    key=lambda x: x[2])
+    incidence = compPaths[rows[known], :]
+    mapped = np.diff(incidence.indptr) > 0
     
-    # Remove those pathways with no compound mapped
-    toRemove = []
-    for j in genome:
-        p = j[0]
-        
-        bOne = False
-        for i in phenome:
-            cid = i[0]
-            scateg = i[1]
+    return [phenome[i] for i in known[mapped]], incidence[mapped]
 
-            if p in matrix[cid][scateg]:
-                bOne = True
-                break
-        
-        if not bOne:
-            toRemove.append(j)
-    for i in toRemove:
-        genome.remove(i)
+def selectCombined(phenome, genome, matrix, pthresh):
+    '''
+    Given a phenomic data and genomic data vectors and their incidence
+    matrix, select the compounds to be combined (sorted by decreasing value)
+    and the pathways (sorted by increasing value)
     
-    gnames = [(x[0], x[1]) for x in genome]
+    Returns the selected compounds and pathways indexes and the dense
+    incidence matrix between them
+    
+    threshold is inclusive
+    '''
+    pvals = np.array([x[3] for x in phenome], dtype=float)
+    gvals = np.array([x[2] for x in genome], dtype=float)
+    
+    rows = np.nonzero(pvals >= pthresh)[0]
+    rows = rows[np.argsort(-pvals[rows], kind='mergesort')]
+    
+    cols = np.nonzero(gvals >= 0)[0]
+    cols = cols[np.argsort(gvals[cols], kind='mergesort')]
+    
+    sub = matrix[rows, :][:, cols].toarray()
+    
+    # Remove those pathways with no compound mapped
+    mapped = sub.any(axis=0)
+    
+    return rows, cols[mapped], sub[:, mapped]
 
-    matr=[]
-    for i in phenome:
-        vec = []
-        
-        cid = i[0]
-        scateg = i[1]
-        
-        for j in genome:
-            p = j[0]
-            if p in matrix[cid][scateg]:
-                vec.append(matrix[cid][scateg][p])
-            else:
-                vec.append(np.nan)
-        
-        matr.append(vec)
+def getCombinedMatrix(phenome, genome, matrix, pthresh, gthresh):
+    '''
+    Given a phenomic data and genomic data vectors and their incidence
+    matrix (see getCombinedIncidence) return a plottable matrix
+    w/ compounds on y-axis and w/ pathways on x-axis
+    
+    Labels are returned as well
+    
+    thresholds are inclusive
+    '''
+    rows, cols, sub = selectCombined(phenome, genome, matrix, pthresh)
+    
+    pvals = np.array([phenome[i][3] for i in rows], dtype=float)
+    matr = np.where(sub, pvals[:, np.newaxis], np.nan)
+    
+    pnames = [(phenome[i][1]+' '+phenome[i][0], phenome[i][2]) for i in rows]
+    gnames = [(genome[j][0], genome[j][1]) for j in cols]
     
     return matr, pnames, gnames
 
@@ -3733,9 +3849,8 @@ def writeCombinedMatrix(fhandle, matr, pnames, gnames):
     fhandle.write('\t'.join([' '] + [x[0] + ' ' + x[1] for x in gnames]))
     fhandle.write('\n')
     
-    for i in range(len(matr)):
-        v = matr[i]
-        fhandle.write('\t'.join([pnames[i][0] + ' ' + pnames[i][1]]
+    for pname, v in zip(pnames, matr):
+        fhandle.write('\t'.join([pname[0] + ' ' + pname[1]]
                                 + [str(x) for x in v]))
         fhandle.write('\n')
         
@@ -3796,55 +3911,25 @@ def getCombinations(matrix, phenome, genome, pthresh, gthresh):
     '''
     Generator to combination of compounds and pathways data
     '''
-    phenome = sorted([x for x in phenome if x[3] >= pthresh],
-                     key=lambda x: x[3], reverse=True)
-    
-    genome = sorted([x for x in genome if x[2] >= 0],
-                    key=lambda x: x[2])
-    
-    # Remove those pathways with no compound mapped
-    toRemove = []
-    for j in genome:
-        p = j[0]
-        
-        bOne = False
-        for i in phenome:
-            cid = i[0]
-            scateg = i[1]
-
-            if p in matrix[cid][scateg]:
-                bOne = True
-                break
-        
-        if not bOne:
-            toRemove.append(j)
-    for i in toRemove:
-        genome.remove(i)
-    
-    out = []
-    for i in phenome:
-        cid = i[0]
-        scateg = i[1]
-        cname = i[2]
-        pval = i[3]
-        
-        for j in genome:
-            p = j[0]
-            pname = j[1]
-            gval = j[2]
-            
-            if p in matrix[cid][scateg]:
-                out.append((scateg, cid, cname, p, pname, pval, gval))
-    
-    for o in sorted(out, key=lambda x: (x[5], x[6]), reverse=True):
-        yield o
+    rows, cols, sub = selectCombined(phenome, genome, matrix, pthresh)
+    
+    # Each compound/pathway pair, sorted by (phenomic, genomic) value
+    i, j = np.nonzero(sub)
+    i = rows[i]
+    j = cols[j]
+    pvals = np.array([phenome[x][3] for x in i], dtype=float)
+    gvals = np.array([genome[x][2] for x in j], dtype=float)
+    
+    for k in np.lexsort((-gvals, -pvals)):
+        cid, scateg, cname, pval = phenome[i[k]]
+        p, pname, gval = genome[j[k]]
+        yield (scateg, cid, cname, p, pname, pval, gval)
 
 def dCombine(project, allorgs=False, pthresh=5, doPrint=True):
     '''
     Prepare a table/heatmap focused on compound activity/genetic content
     '''
     from ductape.kegg.kegg import avoidedPaths
-    from itertools import combinations
     
     kind = dSetKind(project)
     
@@ -3867,84 +3952,38 @@ def dCombine(project, allorgs=False, pthresh=5, doPrint=True):
         logger.warning('Phenome parametrization has not yet been performed!')
         return True
     
+    cnames = dict([(x.co_id, x.name) for x in kegg.getAllCompounds()])
+    
+    # Wells of each category, with their activity for each organism
+    categs = []
+    for categ in biolog.getCategs(True):
+        category = categ.category
+        scateg = categ.category.replace(' ','_').replace('&','and')
+        
+        wells = [w for w in biolog.getAllCoByCateg(category)]
+        categs.append((scateg,
+                       ['cpd:' + w.co_id for w in wells],
+                       [(w.plate_id, w.well_id) for w in wells],
+                       biolog.getWellActivityMatrix(category)))
+    
     if proj.isPanGenome() and kind == 'pangenome' and not allorgs:
         logger.info('Analyzing combined data from a pangenome')
-           
-        matr = {}
+        
         cos = []
         gens = []
         
         # Start from the pathways with at least one reaction mapped
-        paths = set([x.path_id for x in kegg.getMappedPathways()])
-        for p in avoidedPaths:
-            try:
-                paths.remove(p)
-            except:pass
-           
-        # Cycle through category/compound to build the matrix
-        for categ in biolog.getCategs(True):
-            category = categ.category
-            scateg = categ.category.replace(' ','_').replace('&','and')
-
-            corg = {}
-            
-            wells = [w for w in biolog.getAllCoByCateg(category)]
-            
-            for well in wells:
-                co_id = 'cpd:' + well.co_id
-                
-                acts = [x.avgact 
-                        for x in
-                        biolog.getAvgActivityEachOrg(well.plate_id,
-                                                     well.well_id)]
-                if len(acts) <= 1:
-                    continue
-                
-                diffs = []
-                for a, a1 in combinations(acts, 2):
-                    diffs.append( abs(a - a1) )
-                    
-                avgdiff = np.array(diffs).mean()
-                
-                # Some co_ids are present more than once
-                if co_id not in corg:
-                    corg[co_id] = []
-                corg[co_id].append(avgdiff)
-            
-            toremove = set()
-            for k, v in list(corg.items()):
-                mean = np.array(v).mean()
-                if not math.isnan(float(mean)):
-                    corg[k] = mean
-                else:
-                    toremove.add(k)
-            for k in toremove:
-                del corg[k]
-                
-            # Insert the compounds inside the matrix
-            for co_id in corg:
-                # Pathways mapped to this co_id
-                # only those with reactions will be used
-                for p in kegg.getCompPaths(co_id):
-                    if p.path_id not in paths:continue
-                    
-                    matr[co_id] = matr.get(co_id, {})
-                    matr[co_id][scateg] = matr[co_id].get(scateg, {})
-                    matr[co_id][scateg][p.path_id] = matr[co_id][scateg].get(
-                                                         p.path_id, corg[co_id])
-                
-                # Add the phenotypic variability
-                if co_id in matr and scateg in matr[co_id]:
-                    cname = kegg.getCompound(co_id).name
-                    cos.append((co_id, scateg, cname, corg[co_id]))
+        paths = sorted(set([x.path_id for x in kegg.getMappedPathways()]) -
+                       set(avoidedPaths))
         
         # Get the genetic variability
-        for p in paths:
+        gcols = []
+        for j, p in enumerate(paths):
             allr = [r for r in kegg.getMappedRPairsReact(p)]
             ecore = [r for r in kegg.getConservedRPairsReact(p)]
             edisp = [r for r in kegg.getVariableRPairsReact(p)]
             dpangenome = {'all': allr,'conserved':ecore, 'variable':edisp}
-                
+            
             totNet = len(getPanGenomeNet(project,
                                      dpangenome, 'all',
                                      path_id=p).getDistinctReactions())
@@ -3955,11 +3994,39 @@ def dCombine(project, allorgs=False, pthresh=5, doPrint=True):
             pname = kegg.getPathway(p).name
             try:
                 gens.append((p, pname, float(dispNet)/float(totNet)))
+                gcols.append(j)
             except:pass
         
+        coIndex, compPaths = getCompPathMatrix(kegg, paths)
+        
+        # Cycle through category/compound to build the matrix
+        for scateg, co_ids, keys, activity in categs:
+            values = activity.getValues(activity.orgs, keys)
+            
+            # Average activity difference between each pair of organisms
+            diffs = np.empty(len(keys))
+            diffs.fill(np.nan)
+            for i in range(len(keys)):
+                acts = values[~np.isnan(values[:, i]), i]
+                if len(acts) <= 1:
+                    continue
+                
+                a, a1 = np.triu_indices(len(acts), 1)
+                diffs[i] = np.abs(acts[a] - acts[a1]).mean()
+            
+            # Some co_ids are present more than once
+            compounds, means, first = getCompoundsActivity(co_ids, diffs)
+            cos += getCombinedPhenome(compounds, means[0], first[0],
+                                      scateg, cnames)
+        
+        # Add the phenotypic variability
+        # (only compounds in the pathways with reactions will be used)
+        cos, matr = getCombinedIncidence(cos, coIndex, compPaths)
+        matr = matr[:, gcols]
+        
         matr_all, phen_all, gen_all = getCombinedMatrix(cos, gens, matr,
                                                         0, 0)
-            
+        
         # Write the whole matrix
         fname = 'combined_matrix_full.tsv'
         fout = open(fname, 'w')
@@ -4027,7 +4094,7 @@ def dCombine(project, allorgs=False, pthresh=5, doPrint=True):
                 print(line)
             else:
                 logger.info(line)
-        
+    
     elif kind == 'single' or allorgs and not kind == 'mutants':
         logger.info('Analyzing combined data for each organisms')
         
@@ -4035,70 +4102,32 @@ def dCombine(project, allorgs=False, pthresh=5, doPrint=True):
         
         orgs = [org.org_id for org in organism.getAll()]
         
-        for org_id in orgs:
-            # Start from the pathways with at least one reaction mapped
-            paths = set([x.path_id for x in kegg.getMappedPathways(org_id)])
-            for p in avoidedPaths:
-                try:
-                    paths.remove(p)
-                except:pass
+        # Get the genetic content
+        # (pathways with at least one reaction mapped)
+        paths, pnames, content = getOrgsPathsContent(project, kegg, orgs)
+        coIndex, compPaths = getCompPathMatrix(kegg, paths)
+        
+        # Organisms x compounds activity, for each category
+        # (some co_ids are present more than once)
+        activity = [(scateg,
+                     getCompoundsActivity(co_ids,
+                                          matrix.getValues(orgs, keys)))
+                    for scateg, co_ids, keys, matrix in categs]
+        
+        for i, org_id in enumerate(orgs):
+            mapped = np.nonzero(content[i] >= 0)[0]
+            gens = [(paths[j], pnames[j], int(content[i, j])) for j in mapped]
             
-            matr = {}
             cos = []
-            gens = []
-            # Cycle through category/compound to build the matrix
-            for categ in biolog.getCategs(True):
-                category = categ.category
-                scateg = categ.category.replace(' ','_').replace('&','and')
-    
-                corg = {}
-        
-                # Filter by path?
-                wells = [w for w in biolog.getAllCoByCateg(category)]
-                for well in wells:
-                    co_id = 'cpd:' + well.co_id
-                    
-                    act = biolog.getAvgActivity(well.plate_id, well.well_id,
-                                                org_id)
-                    if act is not None:
-                        # Some co_ids are present more than once
-                        if co_id not in corg:
-                            corg[co_id] = []
-                        corg[co_id].append(act)
+            for scateg, (compounds, means, first) in activity:
+                cos += getCombinedPhenome(compounds, means[i], first[i],
+                                          scateg, cnames)
             
-                toremove = set()
-                for k, v in list(corg.items()):
-                    mean = np.array(v).mean()
-                    if not math.isnan(float(mean)):
-                        corg[k] = mean
-                    else:
-                        toremove.add(k)
-                for k in toremove:
-                    del corg[k]
-                
-                # Insert the compounds inside the matrix
-                for co_id in corg:
-                    # Pathways mapped to this co_id
-                    # only those with reactions will be used
-                    for p in kegg.getCompPaths(co_id):
-                        if p.path_id not in paths:continue
-                        
-                        matr[co_id] = matr.get(co_id, {})
-                        matr[co_id][scateg] = matr[co_id].get(scateg, {})
-                        matr[co_id][scateg][p.path_id] = matr[co_id][scateg].get(
-                                                             p.path_id, corg[co_id])
-                    
-                    # Add the phenotypic variability
-                    if co_id in matr and scateg in matr[co_id]:
-                        cname = kegg.getCompound(co_id).name
-                        cos.append((co_id, scateg, cname, corg[co_id]))
+            # Add the phenotypic variability
+            # (only compounds in the pathways with reactions will be used)
+            cos, matr = getCombinedIncidence(cos, coIndex,
+                                             compPaths[:, mapped])
             
-            # Get the genetic content
-            for p in paths:
-                pname = kegg.getPathway(p).name
-                gens.append((p, pname,
-                     len(getOrgNet(project, org_id, path_id=p).getDistinctReactions())))
-                
             matr_all, phen_all, gen_all = getCombinedMatrix(cos, gens, matr,
                                                         0, 0)
             
@@ -4121,156 +4150,119 @@ def dCombine(project, allorgs=False, pthresh=5, doPrint=True):
                            vmax=biolog.getMaxActivity())
             
             logger.info('Saved combined genome/phenome plot (%s)'%fname)
-        
+    
     elif kind == 'mutants' or allorgs:
         logger.info('Analyzing combined data for each mutant w/r/t the wild-type')
-    
+        
         organism = Organism(project)
         
         refs = [org.org_id
                     for org in organism.getAll()
                     if not organism.isMutant(org.org_id)]
-        
-        for ref_id in refs:
-            muts = [x for x in organism.getOrgMutants(ref_id)]
+        pairs = [(ref_id, mut_id)
+                 for ref_id in refs
+                 for mut_id in organism.getOrgMutants(ref_id)]
+        
+        # Get the genetic content of each mutant
+        # (pathways with at least one reaction mapped)
+        paths, pnames, content = getOrgsPathsContent(project, kegg,
+                                                     [x[1] for x in pairs])
+        coIndex, compPaths = getCompPathMatrix(kegg, paths)
+        
+        # Wild-type - mutant activity difference, for each category
+        # (some co_ids are present more than once)
+        activity = []
+        for scateg, co_ids, keys, matrix in categs:
+            refacts = matrix.getValues([x[0] for x in pairs], keys)
+            mutacts = matrix.getValues([x[1] for x in pairs], keys)
+            activity.append((scateg,
+                             getCompoundsActivity(co_ids, refacts - mutacts)))
+        
+        for i, (ref_id, mut_id) in enumerate(pairs):
+            mapped = np.nonzero(content[i] >= 0)[0]
+            gens = [(paths[j], pnames[j], int(content[i, j])) for j in mapped]
             
-            for mut_id in muts:
-                # Start from the pathways with at least one reaction mapped
-                paths = set([x.path_id for x in kegg.getMappedPathways(mut_id)])
-                for p in avoidedPaths:
-                    try:
-                        paths.remove(p)
-                    except:pass
-                
-                matr = {}
-                cos = []
-                gens = []
-                # Cycle through category/compound to build the matrix
-                for categ in biolog.getCategs(True):
-                    category = categ.category
-                    scateg = categ.category.replace(' ','_').replace('&','and')
-
-                    corg = {}
-        
-                    # Filter by path?
-                    wells = [w for w in biolog.getAllCoByCateg(category)]
-                    for well in wells:
-                        co_id = 'cpd:' + well.co_id
-                        refact = biolog.getAvgActivity(well.plate_id, well.well_id,
-                                                       ref_id)
-                        act = biolog.getAvgActivity(well.plate_id, well.well_id,
-                                                    mut_id)
-                        if act is not None and refact is not None:
-                            # Some co_ids are present more than once
-                            if co_id not in corg:
-                                corg[co_id] = []
-                            corg[co_id].append(refact-act)
-                
-                    toremove = set()
-                    for k, v in list(corg.items()):
-                        mean = np.array(v).mean()
-                        if not math.isnan(float(mean)):
-                            corg[k] = mean
-                        else:
-                            toremove.add(k)
-                    for k in toremove:
-                        del corg[k]
-                    
-                    # Insert the compounds inside the matrix
-                    for co_id in corg:
-                        # Pathways mapped to this co_id
-                        # only those with reactions will be used
-                        for p in kegg.getCompPaths(co_id):
-                            if p.path_id not in paths:continue
-                            
-                            matr[co_id] = matr.get(co_id, {})
-                            matr[co_id][scateg] = matr[co_id].get(scateg, {})
-                            matr[co_id][scateg][p.path_id] = matr[co_id][scateg].get(
-                                                                 p.path_id, corg[co_id])
-                        
-                        # Add the phenotypic variability
-                        if co_id in matr and scateg in matr[co_id]:
-                            cname = kegg.getCompound(co_id).name
-                            cos.append((co_id, scateg, cname, corg[co_id]))
-                
-                # Get the genetic content
-                for p in paths:
-                    pname = kegg.getPathway(p).name
-                    gens.append((p, pname,
-                         len(getOrgNet(project, mut_id,
-                                       path_id=p).getDistinctReactions())))
-                    
-                matr_all, phen_all, gen_all = getCombinedMatrix(cos, gens, matr,
-                                                        0, 0)
+            cos = []
+            for scateg, (compounds, means, first) in activity:
+                cos += getCombinedPhenome(compounds, means[i], first[i],
+                                          scateg, cnames)
             
-                # Write the whole matrix
-                fname = 'combined_matrix_full_%s.tsv'%mut_id
-                fout = open(fname, 'w')
-                fout.write('# Combined matrix for the %s mutant (WT %s)\n'%(mut_id,
-                                                                            ref_id))
-                fout.write('# Each cell contains the difference on the AV '+
-                           ' between the mutant and the wild-type\n')
-                fout.write('#  Compounds are sorted by diffAV, '+
-                           ' pathways by genomic content '+
-                           '(numer of distinct mutated reaction IDs)\n')
-                writeCombinedMatrix(fout, matr_all, phen_all, gen_all)
-                
-                logger.info('Saved overall combined genome/phenome matrix (%s)'%fname)
-                
-                # Reduced matrix
-                matr_comb, phen, gen = getCombinedMatrix(cos, gens, matr,
-                                                    pthresh, 0.0000001)
-                
-                # Write the matrix
-                fname = 'combined_matrix_%s.tsv'%mut_id
-                fout = open(fname, 'w')
-                fout.write('# Combined matrix for the %s mutant (WT %s)\n'%(mut_id,
-                                                                            ref_id))
-                fout.write('# Each cell contains the difference on the AV '+
-                           ' between the mutant and the wild-type\n')
-                fout.write('#  Compounds are sorted by diffAV, '+
-                           ' pathways by genomic content '+
-                           '(numer of distinct mutated reaction IDs)\n')
-                fout.write('#  diffAV threshold: %f\n'%pthresh)
-                writeCombinedMatrix(fout, matr_comb, phen, gen)
-                
-                logger.info('Saved reduced combined pangenome matrix (%s)'%fname)
-                
-                # Plot!
-                fname = 'combined_%s.png'%mut_id
-                plotCombinedMatrix(fname, matr_comb, phen, gen, cmap=cm.PuOr,
-                               vmin=-biolog.getMaxActivity(),
-                               vmax=biolog.getMaxActivity(),
-                               xlabel='Pathways containing the mutated reactions',
-                               ylabel='Phenotypic variability w/r/t wild-type (diffAV)')
-                
-                logger.info('Saved combined genome/phenome plot (%s)'%fname)
-                
-                # Print relevant combinations
-                logger.info('Relevant combined data')
+            # Add the phenotypic variability
+            # (only compounds in the pathways with reactions will be used)
+            cos, matr = getCombinedIncidence(cos, coIndex,
+                                             compPaths[:, mapped])
+            
+            matr_all, phen_all, gen_all = getCombinedMatrix(cos, gens, matr,
+                                                    0, 0)
+            
+            # Write the whole matrix
+            fname = 'combined_matrix_full_%s.tsv'%mut_id
+            fout = open(fname, 'w')
+            fout.write('# Combined matrix for the %s mutant (WT %s)\n'%(mut_id,
+                                                                        ref_id))
+            fout.write('# Each cell contains the difference on the AV '+
+                       ' between the mutant and the wild-type\n')
+            fout.write('#  Compounds are sorted by diffAV, '+
+                       ' pathways by genomic content '+
+                       '(numer of distinct mutated reaction IDs)\n')
+            writeCombinedMatrix(fout, matr_all, phen_all, gen_all)
+            
+            logger.info('Saved overall combined genome/phenome matrix (%s)'%fname)
+            
+            # Reduced matrix
+            matr_comb, phen, gen = getCombinedMatrix(cos, gens, matr,
+                                                pthresh, 0.0000001)
+            
+            # Write the matrix
+            fname = 'combined_matrix_%s.tsv'%mut_id
+            fout = open(fname, 'w')
+            fout.write('# Combined matrix for the %s mutant (WT %s)\n'%(mut_id,
+                                                                        ref_id))
+            fout.write('# Each cell contains the difference on the AV '+
+                       ' between the mutant and the wild-type\n')
+            fout.write('#  Compounds are sorted by diffAV, '+
+                       ' pathways by genomic content '+
+                       '(numer of distinct mutated reaction IDs)\n')
+            fout.write('#  diffAV threshold: %f\n'%pthresh)
+            writeCombinedMatrix(fout, matr_comb, phen, gen)
+            
+            logger.info('Saved reduced combined pangenome matrix (%s)'%fname)
+            
+            # Plot!
+            fname = 'combined_%s.png'%mut_id
+            plotCombinedMatrix(fname, matr_comb, phen, gen, cmap=cm.PuOr,
+                           vmin=-biolog.getMaxActivity(),
+                           vmax=biolog.getMaxActivity(),
+                           xlabel='Pathways containing the mutated reactions',
+                           ylabel='Phenotypic variability w/r/t wild-type (diffAV)')
+            
+            logger.info('Saved combined genome/phenome plot (%s)'%fname)
+            
+            # Print relevant combinations
+            logger.info('Relevant combined data')
+            
+            header = '\t'.join( ['category', 'co_id', 'name', 
+                                    'path_id', 'name',
+                                    'diffAV',
+                                    'distinct mutated reaction IDs'] )
+            if doPrint:
+                print(header)
+            else:
+                logger.info(header)
+            
+            for scateg, cid, cname, p, pname, pval, gval in getCombinations(matr,
+                                                                    cos,
+                                                                    gens,
+                                                                    pthresh,
+                                                                    0.0000001):
+                line = '\t'.join( [str(x)
+                                   for x in [scateg, cid, cname,
+                                             p, pname, pval, gval]] )
                 
-                header = '\t'.join( ['category', 'co_id', 'name', 
-                                        'path_id', 'name',
-                                        'diffAV',
-                                        'distinct mutated reaction IDs'] )
                 if doPrint:
-                    print(header)
+                    print(line)
                 else:
-                    logger.info(header)
-                
-                for scateg, cid, cname, p, pname, pval, gval in getCombinations(matr,
-                                                                        cos,
-                                                                        gens,
-                                                                        pthresh,
-                                                                        0.0000001):
-                    line = '\t'.join( [str(x)
-                                       for x in [scateg, cid, cname,
-                                                 p, pname, pval, gval]] )
-                    
-                    if doPrint:
-                        print(line)
-                    else:
-                        logger.info(line)
+                    logger.info(line)
     
     return True
 
@@ -4830,10 +4822,35 @@ def touchProject(project):
         return False
     else:
         proj = Project(project)
+        if not proj.isUpToDate():
+            logger.info('The project was created with an older version: '+
+                        'upgrading it')
+            try:
+                if not dUpgrade(project):
+                    return False
+            except Exception as e:
+                logger.error('Could not upgrade the project (%s)'%str(e))
+                logger.error('Run "dape upgrade" to try again')
+                return False
         proj.updateLast()
         logger.debug('%s'%str(proj))
         return True
 
+def dUpgrade(project):
+    '''
+    Upgrade the project to the current storage schema
+    '''
+    db = DBBase(project)
+    version = db.getSchema()
+    if db.isUpToDate():
+        logger.info('Project already up to date (schema version %d)'%version)
+        return True
+    
+    steps = db.upgrade()
+    logger.info('Project upgraded (schema version %d to %d)'%(version,
+                                                              version+steps))
+    return True
+
 def prepareDir(wdir, tdir):
     '''
     Prepare the temp directory
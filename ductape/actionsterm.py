@@ -77,6 +77,7 @@ def fetchKegg(project, keeptrying=False):
         kegg.addReactRPairs(knet.result.reactrpair)
         kegg.addRPairReacts(knet.result.rpairreact)
         logger.info('Added Kegg links')
+        kegg.buildMainEdges()
         # HTML maps
         kegg.addPathHtml(knet.result.pathmaps)
         logger.info('Added Kegg maps')
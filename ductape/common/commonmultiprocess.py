@@ -16,6 +16,10 @@ if sys.version_info[0] < 3:
         return None
     multiprocessing.get_context = t
 import time
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
 
 # Consumer borrowed from http://broadcast.oreilly.com/
 # EINTR fix borrowed from Boyd Waters
@@ -76,7 +80,7 @@ class SafeQueue(Queue):
         e = IOError('Unrecoverable error')
         raise e
 
-    def get(self):
+    def get(self, block=True, timeout=None):
         '''
         Get the element in the queue
         Raises an exception if it's empty or if too many errors are
@@ -85,7 +89,7 @@ class SafeQueue(Queue):
         dt = 1e-3
         while dt < 1:
             try:
-                element = Queue.get(self)
+                element = Queue.get(self, block, timeout)
                 return element
             except IOError:
                 logger.warning('IOError encountered in SafeQueue get()')
@@ -118,6 +122,51 @@ class SafeQueue(Queue):
         e = IOError('Unrecoverable error')
         raise e
 
+class Future(object):
+    '''
+    Class Future
+    Result of a task submitted to a CommonMultiProcess pool
+    '''
+    def __init__(self, taskid):
+        self.taskid = taskid
+        self._done = False
+        self._result = None
+        self._error = None
+    
+    def _set(self, result, error=None):
+        self._result = result
+        self._error = error
+        self._done = True
+    
+    def done(self):
+        return self._done
+    
+    def result(self):
+        '''
+        Returns the task result
+        Raises an exception if the task is not done or if it has failed
+        '''
+        if not self._done:
+            raise Exception('Task %d is not done yet'%self.taskid)
+        if self._error is not None:
+            raise Exception(self._error)
+        return self._result
+
+class PoolTask(object):
+    '''
+    Class PoolTask
+    Wraps a task sent to the pool, so that its result can be tracked
+    '''
+    def __init__(self, taskid, task):
+        self.taskid = taskid
+        self.task = task
+    
+    def __call__(self):
+        try:
+            return (self.taskid, self.task(), None)
+        except Exception as e:
+            return (self.taskid, None, str(e))
+
 class Consumer(multiprocessing.Process):
     
     def __init__(self, 
@@ -131,7 +180,6 @@ class Consumer(multiprocessing.Process):
     def run(self):
         while True:
             next_task = self.task_queue.get()
-            self.sleeper.sleep(0.01)
             if next_task is None:
                 # Poison pill means we should exit
                 break
@@ -159,6 +207,10 @@ class CommonMultiProcess(CommonThread):
         self._parallelresults = SafeQueue()
         self.sleeper = SafeSleep()
         
+        # Persistent pool
+        self._pool = False
+        self._futures = {}
+        
         # ID
         self._unique = 0
         
@@ -166,9 +218,11 @@ class CommonMultiProcess(CommonThread):
         self._unique += 1
         return self._unique
     
-    def initiateParallel(self):
+    def initiateParallel(self, workers=None):
+        if workers is None:
+            workers = self.ncpus
         self._parallel = [Consumer(self._paralleltasks,self._parallelresults)
-                          for x in range(self.ncpus)]
+                          for x in range(workers)]
         for consumer in self._parallel:
             consumer.start()
             
@@ -183,5 +237,95 @@ class CommonMultiProcess(CommonThread):
         return True
 
     def killParallel(self):
+        if self._parallel is None:
+            return
         for consumer in self._parallel:
             consumer.terminate()
+        self._pool = False
+        self._futures = {}
+
+    def startPool(self, workers=None):
+        '''
+        Starts a persistent pool of workers, to be fed through submit()
+        Workers are spawned only once, until stopPool() is called
+        (default number of workers: ncpus)
+        '''
+        if self._pool:
+            return
+        self.initiateParallel(workers)
+        self._pool = True
+    
+    def submit(self, task):
+        '''
+        Sends a task to the pool and returns its Future
+        '''
+        if not self._pool:
+            self.startPool()
+        future = Future(self.getUniqueID())
+        self._futures[future.taskid] = future
+        self._paralleltasks.put(PoolTask(future.taskid, task))
+        return future
+    
+    def collect(self, timeout=None):
+        '''
+        Waits for a result from the pool and returns the completed Future
+        Returns None if nothing has arrived before the timeout
+        '''
+        try:
+            taskid, result, error = self._parallelresults.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        future = self._futures.pop(taskid)
+        future._set(result, error)
+        return future
+    
+    def completed(self, futures, timeout=0.1):
+        '''
+        Generator to the futures, as soon as they are done
+        Stops early if we have been killed or if a worker has died
+        (some futures will then be left undone)
+        '''
+        pending = set([f.taskid for f in futures])
+        for future in futures:
+            if future.done():
+                pending.discard(future.taskid)
+                yield future
+        
+        while len(pending) > 0:
+            if self.killed:
+                logger.debug('Exiting for a kill signal')
+                return
+            future = self.collect(timeout)
+            if future is None:
+                if not all([c.is_alive() for c in self._parallel]):
+                    logger.error('A worker has died unexpectedly')
+                    return
+                continue
+            if future.taskid in pending:
+                pending.discard(future.taskid)
+                yield future
+    
+    def wait(self, futures, timeout=0.1):
+        '''
+        Blocks until all the futures are done
+        Returns False if we have been killed or if a worker has died
+        '''
+        for future in self.completed(futures, timeout):
+            pass
+        return all([f.done() for f in futures])
+    
+    def stopPool(self):
+        '''
+        Stops the persistent pool
+        (pending tasks are discarded if killed or if some result is missing)
+        '''
+        if not self._pool:
+            return
+        if self.killed or len(self._futures) > 0:
+            self.killParallel()
+        else:
+            self.addPoison()
+            for consumer in self._parallel:
+                consumer.join()
+        self._pool = False
+        self._futures = {}
@@ -6,10 +6,13 @@ Genome library
 
 Classes to handle Blast analysis against a local database
 """
+import hashlib
 import logging
 import os
+import shutil
 import subprocess
 import sys
+import time
 if sys.version_info[0] < 3:
     from StringIO import StringIO # Python 2
 else:
@@ -22,16 +25,46 @@ __author__ = "Marco Galardini"
 
 logger = logging.getLogger('ductape.blast')
 
+################################################################################
+# Constants
+
+# Columns of the tabular output
+tabularFields = ['qseqid', 'qlen', 'sseqid', 'slen',
+                 'nident', 'length', 'gaps',
+                 'qstart', 'qend', 'sstart', 'send',
+                 'evalue', 'bitscore', 'stitle']
+tabularFormat = '6 ' + ' '.join(tabularFields)
+
+# Blast DBs cache, shared by all the projects
+# Default settings, can be overridden by environment variables
+# DUCTAPE_CACHE: cache directory ("off" to disable the cache)
+# DUCTAPE_BLASTDB_SIZE: maximum size of the cached Blast DBs (MB)
+defaultDir = os.path.join(os.path.expanduser('~'), '.ductape')
+defaultDBSize = 4096
+
+# Blast alias files extensions
+aliasExt = {'prot':'.pal', 'nucl':'.nal'}
+
 ################################################################################
 # Classes
 
 # Useful class for parsing
-class BlastHit:
-    def __init__(self,query,align,hsp):
+class BlastHit(object):
+    __slots__ = ['query', 'query_id', 'query_len',
+                 'hit', 'hit_desc', 'hit_len',
+                 'identity', 'align_len', 'mismatches', 'gaps',
+                 'query_start', 'query_end', 'subjct_start', 'subjct_end',
+                 'evalue', 'bits']
+    
+    def __init__(self,query=None,align=None,hsp=None):
         '''
         Query, Alignment and Hsp are all Biopython objects derived from
         Blast results parsing
+        (if not provided the hit is left empty, see fromTabular)
         '''
+        if query is None:
+            return
+        
         self.query = query.query
         self.query_id = query.query.split(' ')[0]
         self.query_len = int(query.query_length)
@@ -48,6 +81,38 @@ class BlastHit:
         self.subjct_end = int(hsp.sbjct_end)
         self.evalue = float(hsp.expect)
         self.bits = float(hsp.bits)
+    
+    @classmethod
+    def fromTabular(cls, line):
+        '''
+        Builds the hit from a line of the tabular output
+        (see tabularFormat)
+        '''
+        s = line.rstrip('\r\n').split('\t', len(tabularFields) - 1)
+        
+        hit = cls()
+        hit.query = s[0]
+        hit.query_id = s[0]
+        hit.query_len = int(s[1])
+        hit.hit = s[2]
+        hit.hit_len = int(s[3])
+        identities = int(s[4])
+        hit.align_len = int(s[5])
+        hit.gaps = int(s[6])
+        hit.identity = float(identities) / float(hit.align_len)
+        hit.mismatches = hit.align_len - identities - hit.gaps
+        hit.query_start = int(s[7])
+        hit.query_end = int(s[8])
+        hit.subjct_start = int(s[9])
+        hit.subjct_end = int(s[10])
+        hit.evalue = float(s[11])
+        hit.bits = float(s[12])
+        if len(s) > 13:
+            hit.hit_desc = s[13]
+        else:
+            hit.hit_desc = ''
+        
+        return hit
         
     def getHomologyIndex(self):
         '''
@@ -84,10 +149,178 @@ class BlastHit:
         else:
             return None
         
+class BlastDBCache(object):
+    '''
+    Class BlastDBCache
+    Keeps the Blast DBs in a directory, using the hash of the sequences
+    file (and of the DB options) as key
+    A cached DB is made available at the requested path through a
+    Blast alias file, so it is built just once
+    Before a new DB is built the least recently used DBs are removed to
+    keep the cache under maxsize (MB); the DBs used by the current run
+    are never removed
+    '''
+    def __init__(self, path=None, maxsize=defaultDBSize, enabled=True):
+        if path is None:
+            path = os.path.join(defaultDir, 'blastdb')
+        self.path = path
+        self.maxsize = int(float(maxsize) * 1024 * 1024)
+        self.enabled = bool(enabled)
+        
+        # DBs used by this run (and by the other processes since then)
+        self.used = set()
+        self.started = time.time()
+        
+        if self.enabled:
+            try:
+                if not os.path.exists(self.path):
+                    os.makedirs(self.path)
+            except OSError as e:
+                logger.warning('Could not create the Blast DB cache %s (%s)'%
+                               (self.path, str(e)))
+                self.enabled = False
+    
+    def getKey(self, seqFile, dbType, parseIDs, title):
+        '''
+        Hash of the sequences file and of the DB options
+        '''
+        h = hashlib.sha1()
+        h.update(('%s\t%s\t%s\n'%(dbType, bool(parseIDs),
+                                    title)).encode('utf-8'))
+        f = open(seqFile, 'rb')
+        try:
+            while True:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                h.update(chunk)
+        finally:
+            f.close()
+        return h.hexdigest()
+    
+    def getDB(self, key):
+        '''
+        Returns the path of a cached DB (None if missing)
+        '''
+        done = os.path.join(self.path, key, 'done')
+        if not os.path.exists(done):
+            return None
+        self.used.add(key)
+        
+        # Mark it as recently used
+        try:
+            os.utime(done, None)
+        except OSError:
+            pass
+        
+        return os.path.join(self.path, key, 'db')
+    
+    def putDB(self, key, build, expected=0):
+        '''
+        Build a DB in the cache: build(out) creates the DB in out
+        and returns True/False
+        Room for the new DB (expected size, in bytes) is made before the build
+        Returns the path of the cached DB (None if the build fails)
+        '''
+        self.used.add(key)
+        self.evict(expected)
+        
+        tmp = os.path.join(self.path, '%s.%d.tmp'%(key, os.getpid()))
+        shutil.rmtree(tmp, True)
+        os.makedirs(tmp)
+        
+        if not build(os.path.join(tmp, 'db')):
+            shutil.rmtree(tmp, True)
+            return None
+        open(os.path.join(tmp, 'done'), 'w').close()
+        
+        try:
+            os.rename(tmp, os.path.join(self.path, key))
+        except OSError:
+            # Built meanwhile by another process
+            shutil.rmtree(tmp, True)
+        
+        size = self.getSize(os.path.join(self.path, key))
+        if size > self.maxsize:
+            logger.warning('The Blast DB %s (%d MB) is bigger than the '%(key,
+                                                        size / 1024 / 1024)+
+                           'cache maximum size (%d MB): keeping it anyway'%(
+                                                self.maxsize / 1024 / 1024))
+        
+        return os.path.join(self.path, key, 'db')
+    
+    def makeAlias(self, db, outFile, dbType, title):
+        '''
+        Make the cached DB available as outFile (Blast alias file)
+        '''
+        f = open(outFile + aliasExt[dbType], 'w')
+        try:
+            f.write('TITLE %s\n'%title)
+            f.write('DBLIST "%s"\n'%db)
+        finally:
+            f.close()
+    
+    def getSize(self, entry):
+        '''
+        Size of a cached DB (bytes)
+        '''
+        try:
+            return sum([os.path.getsize(os.path.join(entry, x))
+                        for x in os.listdir(entry)])
+        except OSError:
+            return 0
+    
+    def evict(self, incoming=0):
+        '''
+        Remove the least recently used DBs until there is room for
+        a new DB of size incoming (bytes) and the cache is 10% below its
+        maximum size
+        The DBs used by this run are kept, even if the cache is too big
+        '''
+        entries = []
+        size = incoming
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            done = os.path.join(entry, 'done')
+            if not os.path.exists(done):
+                continue
+            esize = self.getSize(entry)
+            size += esize
+            
+            mtime = os.path.getmtime(done)
+            if name in self.used or mtime >= self.started:
+                continue
+            entries.append((mtime, esize, entry))
+        
+        if size <= self.maxsize:
+            return
+        
+        target = self.maxsize * 0.9
+        removed = 0
+        for mtime, esize, entry in sorted(entries):
+            if size <= target:
+                break
+            shutil.rmtree(entry, True)
+            size -= esize
+            removed += 1
+        
+        logger.debug('Removed %d DBs from the Blast DB cache'%removed)
+    
+    def clear(self):
+        '''
+        Empty the cache
+        '''
+        if not self.enabled:
+            return
+        
+        for name in os.listdir(self.path):
+            shutil.rmtree(os.path.join(self.path, name), True)
+
 class Blaster(object):
     def __init__(self, useDisk=False):
         self._hits = None
         self._out = ''
+        self._tabular = True
         
         # No-disk
         self._useDisk = bool(useDisk)
@@ -97,7 +330,30 @@ class Blaster(object):
         
     def createDB(self,seqFile,dbType,outFile='BlastDB',parseIDs=True,
                         title='Generic Blast DB'):
-        '''Generation of a Blast DB'''
+        '''Generation of a Blast DB
+        If a DB has already been built from the same sequences (and options)
+        the cached one is used (see BlastDBCache)'''
+        cache = getDBCache()
+        if not cache.enabled or not os.path.exists(seqFile):
+            return self._makeDB(seqFile,dbType,outFile,parseIDs,title)
+        
+        key = cache.getKey(seqFile, dbType, parseIDs, title)
+        db = cache.getDB(key)
+        if db is not None:
+            logger.debug('Using the cached Blast DB for %s'%seqFile)
+        else:
+            db = cache.putDB(key,
+                             lambda out: self._makeDB(seqFile,dbType,out,
+                                                      parseIDs,title),
+                             expected=os.path.getsize(seqFile))
+            if db is None:
+                return False
+        
+        cache.makeAlias(db, outFile, dbType, title)
+        return True
+    
+    def _makeDB(self,seqFile,dbType,outFile,parseIDs,title):
+        '''Run makeblastdb'''
         cmd = ('makeblastdb -in %s -dbtype %s -out %s -title "%s"')
         cmd = cmd%(seqFile,dbType,outFile,title)
         if parseIDs:
@@ -145,19 +401,27 @@ class Blaster(object):
         return bool(not return_code)
     
     def runBlast(self, queryFile, db, outFile='', evalue = 10,
-                    task = '', ncpus = 1, additional = '', outfmt='5'):
-        '''Run Blast with the desired parameters'''
+                    task = '', ncpus = 1, additional = '',
+                    outfmt=tabularFormat):
+        '''Run Blast with the desired parameters
+        The default output format is tabular (see tabularFormat),
+        use outfmt='5' to get the XML output'''
         # Create the command line
         from Bio.Blast.Applications import NcbiblastpCommandline
         self._out = outFile
+        self._tabular = (outfmt == tabularFormat)
+        self._hits = None
         cmd = NcbiblastpCommandline(db=db,
                 evalue=float(evalue),
                 outfmt=outfmt,
                 num_threads=ncpus)
+        # The output is renamed only when Blast has completed:
+        # an interrupted run never leaves a truncated output file
+        tmpFile = outFile + '.tmp'
         if self._useDisk:
             cmd.set_parameter('query', queryFile)
             if outFile != '':
-                cmd.set_parameter('out', outFile)
+                cmd.set_parameter('out', tmpFile)
         if task != '':
             cmd.set_parameter('task', task)
         if additional !='':
@@ -185,25 +449,69 @@ class Blaster(object):
             logger.warning('Run Blast failed with error %d'
                             %return_code)
             logger.warning('%s'%str(out[1]))
+        
+        if self._useDisk and outFile != '':
+            if not return_code:
+                if os.path.exists(outFile):
+                    os.remove(outFile)
+                os.rename(tmpFile, outFile)
+            elif os.path.exists(tmpFile):
+                os.remove(tmpFile)
 
         return bool(not return_code)
     
-    def parseBlast(self, fileOut):
-        '''Parse the xml blast output -- default file is self._out'''
-        from Bio.Blast import NCBIXML
-
+    def parseBlast(self, fileOut, tabular=None):
+        '''Parse the blast output -- default file is self._out
+        The tabular output is read one line at a time,
+        otherwise the xml one is parsed'''
+        if tabular is not None:
+            self._tabular = bool(tabular)
+        
         if self._useDisk:
             self._out = fileOut
             handle = open(fileOut)
         else:
             handle = StringIO(self.out.decode('utf-8'))
+        
+        if self._tabular:
+            self._hits = handle
+        else:
+            from Bio.Blast import NCBIXML
+            self._hits = NCBIXML.parse(handle)
+    
+    def _getTabularHits(self, expect=10.0):
+        '''Generator to the hits of each query from the tabular output
+        (lines of the same query are contiguous)'''
+        hits = []
+        query = None
+        for line in self._hits:
+            if line.startswith('#') or len(line.strip()) == 0:
+                continue
             
-        self._hits = NCBIXML.parse(handle)
+            h = BlastHit.fromTabular(line)
+            if h.query_id != query:
+                if query is not None:
+                    yield hits
+                hits = []
+                query = h.query_id
+            
+            if h.evalue > expect:continue
+            hits.append(h)
+        
+        if query is not None:
+            yield hits
+        
+        if hasattr(self._hits, 'close'):
+            self._hits.close()
         
     def getHits(self,expect=10.0):
         '''Returns a Generator query -> BlastObj'''
         if self._hits == None:
             self.parseBlast(self._out)
+        if self._tabular:
+            for hits in self._getTabularHits(expect):
+                yield hits
+            return
         for BlastQuery in self._hits:
             hits = []
             for alignment in BlastQuery.alignments:
@@ -238,7 +546,7 @@ class RunBBH(object):
         self.ko_id = ko_id
         self.useDisk = bool(useDisk)
         
-        self.out = self.queryid + '_' + str(self.uniqueid) +'.xml'
+        self.out = self.queryid + '_' + str(self.uniqueid) +'.tab'
         self.blaster = Blaster(useDisk=self.useDisk)
         self.additional = (' -soft_masking true -dbsize 500000000 '+
                     '-use_sw_tback -max_target_seqs 1 -matrix %s'%self.matrix)
@@ -360,3 +668,31 @@ class RunBBH(object):
         if self.useDisk:
             os.remove(self.out)
         return [None, self.targetorg, True]
+
+################################################################################
+# Methods
+
+_dbcache = None
+
+def getDBCache():
+    '''
+    Returns the Blast DB cache shared by the whole process
+    (settings are taken from the environment variables)
+    '''
+    global _dbcache
+    if _dbcache is None:
+        cachedir = os.environ.get('DUCTAPE_CACHE', defaultDir)
+        enabled = cachedir.lower() not in ['off', 'no', '0', '']
+        _dbcache = BlastDBCache(os.path.join(cachedir, 'blastdb')
+                                if enabled else None,
+                                maxsize=os.environ.get('DUCTAPE_BLASTDB_SIZE',
+                                                       defaultDBSize),
+                                enabled=enabled)
+    return _dbcache
+
+def setDBCache(cache):
+    '''
+    Use a custom BlastDBCache object
+    '''
+    global _dbcache
+    _dbcache = cache
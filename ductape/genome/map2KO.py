@@ -16,6 +16,7 @@ if sys.version_info[0] < 3:
 else:
     import queue
 import logging
+import math
 import os
 import webbrowser
 
@@ -32,6 +33,29 @@ logger = logging.getLogger('ductape.map2KO')
 class KOBBH(object):
     pass
 
+class BlastSlice(object):
+    '''
+    Class BlastSlice
+    Runs Blast on a proteome slice (to be used in a separate process)
+    '''
+    def __init__(self, query, db, out, evalue, ncpus=1, short=False):
+        self.query = query
+        self.db = db
+        self.out = out
+        self.evalue = evalue
+        self.ncpus = ncpus
+        self.short = short
+    
+    def __call__(self):
+        blaster = Blaster(useDisk=True)
+        if self.short:
+            return blaster.runBlast(self.query, self.db, self.out,
+                                    evalue = self.evalue,
+                                    ncpus = self.ncpus, task='blastp-short')
+        return blaster.runBlast(self.query, self.db, self.out,
+                                evalue = self.evalue,
+                                ncpus = self.ncpus)
+
 class LocalSearch(CommonMultiProcess):
     '''
     Class localSearch
@@ -49,7 +73,8 @@ class LocalSearch(CommonMultiProcess):
     
     def __init__(self,query,target,
                  ncpus=1,evalue=1e-50,
-                 buildDB=True,bbh=True,recover=False,queue=queue.Queue()):
+                 buildDB=True,bbh=True,recover=False,queue=queue.Queue(),
+                 threads=4, slicesize=500):
         CommonMultiProcess.__init__(self,ncpus,queue)
         # Blast
         self.query = query
@@ -64,10 +89,20 @@ class LocalSearch(CommonMultiProcess):
         self.bbh = bool(bbh)
         self.recover = recover
         self.ncpus = int(ncpus)
+        # Blast does not scale well with many threads:
+        # many slices are run at once, each one with a few threads
+        # The leftover CPUs are spread among the jobs,
+        # so that all of them are used (see getThreads)
+        threads = max(1, min(int(threads), self.ncpus))
+        self.jobs = max(1, self.ncpus // threads)
+        self.threads = max(1, self.ncpus // self.jobs)
+        # Approximate number of proteins in each slice
+        self.slicesize = int(slicesize)
         self._kohits = []
         self.results = {}
         self._keggroom = None
-        self._blast = Blaster()
+        # Blast outputs are kept on disk and parsed line by line
+        self._blast = Blaster(useDisk=True)
         
     def makeRoom(self,location=''):
         '''
@@ -102,6 +137,26 @@ class LocalSearch(CommonMultiProcess):
         self.db = os.path.join(self._keggroom,'KEGGdb') 
         return self._blast.createDB(self.target, 'prot', self.db)
     
+    def _isSlice(self, query, seqs):
+        '''
+        Check that a query file from a previous run holds the same proteins
+        '''
+        try:
+            ids = [s.id for s in SeqIO.parse(open(query),'fasta')]
+        except:
+            return False
+        return ids == [s.id for s in seqs]
+    
+    def getThreads(self, task):
+        '''
+        Number of Blast threads for the n-th submitted slice
+        In each round of jobs the first ones get one more thread,
+        so that the threads of the running slices add up to ncpus
+        '''
+        if task % self.jobs < self.ncpus % self.jobs:
+            return self.threads + 1
+        return self.threads
+    
     def runBlast(self,short=False):
         lS = []
         for s in SeqIO.parse(open(self.query),'fasta'):
@@ -109,53 +164,72 @@ class LocalSearch(CommonMultiProcess):
                 lS.append(s)
             elif not short:lS.append(s)
         self._maxsubstatus = len(lS)
-        for seqs in slice_it(lS,10):
+        
+        # The slicing only depends on the proteome and the slice size
+        # (not on the number of jobs): the slice files can then be
+        # recovered by a run with a different number of CPUs
+        nslices = max(10, int(math.ceil(len(lS) / float(self.slicesize))))
+        
+        self.startPool(self.jobs)
+        
+        futures = []
+        sizes = {}
+        for i, seqs in enumerate(slice_it(lS,nslices)):
             if self.killed:
                 logger.debug('Exiting for a kill signal')
+                self.stopPool()
                 return False
             
             if len(seqs) == 0:
                 continue
-            self._substatus += len(seqs)
-            self.updateStatus(sub=True)
             if short:
                 query = os.path.join(self._room,
-                         'KEGGshort_%d.faa'%self._substatus)
+                         'KEGGshort_%d.faa'%i)
                 out = os.path.join(self._room,
-                           'KEGGshort_%d.xml'%self._substatus)
+                           'KEGGshort_%d.tab'%i)
             else:
                 query = os.path.join(self._room,
-                         'KEGG_%d.faa'%self._substatus)
-                out = os.path.join(self._room,'KEGG_%d.xml'%self._substatus)
+                         'KEGG_%d.faa'%i)
+                out = os.path.join(self._room,'KEGG_%d.tab'%i)
             self.out.append(out)
             # If recovery, skip the unnecessary scans
+            # (Blast renames its output only once it has completed)
             if ( self.recover and os.path.exists(query) and
-                 os.path.exists(out)):
-                # Last test: can it be parsed?
-                try:
-                    self._blast.parseBlast(out)
-                    for hits in self._blast.getHits(self.evalue):
-                        pass
-                    logger.debug('Skipping slice %s because has already been done'
-                                %query)
-                    continue
-                except:
-                    pass
+                 os.path.exists(out) and self._isSlice(query, seqs)):
+                logger.debug('Skipping slice %s because has already been done'
+                            %query)
+                self._substatus += len(seqs)
+                self.updateStatus(sub=True)
+                continue
             oseqs = SeqIO.write(seqs,open(query,'w'),'fasta')
             if oseqs != len(seqs):
                 logger.warning('Query splitting error! Expected %d, '+
                                 'Printed %d'%(len(seqs),oseqs))
-            if short:
-                res = self._blast.runBlast(query, self.db, out,
-                                 evalue = self.evalue,
-                                 ncpus = self.ncpus, task='blastp-short')
-            else:
-                res = self._blast.runBlast(query, self.db, out,
-                                 evalue = self.evalue,
-                                 ncpus = self.ncpus)
+            
+            future = self.submit(BlastSlice(query, self.db, out,
+                                            self.evalue,
+                                            self.getThreads(len(futures)),
+                                            short))
+            futures.append(future)
+            sizes[future.taskid] = len(seqs)
+        
+        for future in self.completed(futures):
+            self._substatus += sizes[future.taskid]
+            self.updateStatus(sub=True)
+            
+            try:
+                res = future.result()
+            except Exception as e:
+                logger.error('Blast slice failure: %s'%e)
+                res = False
             if not res:
+                self.stopPool()
                 return False
-        return True
+        
+        done = all([f.done() for f in futures])
+        self.stopPool()
+        
+        return done
     
     def parseBlast(self):
         for out in self.out:
@@ -164,7 +238,7 @@ class LocalSearch(CommonMultiProcess):
                 return False
         
             self._blast.parseBlast(out)
-            # Catch the exceptions if the XML is dirty
+            # Catch the exceptions if the output is dirty
             try:
                 for hits in self._blast.getHits(self.evalue):
                     for hit in hits:
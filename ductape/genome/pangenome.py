@@ -125,7 +125,39 @@ class PanGenomer(CommonMultiProcess):
             dbindex += 1
         return True
     
+    def _addOrthologs(self, tasks, query_id, orthname, orgsincluded):
+        '''
+        Submits the BBH tasks to the pool and adds the orthologs found
+        Results are parsed in submission order
+        '''
+        futures = [self.submit(obj) for obj in tasks]
+        
+        if not self.wait(futures):
+            return False
+        
+        for future in futures:
+            result = future.result()
+            
+            if not result[2]:
+                logger.error('An error occurred for BBH on query %s'%query_id+
+                             ' and target %s'%result[1])
+                return False
+            if result[0] and result[0] not in self._already:
+                self.orthologs[orthname].append(result[0])
+                orgsincluded.append(result[1])
+                self._already.add(result[0])
+        
+        return True
+    
     def serialBBH(self):
+        # The workers are spawned just once
+        self.startPool()
+        try:
+            return self._serialBBH()
+        finally:
+            self.stopPool()
+    
+    def _serialBBH(self):
         orthindex = 1
         
         self._maxsubstatus = len(self._prot2orgs)
@@ -152,17 +184,17 @@ class PanGenomer(CommonMultiProcess):
                 self.orthologs[orthname] = [seq.id]
                 query = '>%s\n%s\n'%(seq.id, str(seq.seq))
                 
-                self.initiateParallel()
+                # Go fot it!
+                if len(seq) < 30:
+                    short = True
+                else:
+                    short = False
                 
                 # Iterate over each other organism
+                tasks = []
                 for otherorg in self.organisms:
                     if org == otherorg:
                         continue
-                    # Go fot it!
-                    if len(seq) < 30:
-                        short = True
-                    else:
-                        short = False
                     
                     uniqueid = self.getUniqueID()
                     
@@ -171,54 +203,11 @@ class PanGenomer(CommonMultiProcess):
                             self.dbs[otherorg],otherorg,
                             self.evalue,self.matrix,short=short,
                             uniqueid=uniqueid,useDisk=False)
-                    self._paralleltasks.put(obj)
-                    
-                # Poison pill to stop the workers
-                self.addPoison()
-                
-                while True:
-                    if self.killed:
-                        logger.debug('Exiting for a kill signal')
-                        return
-                         
-                    while not self._parallelresults.empty():
-                        if self.killed:
-                            logger.debug('Exiting for a kill signal')
-                            return
-                        
-                        result = self._parallelresults.get()
-                        
-                        if not result[2]:
-                            logger.error('An error occurred for BBH on query %s'%seq.id+
-                                         ' and target %s'%result[1])
-                            return False
-                        if result[0] and result[0] not in self._already:
-                            self.orthologs[orthname].append(result[0])
-                            orgsincluded.append(result[1])
-                            self._already.add(result[0])
-                            
-                    if self.isTerminated():
-                        break
-                    
-                    self.sleeper.sleep(0.01)
-                    
-                while not self._parallelresults.empty():
-                    if self.killed:
-                        logger.debug('Exiting for a kill signal')
-                        return
-                    
-                    result = self._parallelresults.get()
-                    
-                    if not result[2]:
-                        logger.error('An error occurred for BBH on query %s'%seq.id+
-                                     ' and target %s'%result[1])
-                        return False
-                    if result[0] and result[0] not in self._already:
-                        self.orthologs[orthname].append(result[0])
-                        orgsincluded.append(result[1])
-                        self._already.add(result[0])
+                    tasks.append(obj)
                 
-                self.killParallel()
+                if not self._addOrthologs(tasks, seq.id,
+                                          orthname, orgsincluded):
+                    return False
                 
                 if len(orgsincluded) < len(self.organisms):
                     logger.debug('Additional search on missing organisms for'+
@@ -235,16 +224,10 @@ class PanGenomer(CommonMultiProcess):
                                                 otherprotein)
                         query = searcher.retrieved
                         
-                        self.initiateParallel()
-                        
+                        tasks = []
                         for evenneworg in self.organisms:
                             if evenneworg in orgsincluded:
                                 continue
-                            # Go fot it!
-                            if len(seq) < 30:
-                                short = True
-                            else:
-                                short = False
                             
                             uniqueid = self.getUniqueID()
                     
@@ -253,58 +236,18 @@ class PanGenomer(CommonMultiProcess):
                                     self.dbs[evenneworg],evenneworg,
                                     self.evalue,self.matrix,short=short,
                                     uniqueid=uniqueid,useDisk=False)
-                            self._paralleltasks.put(obj)
-                            
-                        # Poison pill to stop the workers
-                        self.addPoison()
+                            tasks.append(obj)
                         
-                        while True:
-                            if self.killed:
-                                logger.debug('Exiting for a kill signal')
-                                return
-                            
-                            while not self._parallelresults.empty():
-                                if self.killed:
-                                    logger.debug('Exiting for a kill signal')
-                                    return
-                                
-                                result = self._parallelresults.get()
-                                
-                                if not result[2]:
-                                    logger.error('An error occurred for BBH on query %s'%seq.id+
-                                                 ' and target %s'%result[1])
-                                    return False
-                                if result[0] and result[0] not in self._already:
-                                    self.orthologs[orthname].append(result[0])
-                                    orgsincluded.append(result[1])
-                                    self._already.add(result[0])
-                            
-                            if self.isTerminated():
-                                break
-                            
-                            self.sleeper.sleep(0.01)
-                        
-                        while not self._parallelresults.empty():
-                            if self.killed:
-                                logger.debug('Exiting for a kill signal')
-                                return
-                            
-                            result = self._parallelresults.get()
-                            
-                            if not result[2]:
-                                logger.error('An error occurred for BBH on query %s'%seq.id+
-                                             ' and target %s'%result[1])
-                                return False
-                            if result[0] and result[0] not in self._already:
-                                self.orthologs[orthname].append(result[0])
-                                orgsincluded.append(result[1])
-                                self._already.add(result[0])
-                        
-                        self.killParallel()
+                        if not self._addOrthologs(tasks, seq.id,
+                                                  orthname, orgsincluded):
+                            return False
                 
                 orthindex += 1
         return True
     
+    def findOrthologs(self):
+        return self.serialBBH()
+    
     def packPanGenome(self):
         for g in self.orthologs:
             if len(self.orthologs[g]) == len(self.organisms):
@@ -332,8 +275,8 @@ class PanGenomer(CommonMultiProcess):
             return
             
         self.updateStatus()
-        if not self.serialBBH():
-            self.sendFailure('Serial BBH failure!')
+        if not self.findOrthologs():
+            self.sendFailure('%s failure!'%self._statusDesc[self.status])
             self.killParallel()
             self.cleanUp()
             return
@@ -350,3 +293,175 @@ class PanGenomer(CommonMultiProcess):
         
         self.updateStatus()
         self.cleanUp()
+
+class AllVsAllPanGenomer(PanGenomer):
+    '''
+    Class AllVsAllPanGenomer
+    Same results as PanGenomer, but a single (multi-threaded) Blast run
+    is performed for each organisms pair: the best bidirectional hits
+    are then computed from the tabular outputs
+    '''
+    _statusDesc = {0:'Not started',
+               1:'Making room',
+               2:'Creating Blast DBs',
+               3:'Running all-vs-all Blast',
+               4:'Crafting the PanGenome',
+               5:'Cleaning up'}
+    
+    _substatuses = [2,3]
+    
+    def __init__(self, *args, **kwargs):
+        PanGenomer.__init__(self, *args, **kwargs)
+        # (query organism, target organism) --> query --> best hit
+        self._besthits = {}
+        # Blast additional parameters, the same used by RunBBH
+        self.additional = (' -soft_masking true -dbsize 500000000 '+
+                    '-use_sw_tback -max_target_seqs 1 -matrix %s'%self.matrix)
+    
+    def splitProteomes(self):
+        '''
+        Write each proteome in two files (short and long proteins),
+        as short ones need a different Blast task
+        Returns a dictionary organism --> (short file, long file)
+        '''
+        splitted = {}
+        for i, org in enumerate(self.organisms):
+            short = os.path.join(self._pangenomeroom, '%d_short.faa'%i)
+            longer = os.path.join(self._pangenomeroom, '%d_long.faa'%i)
+            fshort = open(short, 'w')
+            flonger = open(longer, 'w')
+            for seq in SeqIO.parse(open(org),'fasta'):
+                if len(seq) < 30:
+                    fshort.write('>%s\n%s\n'%(seq.id, str(seq.seq)))
+                else:
+                    flonger.write('>%s\n%s\n'%(seq.id, str(seq.seq)))
+            fshort.close()
+            flonger.close()
+            splitted[org] = (short, longer)
+        return splitted
+    
+    def parseBestHits(self, searcher, fileOut, besthits):
+        '''
+        Reads a tabular Blast output and keeps the best hit for each query
+        (lowest evalue, highest bitscore)
+        '''
+        searcher.parseBlast(fileOut)
+        for hits in searcher.getHits(self.evalue):
+            if len(hits) == 0:
+                continue
+            best = min(hits, key=lambda h: (h.evalue, -h.bits))
+            besthits[best.query_id.replace('lcl|','')] = best.hit.replace(
+                                                                'lcl|','')
+    
+    def allVsAll(self):
+        '''
+        Runs a Blast search for each organisms pair
+        '''
+        splitted = self.splitProteomes()
+        
+        pairs = [(org, otherorg) for org in self.organisms
+                 for otherorg in self.organisms
+                 if org != otherorg]
+        self._maxsubstatus = len(pairs)
+        
+        for org, otherorg in pairs:
+            self._substatus += 1
+            self.updateStatus(sub=True)
+            
+            if self.killed:
+                logger.debug('Exiting for a kill signal')
+                return False
+            
+            logger.debug('Blast %s vs. %s'%(org, otherorg))
+            
+            besthits = {}
+            for queryFile, task in zip(splitted[org],
+                                       ['blastp-short', '']):
+                if os.path.getsize(queryFile) == 0:
+                    continue
+                
+                fileOut = os.path.join(self._pangenomeroom,
+                                       '%d.tab'%self.getUniqueID())
+                
+                searcher = Blaster(useDisk=True)
+                if not searcher.runBlast(queryFile, self.dbs[otherorg],
+                                         fileOut, evalue=self.evalue,
+                                         task=task, ncpus=self.ncpus,
+                                         additional=self.additional):
+                    logger.error('Blast failed for %s vs. %s'%(org,
+                                                              otherorg))
+                    return False
+                
+                self.parseBestHits(searcher, fileOut, besthits)
+                os.remove(fileOut)
+            
+            self._besthits[(org, otherorg)] = besthits
+        
+        return True
+    
+    def getBBH(self, protein, org, otherorg):
+        '''
+        Returns the best bidirectional hit of protein (from org)
+        in otherorg, None if missing
+        '''
+        hit = self._besthits[(org, otherorg)].get(protein)
+        if hit is None:
+            return None
+        if self._besthits[(otherorg, org)].get(hit) == protein:
+            return hit
+        return None
+    
+    def _addOrthologs(self, protein, org, targets, orthname, orgsincluded):
+        for otherorg in targets:
+            hit = self.getBBH(protein, org, otherorg)
+            if hit and hit not in self._already:
+                self.orthologs[orthname].append(hit)
+                orgsincluded.append(otherorg)
+                self._already.add(hit)
+    
+    def bidirectionalHits(self):
+        '''
+        Builds the orthologs groups (same logic as serialBBH)
+        '''
+        orthindex = 1
+        
+        for org in self.organisms:
+            for seq in SeqIO.parse(open(org),'fasta'):
+                if self.killed:
+                    logger.debug('Exiting for a kill signal')
+                    return False
+                
+                if seq.id in self._already:
+                    continue
+                orthname = self.prefix + str(orthindex)
+                orgsincluded = [org]
+                self.orthologs[orthname] = [seq.id]
+                
+                self._addOrthologs(seq.id, org,
+                                   [otherorg for otherorg in self.organisms
+                                    if otherorg != org],
+                                   orthname, orgsincluded)
+                
+                if len(orgsincluded) < len(self.organisms):
+                    logger.debug('Additional search on missing organisms for'+
+                                  ' ortholog %s'%orthname)
+                    for otherprotein in self.orthologs[orthname]:
+                        if otherprotein == seq.id:
+                            continue
+                        neworg = self._prot2orgs[otherprotein]
+                        if neworg == org:
+                            continue
+                        
+                        self._addOrthologs(otherprotein, neworg,
+                                           [evenneworg
+                                            for evenneworg in self.organisms
+                                            if evenneworg not in orgsincluded],
+                                           orthname, orgsincluded)
+                
+                orthindex += 1
+        return True
+    
+    def findOrthologs(self):
+        if not self.allVsAll():
+            return False
+        return self.bidirectionalHits()
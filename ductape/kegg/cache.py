@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+"""
+Cache
+
+Kegg Library
+
+Persistent on-disk cache for the KEGG REST calls
+"""
+import sys
+if sys.version_info[0] < 3:
+    from urllib2 import urlopen
+    from urlparse import urlparse
+else:
+    from urllib.request import urlopen
+    from urllib.parse import urlparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+__author__ = "Marco Galardini"
+
+################################################################################
+# Log setup
+
+logger = logging.getLogger('ductape.cache')
+
+################################################################################
+# Constants
+
+# Default settings, can be overridden by environment variables
+# DUCTAPE_CACHE: cache directory ("off" to disable the cache)
+# DUCTAPE_CACHE_TTL: time-to-live of the entries (days)
+# DUCTAPE_CACHE_SIZE: maximum cache size (MB)
+# DUCTAPE_OFFLINE: if set to 1, only cached entries are used
+# DUCTAPE_KEGG_RATE: maximum requests per second to each host
+defaultDir = os.path.join(os.path.expanduser('~'), '.ductape')
+defaultTTL = 30
+defaultSize = 1024
+defaultRate = 10
+# Number of writes after which the cache size is read again from the DB
+# (other processes may be using the same cache)
+sizeSync = 1000
+
+cachestrings = ['''CREATE TABLE IF NOT EXISTS "cache" (
+    "key" TEXT NOT NULL,
+    "url" TEXT NOT NULL,
+    "release" TEXT,
+    "content" BLOB,
+    "size" INTEGER NOT NULL DEFAULT (0),
+    "created" REAL NOT NULL,
+    "accessed" REAL NOT NULL,
+    PRIMARY KEY ("key")
+);''',
+'''CREATE INDEX IF NOT EXISTS "cache_accessed" on cache (accessed ASC);''',
+'''CREATE TABLE IF NOT EXISTS "meta" (
+    "name" TEXT NOT NULL,
+    "value" TEXT,
+    PRIMARY KEY ("name")
+);''']
+
+################################################################################
+# Classes
+
+class CacheMiss(IOError):
+    '''
+    Raised in offline mode when an URL is not cached
+    '''
+    pass
+
+class RateLimiter(object):
+    '''
+    Class RateLimiter
+    Limits the number of requests per second sent to each host
+    (thread-safe)
+    '''
+    def __init__(self, rate=defaultRate):
+        rate = float(rate)
+        if rate > 0:
+            self.interval = 1. / rate
+        else:
+            self.interval = 0
+        self._next = {}
+        self._lock = threading.Lock()
+    
+    def wait(self, url):
+        '''
+        Blocks until a request to this URL's host can be sent
+        '''
+        if self.interval == 0:
+            return
+        
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        
+        if slot > now:
+            time.sleep(slot - now)
+
+class KeggCache(object):
+    '''
+    Class KeggCache
+    Stores the (compressed) content of each URL in a SQLite DB,
+    using the URL hash as key
+
+    Each entry is tagged with the KEGG release (see setRelease):
+    entries from another release are considered missing
+    Entries older than ttl (days) are considered missing as well,
+    but they are kept (and used if the network fails) until fetched again
+    When the DB grows over maxsize (MB) the least recently used
+    entries are removed (the size is tracked at each write)
+    If offline, the network is never used
+    Requests are sent at most at rate per second to each host
+    '''
+    def __init__(self, path=None, ttl=defaultTTL, maxsize=defaultSize,
+                 offline=False, enabled=True, rate=defaultRate):
+        if path is None:
+            path = os.path.join(defaultDir, 'kegg_cache.db')
+        self.path = path
+        self.ttl = float(ttl) * 86400
+        self.maxsize = int(float(maxsize) * 1024 * 1024)
+        self.offline = bool(offline)
+        self.enabled = bool(enabled)
+
+        self._lock = threading.Lock()
+        self.limiter = RateLimiter(rate)
+        self.release = None
+
+        # A single connection for each process
+        self._conn = None
+        self._pid = None
+        # Cached contents size (None: unknown)
+        self._size = None
+        self._writes = 0
+
+        if self.enabled:
+            try:
+                self._create()
+                self.release = self.getMeta('release')
+            except Exception as e:
+                logger.warning('Could not open the KEGG cache %s (%s)'%
+                               (self.path, str(e)))
+                self.enabled = False
+
+    def _connect(self):
+        '''
+        Connection to the cache DB, opened once for each process
+        (the lock must be held)
+        '''
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=60,
+                                         check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        '''
+        Close the connection to the cache DB
+        '''
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def _sumSize(self, conn):
+        '''
+        Total size of the cached contents, read from the DB
+        '''
+        size = conn.execute('select sum(size) from cache;').fetchone()[0]
+        if size is None:
+            return 0
+        return size
+
+    def _updateSize(self, conn, delta):
+        '''
+        Update the cached contents size after a write
+        (the lock must be held)
+        '''
+        self._writes += 1
+        if self._size is None or self._writes % sizeSync == 0:
+            self._size = self._sumSize(conn)
+        else:
+            self._size += delta
+
+    def _create(self):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for query in cachestrings:
+                    conn.execute(query)
+
+    def getKey(self, url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def getMeta(self, name):
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute('select value from meta where name=?;',
+                                  [name,])
+            res = cursor.fetchone()
+        if res is None:
+            return None
+        return res[0]
+
+    def setMeta(self, name, value):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('insert or replace into meta values (?,?);',
+                             [name, value])
+
+    def setRelease(self, release):
+        '''
+        Set the current KEGG release: the entries from older releases
+        will be fetched again
+        '''
+        if not self.enabled or release is None:
+            return
+        self.release = str(release)
+        self.setMeta('release', self.release)
+
+    def get(self, url, tagged=True, ignoreTTL=False):
+        '''
+        Returns the cached content of an URL (None if missing)
+        If tagged, only the entries from the current release are considered
+        If ignoreTTL, the entries older than ttl are returned as well
+        '''
+        if not self.enabled:
+            return None
+
+        key = self.getKey(url)
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute('''select content, release, created, size
+                                    from cache where key=?;''', [key,])
+            res = cursor.fetchone()
+            if res is None:
+                return None
+
+            content, release, created, size = res
+            if tagged and release != self.release:
+                with conn:
+                    conn.execute('delete from cache where key=?;', [key,])
+                self._updateSize(conn, -size)
+                return None
+            if (not self.offline and not ignoreTTL and
+                time.time() - created > self.ttl):
+                # Replaced when fetched again
+                return None
+
+            with conn:
+                conn.execute('update cache set accessed=? where key=?;',
+                             [time.time(), key])
+
+        return zlib.decompress(content)
+
+    def put(self, url, content, tagged=True):
+        '''
+        Store the content of an URL
+        '''
+        if not self.enabled:
+            return
+
+        if tagged:
+            release = self.release
+        else:
+            release = None
+
+        key = self.getKey(url)
+        blob = zlib.compress(content)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute('select size from cache where key=?;',
+                               [key,]).fetchone()
+            with conn:
+                conn.execute('''insert or replace into cache
+                                values (?,?,?,?,?,?,?);''',
+                             [key, url, release,
+                              sqlite3.Binary(blob), len(blob), now, now])
+            if old is None:
+                self._updateSize(conn, len(blob))
+            else:
+                self._updateSize(conn, len(blob) - old[0])
+            full = self._size > self.maxsize
+
+        if full:
+            self.evict()
+
+    def delete(self, url):
+        '''
+        Remove an URL from the cache
+        '''
+        if not self.enabled:
+            return
+
+        key = self.getKey(url)
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute('select size from cache where key=?;',
+                               [key,]).fetchone()
+            if old is None:
+                return
+            with conn:
+                conn.execute('delete from cache where key=?;', [key,])
+            self._updateSize(conn, -old[0])
+
+    def getSize(self):
+        '''
+        Total size of the cached contents (bytes)
+        '''
+        if not self.enabled:
+            return 0
+
+        with self._lock:
+            self._size = self._sumSize(self._connect())
+            return self._size
+
+    def evict(self):
+        '''
+        Remove the least recently used entries
+        until the cache is 10% below its maximum size
+        '''
+        target = self.maxsize * 0.9
+        with self._lock:
+            conn = self._connect()
+            size = self._sumSize(conn)
+            if size <= self.maxsize:
+                self._size = size
+                return
+
+            cursor = conn.execute('''select key, size from cache
+                                    order by accessed;''')
+            remove = []
+            for key, esize in cursor:
+                if size <= target:
+                    break
+                remove.append((key,))
+                size -= esize
+            with conn:
+                conn.executemany('delete from cache where key=?;', remove)
+            self._size = size
+
+        logger.debug('Removed %d entries from the KEGG cache'%len(remove))
+
+    def clear(self):
+        '''
+        Empty the cache
+        '''
+        if not self.enabled:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('delete from cache;')
+            self._size = 0
+
+    def fetch(self, url, timeout=20, tagged=True, live=False):
+        '''
+        Returns the content of an URL, using the cache when possible
+        If live, the network is tried first (the cache is the fallback)
+        If the network fails, the entries older than ttl are used
+        Raises CacheMiss in offline mode if the URL is not cached
+        '''
+        if not live or self.offline:
+            content = self.get(url, tagged)
+            if content is not None:
+                return content
+
+        if self.offline:
+            raise CacheMiss('%s is not cached (offline mode)'%url)
+
+        try:
+            self.limiter.wait(url)
+            sock = urlopen(url, timeout=timeout)
+            content = sock.read()
+            sock.close()
+        except Exception:
+            content = self.get(url, tagged, ignoreTTL=True)
+            if content is not None:
+                logger.debug('Using cached content for %s'%url)
+                return content
+            raise
+
+        self.put(url, content, tagged)
+
+        return content
+
+################################################################################
+# Methods
+
+_cache = None
+
+def getCache():
+    '''
+    Returns the KEGG cache shared by the whole process
+    (settings are taken from the environment variables)
+    '''
+    global _cache
+    if _cache is None:
+        cachedir = os.environ.get('DUCTAPE_CACHE', defaultDir)
+        enabled = cachedir.lower() not in ['off', 'no', '0', '']
+        _cache = KeggCache(os.path.join(cachedir, 'kegg_cache.db')
+                           if enabled else None,
+                           ttl=os.environ.get('DUCTAPE_CACHE_TTL', defaultTTL),
+                           maxsize=os.environ.get('DUCTAPE_CACHE_SIZE',
+                                                  defaultSize),
+                           offline=os.environ.get('DUCTAPE_OFFLINE',
+                                                  '0') == '1',
+                           enabled=enabled,
+                           rate=os.environ.get('DUCTAPE_KEGG_RATE',
+                                               defaultRate))
+    return _cache
+
+def setCache(cache):
+    '''
+    Use a custom KeggCache object
+    '''
+    global _cache
+    _cache = cache
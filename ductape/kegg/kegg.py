@@ -10,14 +10,13 @@ import sys
 if sys.version_info[0] < 3:
     import Queue as queue
     from urllib2 import quote
-    from urllib2 import urlopen
 else:
-    from urllib.request import urlopen
     from urllib.parse import quote
     import queue
 from ductape.common.commonthread import CommonThread
 from ductape.common.utils import get_span
 from ductape.common.utils import isOnline
+from ductape.kegg.cache import getCache
 from ductape.kegg.web import kheader
 from matplotlib import colors
 import logging
@@ -45,6 +44,9 @@ avoidedPaths = set(['%s%s%s' % (prefix1, prefix2, value)
                                   '01230', '01220']
                    ])
 
+# Maximum wait between two attempts (seconds)
+maxBackoff = 60
+
 ################################################################################
 # Classes
 
@@ -92,8 +94,29 @@ class KeggAPI(object):
         
         self.keeptrying = keeptrying
         
+        # Persistent cache of the REST calls
+        self.cache = getCache()
+        self.url = None
+        
         self.clean()
     
+    def fetch(self, url, timeout=20, tagged=True, live=False):
+        '''
+        Get the content of an URL (through the cache)
+        '''
+        self.url = url
+        return self.cache.fetch(url, timeout=timeout, tagged=tagged,
+                                live=live)
+    
+    def wait(self, attempts):
+        '''
+        Wait before the next attempt (no need if offline)
+        Exponential backoff, with some jitter
+        '''
+        if self.cache.offline:
+            return
+        time.sleep(min(2 ** attempts, maxBackoff) + random.random())
+    
     def clean(self):
         self.input = None
         self.result = None
@@ -183,10 +206,14 @@ class KeggAPI(object):
                 self.input = None
                 logger.debug('Looking for KEGG db version')
                 url = self._apiurl + quote('info/kegg')
-                data = urlopen(url, timeout=20).read().decode('utf-8').split('\n')
+                data = self.fetch(url, timeout=20, tagged=False,
+                                  live=True).decode('utf-8').split('\n')
                 
                 line = data[1].split('             ')[1]
                 self.result = (line, self.getRelease(line))
+                
+                # Tag the cached entries with the current release
+                self.cache.setRelease(line)
 
                 return
             except Exception as e:
@@ -194,11 +221,11 @@ class KeggAPI(object):
                 logger.debug('info failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('info failed!')
@@ -226,7 +253,7 @@ class KeggAPI(object):
                 
                 url = url.rstrip('+')
                 url = self._apiurl + 'get/' + quote(url)
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 
                 self.result = {}
                 for lines in data.split('///'):
@@ -258,11 +285,11 @@ class KeggAPI(object):
                 logger.debug('get failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('get failed!')
@@ -289,7 +316,7 @@ class KeggAPI(object):
                     
                 url = url.rstrip('+')
                 url = self._apiurl + 'get/' + quote(url)
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 
                 self.result = {}
                 for lines in data.split('///'):
@@ -321,11 +348,11 @@ class KeggAPI(object):
                 logger.debug('get (rpair) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('get (rpair) failed!')
@@ -344,7 +371,7 @@ class KeggAPI(object):
                 logger.debug('Looking for KEGG IDs from db %s'%db)
                 url = self._apiurl + 'list/%s/' % quote(db)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = set([x.split('\t')[0] for x in data.split('\n')])
                 try:
                     self.result.remove('')
@@ -356,11 +383,11 @@ class KeggAPI(object):
                 logger.debug('list (%s) failed! Attempt %d'
                               %(db,attempts))
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('list (%s) failed!'%db)
@@ -382,7 +409,7 @@ class KeggAPI(object):
                 
                 url = self._apiurl + 'link/reaction/' + quote(url)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = self.parseLinks(data)
                 return
             except Exception as e:
@@ -390,11 +417,11 @@ class KeggAPI(object):
                 logger.debug('link (reaction) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (reaction) failed!')
@@ -416,7 +443,7 @@ class KeggAPI(object):
                 
                 url = self._apiurl + 'link/pathway/' + quote(url)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = self.parseLinks(data)
                 return
             except Exception as e:
@@ -424,11 +451,11 @@ class KeggAPI(object):
                 logger.debug('link (pathway) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (pathway) failed!')
@@ -450,7 +477,7 @@ class KeggAPI(object):
                 
                 url = self._apiurl + 'link/reaction/' + quote(url)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = self.parseLinks(data)
                 return
             except Exception as e:
@@ -458,11 +485,11 @@ class KeggAPI(object):
                 logger.debug('link (reaction) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (reaction) failed!')
@@ -484,7 +511,7 @@ class KeggAPI(object):
                 
                 url = self._apiurl + 'link/reaction/' + quote(url)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = self.parseLinks(data)
                 return
             except Exception as e:
@@ -492,11 +519,11 @@ class KeggAPI(object):
                 logger.debug('link (reaction) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (reaction) failed!')
@@ -522,7 +549,7 @@ class KeggAPI(object):
                 
                 url = url.rstrip('+')
                 url = self._apiurl + 'get/' + quote(url)
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 
                 self.result = {}
                 for lines in data.split('///'):
@@ -544,11 +571,11 @@ class KeggAPI(object):
                 logger.debug('link (rpair) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (rpair) failed!')
@@ -570,7 +597,7 @@ class KeggAPI(object):
                 
                 url = self._apiurl + 'link/compound/' + quote(url)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = self.parseLinks(data)
                 return
             except Exception as e:
@@ -578,11 +605,11 @@ class KeggAPI(object):
                 logger.debug('link (compound) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (compound) failed!')
@@ -604,7 +631,7 @@ class KeggAPI(object):
                 
                 url = self._apiurl + 'link/compound/' + quote(url)
                 
-                data = urlopen(url, timeout=20).read().decode('utf-8')
+                data = self.fetch(url, timeout=20).decode('utf-8')
                 self.result = self.parseLinks(data)
                 return
             except Exception as e:
@@ -612,11 +639,11 @@ class KeggAPI(object):
                 logger.debug('link (compound) failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
+                self.wait(attempts)
                 try:
                     logger.debug(url)
                 except:pass
-                if self.keeptrying:continue
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('link (compound) failed!')
@@ -668,17 +695,15 @@ class KeggAPI(object):
                     self.result = ''
                     return
 
-                sock=urlopen(url, timeout=60)
-                self.result = sock.read().decode('utf-8')
-                sock.close()
+                self.result = self.fetch(url, timeout=60).decode('utf-8')
                 return
             except Exception as e:
                 attempts += 1
                 logger.debug('show_pathway failed! Attempt %d'
                               %attempts)
                 logger.debug('%s'%str(e))
-                time.sleep((2 + random.random())*attempts)
-                if self.keeptrying:continue
+                self.wait(attempts)
+                if self.keeptrying and not self.cache.offline:continue
                 if attempts >= retries:
                     self.failed = True
                     logger.warning('show_pathway failed!')
@@ -889,12 +914,108 @@ class BaseKegg(CommonThread):
         handler = self.handlers[self._hindex] 
         self._hindex += 1
         return handler
+    
+    def getChunks(self, ids, span, *args):
+        '''
+        Split the IDs (skipping the avoided ones) in chunks of the desired
+        size, ready to be used as fetchAll tasks
+        '''
+        avoid = set(getattr(self, 'avoid', []))
+        ids = [i for i in ids if i not in avoid]
+        return [(piece,) + args for piece in get_span(ids, span)]
+    
+    def apiCall(self, name):
+        '''
+        Returns a function calling the desired KeggAPI method
+        (to be used with fetchAll)
+        '''
+        def call(handler, *args):
+            getattr(handler, name)(*args)
+            return handler.result
+        return call
+    
+    def _fetchWorker(self, handler, tasks, results, function, stop):
+        while not stop.is_set():
+            try:
+                args = tasks.get_nowait()
+            except queue.Empty:
+                return
+            
+            handler.clean()
+            try:
+                value = function(handler, *args)
+                results.put((args, handler.failed, value))
+            except Exception as e:
+                logger.debug('KEGG fetch error (%s)'%str(e))
+                results.put((args, True, None))
+    
+    def fetchAll(self, function, tasks, callback):
+        '''
+        Runs function(handler, *args) for each args tuple in tasks,
+        keeping at most numThreads requests in flight (one for each handler)
+        callback(args, value) is called in this thread as soon as each
+        task is completed (empty values are skipped)
+        Raises an IOError if a task fails
+        '''
+        if len(tasks) == 0:
+            return
+        
+        todo = queue.Queue()
+        for args in tasks:
+            todo.put(args)
+        results = queue.Queue()
+        stop = threading.Event()
+        
+        workers = [threading.Thread(target=self._fetchWorker,
+                                    args=(handler, todo, results,
+                                          function, stop))
+                   for handler in self.handlers[:len(tasks)]]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        
+        try:
+            done = 0
+            while done < len(tasks):
+                if self.killed:
+                    logger.debug('Exiting for a kill signal')
+                    return
+                
+                try:
+                    args, failed, value = results.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                done += 1
+                
+                if failed:
+                    logger.error('KEGG API error, aborting')
+                    raise IOError('KEGG API error')
+                
+                if isinstance(args[0], list):
+                    self._substatus += len(args[0])
+                else:
+                    self._substatus += 1
+                if self._substatus > self._maxsubstatus:
+                    self._substatus = self._maxsubstatus
+                self.updateStatus(sub=True)
+                
+                if not value:
+                    logger.debug('Found an empty handler')
+                    continue
+                
+                callback(args, value)
+        finally:
+            stop.set()
         
     def checkConnection(self):
         '''
         Check if there are connection problems
         First check the two IP addresses, then the URL
         '''
+        if getCache().offline:
+            logger.debug('Offline mode: using the KEGG cache only')
+            return
+        
         check = [KeggAPI().baseurl, KeggAPI()._apiurl]
         online = False
         for addr in check:
@@ -933,567 +1054,140 @@ class BaseMapper(BaseKegg):
         self.result = None
         
     def getReactDetails(self):
-        pieces = [p for p in get_span(list(self.reactdet.keys()), 9)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getTitle,
-                                args = (ids,['ENZYME'],))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for kid, title in list(handler.result.items()):
-                    self.reactdet[kid] = title
+        def merge(args, result):
+            for kid, title in list(result.items()):
+                self.reactdet[kid] = title
+        
+        self.fetchAll(self.apiCall('getTitle'),
+                      self.getChunks(list(self.reactdet.keys()), 9,
+                                     ['ENZYME']),
+                      merge)
     
     def getRPairDetails(self):
-        pieces = [p for p in get_span(list(self.rpairdet.keys()), 9)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                for rid in ids:
-                    self.rpairdet[rid] = [rid.split('_')[0],
-                                          rid.split('_')[1],
-                                          'main']
+        for rid in list(self.rpairdet.keys()):
+            if rid in self.avoid:
+                continue
+            self.rpairdet[rid] = [rid.split('_')[0],
+                                  rid.split('_')[1],
+                                  'main']
+        self._substatus = self._maxsubstatus
+        self.updateStatus(sub=True)
     
     def getPathDetails(self):
-        pieces = [p for p in get_span(list(self.pathdet.keys()), 9)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getTitle,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for kid, title in list(handler.result.items()):
-                    self.pathdet[kid] = title
+        def merge(args, result):
+            for kid, title in list(result.items()):
+                self.pathdet[kid] = title
+        
+        self.fetchAll(self.apiCall('getTitle'),
+                      self.getChunks(list(self.pathdet.keys()), 9),
+                      merge)
     
     def getMapsDetails(self):
-        for piece in get_span(list(self.pathdet.keys()), self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += self.numThreads
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for path in piece:
-                if path in self.avoid:
-                    continue
-                
-                obj = threading.Thread(
-                            target = self.handlers[piece.index(path)].getHTMLColoredPathway,
-                        args = (path,[],[],))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                parser = MapParser(handler.result)
-                self.pathmap[handler.input] = parser.map
+        def merge(args, result):
+            parser = MapParser(result)
+            self.pathmap[args[0]] = parser.map
+        
+        self.fetchAll(self.apiCall('getHTMLColoredPathway'),
+                      [(path, [], [])
+                       for path in list(self.pathdet.keys())
+                       if path not in self.avoid],
+                      merge)
     
     def getPathReactions(self):
-        pieces = [p for p in get_span(list(self.pathdet.keys()), 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getReactionsFromPath,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for path, reacts in list(handler.result.items()):
-                    if path not in self.pathreact:
-                        self.pathreact[path] = reacts
-                reacts = set([v for vs in list(handler.result.values()) for v in vs])
-                for react in reacts:
-                    if react not in self.reactdet:
-                        self.reactdet[react] = None
+        def merge(args, result):
+            for path, reacts in list(result.items()):
+                if path not in self.pathreact:
+                    self.pathreact[path] = reacts
+            reacts = set([v for vs in list(result.values()) for v in vs])
+            for react in reacts:
+                if react not in self.reactdet:
+                    self.reactdet[react] = None
+        
+        self.fetchAll(self.apiCall('getReactionsFromPath'),
+                      self.getChunks(list(self.pathdet.keys()), 80),
+                      merge)
                         
     def getPathCompounds(self):
-        pieces = [p for p in get_span(list(self.pathdet.keys()), 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getCompoundsFromPath,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for path, comps in list(handler.result.items()):
-                    if path not in self.pathcomp:
-                        self.pathcomp[path] = comps
-                comps = set([v for vs in list(handler.result.values()) for v in vs])
-                for comp in comps:
-                    if comp not in self.compdet:
-                        self.compdet[comp] = None
+        def merge(args, result):
+            for path, comps in list(result.items()):
+                if path not in self.pathcomp:
+                    self.pathcomp[path] = comps
+            comps = set([v for vs in list(result.values()) for v in vs])
+            for comp in comps:
+                if comp not in self.compdet:
+                    self.compdet[comp] = None
+        
+        self.fetchAll(self.apiCall('getCompoundsFromPath'),
+                      self.getChunks(list(self.pathdet.keys()), 80),
+                      merge)
                         
     def getCompDetails(self):
-        pieces = [p for p in get_span(list(self.compdet.keys()), 9)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getTitle,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for kid, title in list(handler.result.items()):
-                    self.compdet[kid] = title
+        def merge(args, result):
+            for kid, title in list(result.items()):
+                self.compdet[kid] = title
+        
+        self.fetchAll(self.apiCall('getTitle'),
+                      self.getChunks(list(self.compdet.keys()), 9),
+                      merge)
     
     def getPathways(self):
-        pieces = [p for p in get_span(list(self.reactdet.keys()), 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getPathways,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for react, paths in list(handler.result.items()):
-                    if react not in self.reactpath:
-                        self.reactpath[react] = []
-                    for path in paths:
-                        if path.startswith('path:map'):continue
-                        self.reactpath[react].append(path)
-                paths = set([v for vs in list(handler.result.values()) for v in vs])
+        def merge(args, result):
+            for react, paths in list(result.items()):
+                if react not in self.reactpath:
+                    self.reactpath[react] = []
                 for path in paths:
-                    if path not in self.pathdet and not path.startswith('path:map'):
-                        self.pathdet[path] = None
+                    if path.startswith('path:map'):continue
+                    self.reactpath[react].append(path)
+            paths = set([v for vs in list(result.values()) for v in vs])
+            for path in paths:
+                if path not in self.pathdet and not path.startswith('path:map'):
+                    self.pathdet[path] = None
+        
+        self.fetchAll(self.apiCall('getPathways'),
+                      self.getChunks(list(self.reactdet.keys()), 80),
+                      merge)
                         
     def getReactCompounds(self):
-        pieces = [p for p in get_span(list(self.reactdet.keys()), 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getCompoundsFromReaction,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for react, comps in list(handler.result.items()):
-                    if react not in self.reactcomp:
-                        self.reactcomp[react] = comps
-                comps = set([v for vs in list(handler.result.values()) for v in vs])
-                for comp in comps:
-                    if comp not in self.compdet:
-                        self.compdet[comp] = None
+        def merge(args, result):
+            for react, comps in list(result.items()):
+                if react not in self.reactcomp:
+                    self.reactcomp[react] = comps
+            comps = set([v for vs in list(result.values()) for v in vs])
+            for comp in comps:
+                if comp not in self.compdet:
+                    self.compdet[comp] = None
+        
+        self.fetchAll(self.apiCall('getCompoundsFromReaction'),
+                      self.getChunks(list(self.reactdet.keys()), 80),
+                      merge)
                         
     def getCompoundReacts(self):
-        pieces = [p for p in get_span(list(self.compdet.keys()), 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getReactionsByComp,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for comp, reacts in list(handler.result.items()):
-                    if comp not in self.compreact:
-                        self.compreact[comp] = reacts
-                reacts = set([v for vs in list(handler.result.values()) for v in vs])
-                for react in reacts:
-                    if react not in self.reactdet:
-                        self.reactdet[react] = None
+        def merge(args, result):
+            for comp, reacts in list(result.items()):
+                if comp not in self.compreact:
+                    self.compreact[comp] = reacts
+            reacts = set([v for vs in list(result.values()) for v in vs])
+            for react in reacts:
+                if react not in self.reactdet:
+                    self.reactdet[react] = None
+        
+        self.fetchAll(self.apiCall('getReactionsByComp'),
+                      self.getChunks(list(self.compdet.keys()), 80),
+                      merge)
     
     def getReactRPairs(self):
-        pieces = [p for p in get_span(list(self.reactdet.keys()), 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getRPairsFromReaction,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for react, rpairs in list(handler.result.items()):
-                    if react not in self.reactrpair:
-                        self.reactrpair[react] = rpairs
-                rpairs = set([v for vs in list(handler.result.values()) for v in vs])
-                for rpair in rpairs:
-                    if rpair not in self.rpairdet:
-                        self.rpairdet[rpair] = None
+        def merge(args, result):
+            for react, rpairs in list(result.items()):
+                if react not in self.reactrpair:
+                    self.reactrpair[react] = rpairs
+            rpairs = set([v for vs in list(result.values()) for v in vs])
+            for rpair in rpairs:
+                if rpair not in self.rpairdet:
+                    self.rpairdet[rpair] = None
+        
+        self.fetchAll(self.apiCall('getRPairsFromReaction'),
+                      self.getChunks(list(self.reactdet.keys()), 80),
+                      merge)
 
 class KoMapper(BaseMapper):
     '''
@@ -1529,111 +1223,27 @@ class KoMapper(BaseMapper):
         self.koreact = {}
     
     def getKOdet(self):
-        pieces = [p for p in get_span(self.ko, 9)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getTitle,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for kid, title in list(handler.result.items()):
-                    self.kodet[kid] = title
+        def merge(args, result):
+            for kid, title in list(result.items()):
+                self.kodet[kid] = title
+        
+        self.fetchAll(self.apiCall('getTitle'),
+                      self.getChunks(self.ko, 9),
+                      merge)
                 
     def getReactions(self):
-        pieces = [p for p in get_span(self.ko, 80)]
-        for piece in get_span(pieces, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
-            
-            self.cleanHandlers()
-            self._substatus += len([i for p in piece for i in p])
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
-            
-            threads = []
-            for ids in piece:
-                remove = set()
-                for i in ids:
-                    if i in self.avoid:
-                        remove.add(i)
-                for i in remove:
-                    ids.remove(i)
-                    
-                if len(ids) == 0:
-                    continue
-                
-                obj = threading.Thread(
-                                target = self.getHandler().getReactions,
-                                args = (ids,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
-            
-            if len(threads) == 0:
-                continue
-            
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                for ko, reacts in list(handler.result.items()):
-                    if ko not in self.koreact:
-                        self.koreact[ko] = reacts
-                reacts = set([v for vs in list(handler.result.values()) for v in vs])
-                for react in reacts:
-                    if react not in self.reactdet:
-                        self.reactdet[react] = None
+        def merge(args, result):
+            for ko, reacts in list(result.items()):
+                if ko not in self.koreact:
+                    self.koreact[ko] = reacts
+            reacts = set([v for vs in list(result.values()) for v in vs])
+            for react in reacts:
+                if react not in self.reactdet:
+                    self.reactdet[react] = None
+        
+        self.fetchAll(self.apiCall('getReactions'),
+                      self.getChunks(self.ko, 80),
+                      merge)
     
     def run(self):
         self.updateStatus()
@@ -2118,80 +1728,64 @@ class MapsFetcher(BaseKegg):
             return legend
         return None
     
+    def _getMap(self, handler, path, objs, colors, borders):
+        '''
+        Fetch the colored map and its picture
+        Returns the picture content (None if not available)
+        '''
+        handler.getHTMLColoredPathway(path, objs, colors, borders)
+        if handler.failed or not handler.result:
+            return None
+        
+        # Fetch the map picture
+        # Hoping it won't change much in the future
+        if isinstance(handler.result, bytes):
+            handler.result = handler.result.decode('utf-8')
+        for line in handler.result.split('\n'):
+            if ('<img' in line
+                and 'pathwayimage' in line
+                and 'usemap="#mapdata"' in line):
+                urlimage = 'http://www.kegg.jp/' + line.split('src="')[1].split('"')[0]
+                
+                htmlurl = handler.url
+                try:
+                    return handler.fetch(urlimage, timeout=30)
+                except:
+                    # The picture URL may have expired:
+                    # the colored map will be requested again
+                    handler.cache.delete(htmlurl)
+                    raise
+        
+        return None
+    
     def getMaps(self):
         legend = self.copyLegend()
         
-        for piece in get_span(self.colors, self.numThreads):
-            if self.killed:
-                logger.debug('Exiting for a kill signal')
-                return
+        tasks = []
+        for kmap in self.colors:
+            path = kmap.path
             
-            self.cleanHandlers()
-            self._substatus += self.numThreads
-            if self._substatus > self._maxsubstatus:
-                self._substatus = self._maxsubstatus
-            self.updateStatus(sub=True)
+            # Skip the general maps
+            if path in avoidedPaths:
+                logger.debug('Skipping general pathway %s'%path)
+                continue
+            #
             
-            threads = []
-            for kmap in piece:
-                path = kmap.path
-                
-                # Skip the general maps
-                if path in avoidedPaths:
-                    logger.debug('Skipping general pathway %s'%path)
-                    continue
-                #
-                
-                objs,colors = kmap.getAll()
-                dummy,borders = kmap.getBorders()
-                
-                obj = threading.Thread(
-                        target = self.handlers[piece.index(kmap)].getHTMLColoredPathway,
-                        args = (path,objs,colors,borders,))
-                obj.start()
-                threads.append(obj)
-            time.sleep(0.01)
+            objs,colors = kmap.getAll()
+            dummy,borders = kmap.getBorders()
             
-            if len(threads) == 0:
-                continue
+            tasks.append( (path,objs,colors,borders,) )
+        
+        def save(args, pic):
+            fname = os.path.join(self._keggroom,args[0])
+            fname = fname+'.png'
             
-            while len(threads) > 0:
-                for thread in threads:
-                    if not thread.isAlive():
-                        threads.remove(thread)
-            for handler in self.handlers:
-                if handler.failed:
-                    logger.error('KEGG API error, aborting')
-                    raise IOError('KEGG API error')
-                
-                if not handler.result:
-                    logger.debug('Found an empty handler')
-                    continue
-                
-                fname = os.path.join(self._keggroom,handler.input)
-                fname = fname+'.png'
-                
-                # Fetch the map picture
-                # Hoping it won't change much in the future
-                if isinstance(handler.result, bytes):
-                    handler.result = handler.result.decode('utf-8')
-                for line in handler.result.split('\n'):
-                    if ('<img' in line
-                        and 'pathwayimage' in line
-                        and 'usemap="#mapdata"' in line):
-                        urlimage = 'http://www.kegg.jp/' + line.split('src="')[1].split('"')[0]
-
-                        sock=urlopen(urlimage, timeout=30)
-                        pic = sock.read()
-                        #if isinstance(pic, bytes):
-                        #    pic = pic.decode('utf-8')
-                        sock.close()
-                        
-                        fOut = open(fname,'wb')
-                        fOut.write(pic)
-                        fOut.close()
-                        self.pics.append(fname)
-                #
+            fOut = open(fname,'wb')
+            fOut.write(pic)
+            fOut.close()
+            self.pics.append(fname)
+        
+        self.fetchAll(self._getMap, tasks, save)
     
     def getWebPages(self):
         # TODO: nicer web pages
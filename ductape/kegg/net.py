@@ -6,9 +6,20 @@ Kegg Library
 
 Networks made using Kegg data
 """
+from ductape.common.commonmultiprocess import CommonMultiProcess, Consumer
+from ductape.storage.SQLite.database import Kegg, getNetFile
+from scipy import sparse
+from scipy.sparse import csgraph
 import logging
 import networkx as nx
 import numpy as np
+import os
+import sys
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+import time
 # Nodes color handling
 import matplotlib.colors as pltcls
 import matplotlib.pyplot as plt
@@ -20,6 +31,15 @@ __author__ = "Marco Galardini"
 
 logger = logging.getLogger('ductape.net')
 
+################################################################################
+# Constants
+
+# Project-wide networks, by file name: (mtime, GlobalNet)
+_nets = {}
+
+# Formats of the saved networks
+netFormats = ('npz', 'gml')
+
 ################################################################################
 # Classes
 
@@ -63,67 +83,233 @@ class Reaction(object):
 
 class MetabolicNet(object):
     '''
-    A metabolic network as a networkX graph
+    A metabolic network
     
     Nodes: kegg compounds (w co_id, name; w or w/o weight)
     Edges: kegg reactions (w co1, co2, re_id, name; w or w/o weight)
     
     nodes weight indicate the activity index
     edges weight indicate the copy number 
+    
+    Nodes and edges are held as arrays of compounds indexes (the compounds
+    list is shared with the GlobalNet the network is a view of); the
+    networkX graph (net) is built only when requested
     '''
     def __init__(self, nodes=None, edges=None, name='MetNet'):
         self.name = name
         
-        self.net = nx.Graph()
+        # Compounds (copied before being changed, if shared)
+        self.compounds = []
+        self.coNames = []
+        self.coIndex = {}
+        self._shared = False
+        
+        # Compounds explicitly added as nodes, and their attributes
+        self.named = np.zeros(0, dtype=bool)
+        self.attrs = {}
+        
+        self._setEdges(np.zeros(0, dtype=np.int64),
+                       np.zeros(0, dtype=np.int64),
+                       np.zeros(0, dtype=object),
+                       np.zeros(0, dtype=object),
+                       np.zeros(0, dtype=object))
         
         if nodes:
-            for n in nodes:
-                self.net.add_node(n.co_id, name=n.name)
-                if hasattr(n, 'weight'):
-                    self.net.nodes[n.co_id]['weight'] = n.weight
-                    self.net.nodes[n.co_id]['graphics'] = {'fill': n.getColor()}
+            self.addNodes(nodes)
         
         if edges:
-            for e in edges:
-                self.net.add_edge(e.co1, e.co2, reid=e.re_id, name=e.name)
-                if hasattr(e, 'weight'):
-                    self.net.adj[e.co1][e.co2]['weight'] = e.weight
-                    
+            self.addEdges(edges)
+    
+    def _share(self, glob):
+        '''
+        Use the compounds of a GlobalNet
+        '''
+        self.compounds = glob.compounds
+        self.coNames = glob.coNames
+        self.coIndex = glob.coIndex
+        self._shared = True
+    
+    def _compoundIndex(self, co_id):
+        '''
+        Returns the index of a compound (added if not present)
+        '''
+        i = self.coIndex.get(co_id)
+        if i is None:
+            if self._shared:
+                self.compounds = list(self.compounds)
+                self.coNames = list(self.coNames)
+                self.coIndex = dict(self.coIndex)
+                self._shared = False
+            i = len(self.compounds)
+            self.compounds.append(co_id)
+            self.coNames.append(None)
+            self.coIndex[co_id] = i
+        return i
+    
+    def _setEdges(self, co1, co2, reids, names, weights):
+        '''
+        Set the edges arrays (compounds indexes, reaction IDs, names
+        and weights, None if not present)
+        '''
+        self.co1 = co1
+        self.co2 = co2
+        self.reids = reids
+        self.enames = names
+        self.eweights = weights
+        
+        self._changed()
+    
+    def _changed(self):
+        '''
+        Forget the graph and the components (the network has changed)
+        '''
+        self._net = None
+        self._sizes = None
+        self._pairs = None
+    
+    def _getNamed(self):
+        '''
+        Compounds explicitly added as nodes (boolean mask)
+        '''
+        if len(self.named) < len(self.compounds):
+            named = np.zeros(len(self.compounds), dtype=bool)
+            named[:len(self.named)] = self.named
+            self.named = named
+        return self.named
+    
+    def _getNodes(self):
+        '''
+        Indexes of the compounds in the network
+        (added as nodes or linked by an edge)
+        '''
+        mask = self._getNamed().copy()
+        mask[self.co1] = True
+        mask[self.co2] = True
+        return np.nonzero(mask)[0]
+    
+    def _getPairs(self, edges=None):
+        '''
+        Edges of each distinct compounds pair (the last one,
+        as in the graph); edges restricts the search to those edges
+        '''
+        if edges is None:
+            edges = np.arange(len(self.co1))
+        if len(edges) == 0:
+            return edges
+        
+        co1 = self.co1[edges]
+        co2 = self.co2[edges]
+        keys = (np.minimum(co1, co2) * max(len(self.compounds), 1) +
+                np.maximum(co1, co2))
+        
+        first = np.unique(keys[::-1], return_index=True)[1]
+        return np.sort(edges[len(edges) - 1 - first])
+    
+    def _getAllPairs(self):
+        '''
+        Edges of each distinct compounds pair (see _getPairs)
+        '''
+        if self._pairs is None:
+            self._pairs = self._getPairs()
+        return self._pairs
+    
+    def _buildGraph(self):
+        '''
+        Build the networkX graph
+        '''
+        net = nx.Graph()
+        
+        named = self._getNamed()
+        for i in self._getNodes():
+            attrs = {}
+            if named[i] and self.coNames[i] is not None:
+                attrs['name'] = self.coNames[i]
+            attrs.update(self.attrs.get(i, {}))
+            net.add_node(self.compounds[i], **attrs)
+        
+        for i in range(len(self.co1)):
+            co1 = self.compounds[self.co1[i]]
+            co2 = self.compounds[self.co2[i]]
+            net.add_edge(co1, co2, reid=self.reids[i], name=self.enames[i])
+            if self.eweights[i] is not None:
+                net.adj[co1][co2]['weight'] = self.eweights[i]
+        
+        return net
+    
+    @property
+    def net(self):
+        '''
+        The networkX graph (built when first requested)
+        '''
+        if self._net is None:
+            self._net = self._buildGraph()
+        return self._net
+    
     def hasNodesWeight(self):
         '''
         At least one node has weight?
         '''
-        for co in self.net.nodes():
-            try:
-                self.net.nodes[co]['weight']
+        for attrs in self.attrs.values():
+            if 'weight' in attrs:
                 return True
-            except:pass
-            
+        
         return False
     
     def hasEdgesWeight(self):
         '''
         At least one edge has weight?
         '''
-        for e in self.net.edges():
-            if 'weight' in self.net.adj[e[0]][e[1]]:
+        for w in self.eweights:
+            if w is not None:
                 return True
-
+        
         return False
     
     def removeSingletons(self):
         '''
         Remove nodes with degree 0
         '''
-        to_remove = [x for x in self.net.nodes() if self.net.degree()[x] == 0]
-        self.net.remove_nodes_from(to_remove)
-            
+        named = self._getNamed()
+        linked = np.zeros(len(named), dtype=bool)
+        linked[self.co1] = True
+        linked[self.co2] = True
+        for i in np.nonzero(named & ~linked)[0]:
+            self.attrs.pop(i, None)
+        
+        self.named = named & linked
+        
+        self._changed()
+    
     def setNet(self, net):
         '''
         Use an external networkx graph
         '''
-        self.net = net
-                    
+        self.compounds = []
+        self.coNames = []
+        self.coIndex = {}
+        self._shared = False
+        self.named = np.zeros(0, dtype=bool)
+        self.attrs = {}
+        
+        for co_id, attrs in net.nodes(data=True):
+            i = self._compoundIndex(co_id)
+            self.attrs[i] = dict(attrs)
+        self.named = np.ones(len(self.compounds), dtype=bool)
+        
+        edges = list(net.edges(data=True))
+        self._setEdges(np.array([self.coIndex[e[0]] for e in edges],
+                                dtype=np.int64),
+                       np.array([self.coIndex[e[1]] for e in edges],
+                                dtype=np.int64),
+                       np.array([e[2].get('reid') for e in edges],
+                                dtype=object),
+                       np.array([e[2].get('name') for e in edges],
+                                dtype=object),
+                       np.array([e[2].get('weight') for e in edges],
+                                dtype=object))
+        
+        self._net = net
+    
     def addNodes(self, nodes):
         '''
         Takes a compounds iterable and adds (or updates) the nodes
@@ -131,45 +317,73 @@ class MetabolicNet(object):
         nodes weight indicate the activity index
         '''
         for n in nodes:
-            self.net.add_node(n.co_id, name=n.name)
+            i = self._compoundIndex(n.co_id)
+            self._getNamed()[i] = True
+            
+            attrs = self.attrs.setdefault(i, {})
+            attrs['name'] = n.name
             if hasattr(n, 'weight'):
-                self.net.nodes[n.co_id]['weight'] = n.weight
-                self.net.nodes[n.co_id]['graphics'] = {'fill': n.getColor()}
-                
+                attrs['weight'] = n.weight
+                attrs['graphics'] = {'fill': n.getColor()}
+        
+        self._changed()
+    
+    def addEdges(self, edges):
+        '''
+        Takes a reactions iterable and adds the edges
+        w co1, co2, re_id, name; w or w/o weight attributes
+        edges weight indicate the copy number
+        '''
+        co1, co2, reids, names, weights = [], [], [], [], []
+        for e in edges:
+            co1.append(self._compoundIndex(e.co1))
+            co2.append(self._compoundIndex(e.co2))
+            reids.append(e.re_id)
+            names.append(e.name)
+            weights.append(getattr(e, 'weight', None))
+        
+        if len(co1) == 0:
+            return
+        
+        self._setEdges(np.concatenate((self.co1,
+                                       np.array(co1, dtype=np.int64))),
+                       np.concatenate((self.co2,
+                                       np.array(co2, dtype=np.int64))),
+                       np.concatenate((self.reids,
+                                       np.array(reids, dtype=object))),
+                       np.concatenate((self.enames,
+                                       np.array(names, dtype=object))),
+                       np.concatenate((self.eweights,
+                                       np.array(weights, dtype=object))))
+    
     def __len__(self):
         '''
         Returns the number of reactions
         '''
-        i = 0
-        for e in self.net.edges():
-            if 'weight' in self.net.adj[e[0]][e[1]]:
-                i += self.net.adj[e[0]][e[1]]['weight']
-            else:
-                i += 1
-                
-        return i
+        pairs = self._getAllPairs()
+        if not self.hasEdgesWeight():
+            return len(pairs)
+        
+        weighted = np.array([w is not None for w in self.eweights],
+                            dtype=bool)
+        wpairs = self._getPairs(np.nonzero(weighted)[0])
+        
+        return (len(pairs) - len(wpairs) +
+                sum([self.eweights[i] for i in wpairs]))
     
     def getDistinctReactions(self):
         '''
         Returns the distinct reaction IDs of this network
         '''
-        re_id = set()
-        for e in self.net.edges():
-            re_id.add(self.net.adj[e[0]][e[1]]['reid'])
-        
-        return re_id
+        return set(self.reids[self._getAllPairs()])
     
     def mean(self):
         '''
-        Get the mean compounds activity (nodes weight)  
+        Get the mean compounds activity (nodes weight)
         '''
-        weights = []
+        weights = [attrs['weight'] for attrs in self.attrs.values()
+                   if 'weight' in attrs]
         
-        for co in self.net.nodes():
-            try:
-                weights.append(self.net.nodes[co]['weight'])
-            except:pass
-            
         if len(weights) == 0:
             return np.nan
         
@@ -177,30 +391,579 @@ class MetabolicNet(object):
     
     def std(self):
         '''
-        Get the stddev compounds activity (nodes weight)  
+        Get the stddev compounds activity (nodes weight)
         '''
-        weights = []
+        weights = [attrs['weight'] for attrs in self.attrs.values()
+                   if 'weight' in attrs]
         
-        for co in self.net.nodes():
-            try:
-                weights.append(self.net.nodes[co]['weight'])
-            except:pass
-            
         if len(weights) == 0:
             return np.nan
         
         return np.array(weights).std()
-
+    
+    def _getComponentsSizes(self):
+        '''
+        Size of each connected component
+        '''
+        if self._sizes is not None:
+            return self._sizes
+        
+        nodes = self._getNodes()
+        if len(nodes) == 0:
+            self._sizes = np.zeros(0, dtype=np.int64)
+            return self._sizes
+        
+        # Symmetric adjacency matrix of the nodes (built directly as CSR)
+        local = np.zeros(len(self.compounds), dtype=np.int32)
+        local[nodes] = np.arange(len(nodes), dtype=np.int32)
+        rows = np.concatenate((local[self.co1], local[self.co2]))
+        cols = np.concatenate((local[self.co2], local[self.co1]))
+        order = np.argsort(rows, kind='mergesort')
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=len(nodes)))
+        adj = sparse.csr_matrix((np.ones(len(rows)), cols[order], indptr),
+                                shape=(len(nodes), len(nodes)))
+        
+        # Being symmetric, the strong components are the connected ones
+        ncomp, labels = csgraph.connected_components(adj, directed=True,
+                                                     connection='strong')
+        
+        # Components sorted by their first node
+        first = np.unique(labels, return_index=True)[1]
+        self._sizes = np.bincount(labels, minlength=ncomp)[np.argsort(first)]
+        return self._sizes
+    
     def getComponents(self):
-        return len(list(nx.connected_components(self.net)))
+        return len(self._getComponentsSizes())
     
     def getComponentsSizes(self):
-        return [len(x) for x in nx.connected_components(self.net)]
+        return [int(x) for x in self._getComponentsSizes()]
     
     def getComponentsMean(self):
-        return np.array([len(x)
-                         for x in nx.connected_components(self.net)]).mean()
-                         
+        return self._getComponentsSizes().mean()
+    
     def getComponentsStd(self):
-        return np.array([len(x)
-                         for x in nx.connected_components(self.net)]).std()
+        return self._getComponentsSizes().std()
+
+    def toArrays(self):
+        '''
+        Compact version of the network, as a dictionary of arrays
+        (nodes and their attributes, edges as pairs of nodes indexes)
+        
+        Each compounds pair is linked by a single edge, as in the graph
+        missing names are empty and flagged in the *Null arrays,
+        missing weights are NaN
+        '''
+        nodes = self._getNodes()
+        local = np.zeros(len(self.compounds), dtype=np.int32)
+        local[nodes] = np.arange(len(nodes), dtype=np.int32)
+        
+        named = self._getNamed()
+        names, weights, colors = [], [], []
+        for i in nodes:
+            attrs = self.attrs.get(i, {})
+            if named[i] and self.coNames[i] is not None:
+                names.append(attrs.get('name', self.coNames[i]))
+            else:
+                names.append(attrs.get('name'))
+            weights.append(attrs.get('weight', np.nan))
+            colors.append(attrs.get('graphics', {}).get('fill', ''))
+        nodeName, nodeNull = _packStrings(names)
+        
+        # One edge for each pair, in the order the pairs first appear,
+        # with the attributes of the last edge
+        edges = np.arange(len(self.co1))
+        first = edges
+        if len(edges) > 0:
+            keys = (np.minimum(self.co1, self.co2) *
+                    max(len(self.compounds), 1) +
+                    np.maximum(self.co1, self.co2))
+            first = np.sort(np.unique(keys, return_index=True)[1])
+            last = dict(zip(keys, edges))
+            edges = np.array([last[k] for k in keys[first]], dtype=np.int64)
+        edgeName, edgeNull = _packStrings(self.enames[edges])
+        
+        return {'name':np.array(self.name, dtype=str),
+                'nodes':np.array([self.compounds[i] for i in nodes],
+                                 dtype=str),
+                'nodeName':nodeName, 'nodeNull':nodeNull,
+                'nodeWeight':np.array(weights, dtype=float),
+                'nodeColor':np.array(colors, dtype=str),
+                'source':local[self.co1[first]],
+                'target':local[self.co2[first]],
+                'reids':np.array(list(self.reids[edges]), dtype=str),
+                'edgeName':edgeName, 'edgeNull':edgeNull,
+                'edgeWeight':np.array([np.nan if w is None else w
+                                       for w in self.eweights[edges]],
+                                      dtype=float)}
+
+class GlobalNet(object):
+    '''
+    Project-wide metabolic network
+    
+    All the compounds (the ones from the compounds table first) and all
+    the "main" RPairs reactions (edges, as compounds indexes)
+    pathComps (pathways x compounds) and pathReacts (pathways x reactions)
+    are sparse incidence matrices, edgeReact maps each edge to its reaction
+    
+    The networks of the pathways and organisms are views of it
+    (see getNet)
+    '''
+    def __init__(self, compounds, coNames, nnamed, co1, co2, reids, enames,
+                 paths, pathComps, pathReacts):
+        self.compounds = list(compounds)
+        self.coNames = list(coNames)
+        self.coIndex = dict([(co_id, i)
+                             for i, co_id in enumerate(self.compounds)])
+        self.nnamed = nnamed
+        
+        self.co1 = co1
+        self.co2 = co2
+        self.reids = np.array(reids, dtype=object)
+        self.enames = np.array(enames, dtype=object)
+        
+        self.reacts = sorted(set(self.reids))
+        self.reactIndex = dict([(re_id, i)
+                                for i, re_id in enumerate(self.reacts)])
+        self.edgeReact = np.array([self.reactIndex[re_id]
+                                   for re_id in self.reids], dtype=np.int64)
+        
+        self.paths = list(paths)
+        self.pathIndex = dict([(path_id, i)
+                               for i, path_id in enumerate(self.paths)])
+        self.pathComps = pathComps.tocsr()
+        self.pathReacts = pathReacts.tocsr()
+        
+        # Organism x reaction matrix columns of the reactions
+        self._matrix = None
+    
+    def _getPathRow(self, matrix, path_id):
+        '''
+        Column indexes of a pathway row of pathComps or pathReacts
+        '''
+        if path_id not in self.pathIndex:
+            return np.zeros(0, dtype=np.int64)
+        
+        i = self.pathIndex[path_id]
+        return matrix.indices[matrix.indptr[i]:matrix.indptr[i+1]]
+    
+    def _getPathEdges(self, path_id):
+        '''
+        Indexes of the edges of a pathway
+        '''
+        inpath = np.zeros(len(self.reacts), dtype=bool)
+        inpath[self._getPathRow(self.pathReacts, path_id)] = True
+        return np.nonzero(inpath[self.edgeReact])[0]
+    
+    def _getPathNamed(self, path_id):
+        '''
+        Compounds of a pathway (boolean mask)
+        '''
+        named = np.zeros(len(self.compounds), dtype=bool)
+        named[self._getPathRow(self.pathComps, path_id)] = True
+        return named
+    
+    def getOrgReacts(self, matrix, org_id):
+        '''
+        Reactions of an organism (boolean mask of reacts, see getNet)
+        matrix: organism x reaction matrix (see Kegg.getReactMatrix)
+        '''
+        if self._matrix is None or self._matrix[0] is not matrix:
+            cols = np.array([matrix.reactIndex.get(re_id, -1)
+                             for re_id in self.reacts], dtype=np.int64)
+            self._matrix = (matrix, cols >= 0, cols[cols >= 0])
+        present, cols = self._matrix[1:]
+        
+        mask = np.zeros(len(self.reacts), dtype=bool)
+        if org_id in matrix.orgIndex:
+            mask[present] = matrix.presence[matrix.orgIndex[org_id]][cols]
+        return mask
+    
+    def getNet(self, path_id=None, reacts=None, edges=None, name='MetNet'):
+        '''
+        Get a view of the network
+        path_id: only the compounds and reactions of this pathway
+        reacts: only the edges of these reactions (boolean mask of reacts)
+        edges: use these edges instead (reactions iterable, as MetabolicNet)
+        '''
+        net = MetabolicNet(name=name)
+        net._share(self)
+        
+        if path_id:
+            net.named = self._getPathNamed(path_id)
+        else:
+            net.named = np.zeros(len(self.compounds), dtype=bool)
+            net.named[:self.nnamed] = True
+        
+        if edges is not None:
+            net.addEdges(edges)
+            return net
+        
+        if path_id:
+            idx = self._getPathEdges(path_id)
+        else:
+            idx = np.arange(len(self.co1))
+        
+        if reacts is not None:
+            idx = idx[reacts[self.edgeReact[idx]]]
+        
+        net._setEdges(self.co1[idx], self.co2[idx],
+                      self.reids[idx], self.enames[idx],
+                      np.empty(len(idx), dtype=object))
+        
+        return net
+    
+    @classmethod
+    def build(cls, project):
+        '''
+        Compute the network from the project
+        '''
+        kegg = Kegg(project)
+        
+        compounds = []
+        coNames = []
+        for c in kegg.getAllCompounds():
+            compounds.append(c.co_id)
+            coNames.append(c.name)
+        nnamed = len(compounds)
+        coIndex = dict([(co_id, i) for i, co_id in enumerate(compounds)])
+        
+        co1, co2, reids, enames = [], [], [], []
+        for r in kegg.getAllRPairsReacts():
+            for co_id in (r.co1, r.co2):
+                if co_id not in coIndex:
+                    coIndex[co_id] = len(compounds)
+                    compounds.append(co_id)
+                    coNames.append(None)
+            co1.append(coIndex[r.co1])
+            co2.append(coIndex[r.co2])
+            reids.append(r.re_id)
+            enames.append(r.name)
+        
+        pcomps = [(x.path_id, coIndex[x.co_id])
+                  for x in kegg.getPathComps()
+                  if coIndex.get(x.co_id, nnamed) < nnamed]
+        reactIndex = dict([(re_id, i)
+                           for i, re_id in enumerate(sorted(set(reids)))])
+        preacts = [(x.path_id, reactIndex[x.re_id])
+                   for x in kegg.getPathReacts()
+                   if x.re_id in reactIndex]
+        
+        paths = sorted(set([x[0] for x in pcomps] + [x[0] for x in preacts]))
+        pathIndex = dict([(path_id, i) for i, path_id in enumerate(paths)])
+        
+        pathComps = _incidence([pathIndex[x[0]] for x in pcomps],
+                               [x[1] for x in pcomps],
+                               (len(paths), len(compounds)))
+        pathReacts = _incidence([pathIndex[x[0]] for x in preacts],
+                                [x[1] for x in preacts],
+                                (len(paths), len(reactIndex)))
+        
+        return cls(compounds, coNames, nnamed,
+                   np.array(co1, dtype=np.int64),
+                   np.array(co2, dtype=np.int64),
+                   reids, enames, paths, pathComps, pathReacts)
+    
+    def save(self, fname):
+        '''
+        Save the network (the file is replaced at once)
+        '''
+        coNames, coNull = _packStrings(self.coNames)
+        enames, eNull = _packStrings(self.enames)
+        pathComps = self.pathComps.tocoo()
+        pathReacts = self.pathReacts.tocoo()
+        
+        tmp = fname + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            np.savez_compressed(f,
+                                compounds=np.array(self.compounds, dtype=str),
+                                coNames=coNames, coNull=coNull,
+                                nnamed=np.array(self.nnamed),
+                                co1=self.co1, co2=self.co2,
+                                reids=np.array(list(self.reids), dtype=str),
+                                enames=enames, eNull=eNull,
+                                paths=np.array(self.paths, dtype=str),
+                                pcPath=pathComps.row, pcComp=pathComps.col,
+                                prPath=pathReacts.row,
+                                prReact=pathReacts.col,
+                                nreacts=np.array(len(self.reacts)))
+        finally:
+            f.close()
+        
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmp, fname)
+    
+    @classmethod
+    def load(cls, fname):
+        '''
+        Load a network saved with save()
+        '''
+        data = np.load(fname)
+        try:
+            compounds = [str(x) for x in data['compounds']]
+            paths = [str(x) for x in data['paths']]
+            net = cls(compounds,
+                      _unpackStrings(data['coNames'], data['coNull']),
+                      int(data['nnamed']),
+                      data['co1'], data['co2'],
+                      [str(x) for x in data['reids']],
+                      _unpackStrings(data['enames'], data['eNull']),
+                      paths,
+                      _incidence(data['pcPath'], data['pcComp'],
+                                 (len(paths), len(compounds))),
+                      _incidence(data['prPath'], data['prReact'],
+                                 (len(paths), int(data['nreacts']))))
+        finally:
+            data.close()
+        return net
+
+class NetWriter(object):
+    '''
+    Writes a network (see MetabolicNet.toArrays) in the desired formats
+    (fname is without extension); it runs in a worker process
+    '''
+    def __init__(self, arrays, fname, formats=('npz',)):
+        self.arrays = arrays
+        self.fname = fname
+        self.formats = formats
+    
+    def __call__(self):
+        for fmt in self.formats:
+            if fmt == 'npz':
+                writeNetArrays(self.arrays, self.fname + '.npz')
+            elif fmt == 'gml':
+                writeGML(arraysToGraph(self.arrays), self.fname + '.gml')
+            else:
+                raise Exception('Unknown network format %s'%fmt)
+        return self.fname
+
+class NetExporter(CommonMultiProcess):
+    '''
+    Class NetExporter
+    Saves the networks using a pool of ncpus worker processes
+    (the networks are sent to the workers as arrays, see NetWriter)
+    
+    formats: npz (compact edges list and nodes attributes, see readNet)
+             gml (slower, bigger)
+    '''
+    def __init__(self, formats=('npz',), ncpus=1, queue=queue.Queue()):
+        CommonMultiProcess.__init__(self,ncpus,queue)
+        
+        for fmt in formats:
+            if fmt not in netFormats:
+                logger.warning('Unknown network format %s'%fmt)
+                raise Exception('Unknown network format %s'%fmt)
+        self.formats = tuple(formats)
+        
+        # Maximum number of networks waiting for each worker
+        self.backlog = 8
+        
+        # Networks being written, by task ID
+        self._pending = {}
+        
+        self.written = 0
+        self.failed = 0
+    
+    def initiateParallel(self, workers=None):
+        '''
+        Daemon workers, not to be left behind if the analysis fails
+        '''
+        if workers is None:
+            workers = self.ncpus
+        self._parallel = [Consumer(self._paralleltasks,self._parallelresults)
+                          for x in range(workers)]
+        for consumer in self._parallel:
+            consumer.daemon = True
+            consumer.start()
+    
+    def _check(self, fname, error=None):
+        if error is not None:
+            logger.warning('Could not save network %s (%s)'%(fname, error))
+            self.failed += 1
+        else:
+            logger.debug('Saved network %s'%fname)
+            self.written += 1
+    
+    def _drain(self, limit):
+        '''
+        Collect the results until at most limit networks are pending
+        '''
+        while len(self._futures) > limit:
+            future = self.collect(0.1)
+            if future is not None:
+                fname = self._pending.pop(future.taskid)
+                try:
+                    future.result()
+                    self._check(fname)
+                except Exception as e:
+                    self._check(fname, e)
+                continue
+            
+            if not all([c.is_alive() for c in self._parallel]):
+                logger.error('A worker has died unexpectedly')
+                self.failed += len(self._futures)
+                self._pending = {}
+                self.killParallel()
+                return
+    
+    def write(self, net, path, name):
+        '''
+        Save a network in the desired location
+        (name is without extension)
+        '''
+        task = NetWriter(net.toArrays(), os.path.join(path, name),
+                         self.formats)
+        
+        if self.ncpus <= 1:
+            try:
+                task()
+                self._check(task.fname)
+            except Exception as e:
+                self._check(task.fname, e)
+            return
+        
+        future = self.submit(task)
+        self._pending[future.taskid] = task.fname
+        self._drain(self.ncpus * self.backlog)
+    
+    def close(self):
+        '''
+        Waits for the pending networks and stops the workers
+        Returns False if some network could not be saved
+        '''
+        if self._pool:
+            self._drain(0)
+            self.stopPool()
+        
+        logger.debug('Saved %d networks (%d failed)'%(self.written,
+                                                     self.failed))
+        
+        return self.failed == 0
+
+################################################################################
+# Methods
+
+def arraysToGraph(arrays):
+    '''
+    Build the networkX graph from the arrays of a network
+    (see MetabolicNet.toArrays)
+    '''
+    net = nx.Graph()
+    
+    nodes = [str(x) for x in arrays['nodes']]
+    names = _unpackStrings(arrays['nodeName'], arrays['nodeNull'])
+    for co_id, name, weight, color in zip(nodes, names,
+                                          arrays['nodeWeight'],
+                                          arrays['nodeColor']):
+        attrs = {}
+        if name is not None:
+            attrs['name'] = name
+        if not np.isnan(weight):
+            attrs['weight'] = float(weight)
+            attrs['graphics'] = {'fill': str(color)}
+        net.add_node(co_id, **attrs)
+    
+    names = _unpackStrings(arrays['edgeName'], arrays['edgeNull'])
+    for source, target, reid, name, weight in zip(arrays['source'],
+                                                  arrays['target'],
+                                                  arrays['reids'], names,
+                                                  arrays['edgeWeight']):
+        attrs = {'reid':str(reid), 'name':name}
+        if not np.isnan(weight):
+            attrs['weight'] = float(weight)
+        net.add_edge(nodes[source], nodes[target], **attrs)
+    
+    return net
+
+def writeGML(net, fname):
+    '''
+    Save a networkX graph as a gml file
+    '''
+    try:
+        nx.write_gml(net, fname, nx.readwrite.gml.literal_stringizer)
+    except AttributeError:
+        # old version of networkx
+        nx.write_gml(net, fname)
+
+def writeNetArrays(arrays, fname):
+    '''
+    Save the arrays of a network (see MetabolicNet.toArrays)
+    as a compressed numpy file
+    '''
+    f = open(fname, 'wb')
+    try:
+        np.savez_compressed(f, **arrays)
+    finally:
+        f.close()
+
+def readNet(fname):
+    '''
+    Read a network saved in the npz format, as a networkX graph
+    '''
+    data = np.load(fname)
+    try:
+        arrays = dict([(k, data[k]) for k in data.files])
+    finally:
+        data.close()
+    return arraysToGraph(arrays)
+
+def _incidence(rows, cols, shape):
+    '''
+    Boolean sparse matrix from the coordinates of the True values
+    '''
+    return sparse.csr_matrix((np.ones(len(rows), dtype=bool),
+                              (np.array(rows, dtype=np.int64),
+                               np.array(cols, dtype=np.int64))),
+                             shape=shape)
+
+def _packStrings(values):
+    '''
+    Strings array and missing values (None) mask
+    '''
+    return (np.array(['' if x is None else str(x) for x in values], dtype=str),
+            np.array([x is None for x in values], dtype=bool))
+
+def _unpackStrings(values, null):
+    '''
+    Inverse of _packStrings
+    '''
+    return [None if n else str(x) for x, n in zip(values, null)]
+
+def getGlobalNet(project):
+    '''
+    Get the project-wide metabolic network (see GlobalNet)
+    The network is saved next to the project and computed again only
+    after the KEGG data changes
+    '''
+    fname = getNetFile(project)
+    try:
+        mtime = os.path.getmtime(fname)
+    except OSError:
+        mtime = None
+    
+    if mtime is not None:
+        cached = _nets.get(fname)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        try:
+            net = GlobalNet.load(fname)
+            _nets[fname] = (mtime, net)
+            return net
+        except Exception as e:
+            logger.debug('Could not load %s (%s)'%(fname, e))
+    
+    start = time.time()
+    net = GlobalNet.build(project)
+    logger.debug('Project-wide metabolic network: %d compounds, %d edges (%.2fs)'%
+                 (len(net.compounds), len(net.co1), time.time() - start))
+    
+    try:
+        net.save(fname)
+        _nets[fname] = (os.path.getmtime(fname), net)
+    except (IOError, OSError) as e:
+        logger.debug('Could not save %s (%s)'%(fname, e))
+    
+    return net
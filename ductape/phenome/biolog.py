@@ -7,8 +7,9 @@ Phenome library
 Classes to handle Biolog data
 """
 from ductape import __email__
+from ductape.common.commonmultiprocess import CommonMultiProcess
 from ductape.common.commonthread import CommonThread
-from ductape.common.utils import smooth, compress
+from ductape.common.utils import smooth, compress, get_span
 from matplotlib import cm
 from matplotlib import colors
 import sys
@@ -202,20 +203,44 @@ class Well(object):
             logger.warning('Plate %s, Well %s was already compressed'%
                           (self.plate_id, self.well_id))
     
+    def getFitData(self):
+        '''
+        Prepare the signals for the parameters calculation
+        (compression and smoothing are applied if needed)
+        Returns a tuple with the time and signals arrays
+        '''
+        if not self.compressed:
+            self.compress()
+        if not self.smoothed:
+            self.smooth(window_len=11, window_type='blackman')
+        
+        xdata = np.array( [x for x in sorted(self.signals.keys())] )
+        ydata = np.array( [self.signals[x] for x in xdata] )
+        
+        return xdata, ydata
+    
     def calculateParams(self,
                             noCompress = False, noSmooth = False):
         '''
         Populates the parameters values for the experiment
         By default compression and smoothing are applied to save some time
         '''
+        from ductape.phenome.fitting import fitData
+        
+        xdata, ydata = self.getFitData()
+        
+        # Let's go with the function fitting
+        self.setFitParams(xdata, ydata, *fitData(xdata, ydata))
+    
+    def setFitParams(self, xdata, ydata, fitparams, model):
+        '''
+        Populates the parameters values, given the fitted parameters
+        (plateau, slope, lag, v, y0) and the model used
+        xdata and ydata should come from getFitData
+        '''
         from scipy.integrate import trapz
-        from ductape.phenome.fitting import fitData, getFlex, getPlateau
-       
-        if not self.compressed:
-            self.compress()
-        if not self.smoothed:
-            self.smooth(window_len=11, window_type='blackman')
-            
+        from ductape.phenome.fitting import getFlex, getPlateau
+        
         # Let's start with the easy ones!
         self.max = self.getMax()
         
@@ -223,10 +248,7 @@ class Well(object):
         
         self.height = np.array( list(self.signals.values()) ).mean()
         
-        # Let's go with the function fitting
-        xdata = np.array( [x for x in sorted(self.signals.keys())] )
-        ydata = np.array( [self.signals[x] for x in xdata] )
-        (self.plateau, self.slope, self.lag, v, y0), self.model = fitData(xdata, ydata)
+        (self.plateau, self.slope, self.lag, v, y0), self.model = fitparams, model
         
         # May be needed for debugging purposes
         # or to plot some fitting data
@@ -786,7 +808,8 @@ class Experiment(object):
         pass
     
     def __init__(self, exp_id='', name='', plates=[], zero=False,
-                 category = {}, categorder = [], zeroPlates=set()):
+                 category = {}, categorder = [], zeroPlates=set(),
+                 matrix=None):
         self.exp_id = exp_id
         self.name = name
         
@@ -795,17 +818,24 @@ class Experiment(object):
         self.categorder = categorder
         self.zeroPlates = zeroPlates
         
-        self.plates = {}
-        for plate in plates:
-            if not self._addPlate(plate):
-                self.plates = {}
-                break
+        # PhenomeMatrix object: if provided, the Plate and Well objects
+        # are created only when needed
+        self.matrix = matrix
+        
+        self._plates = None
+        if self.matrix is None:
+            self._plates = {}
+            for plate in plates:
+                if not self._addPlate(plate):
+                    self._plates = {}
+                    break
         
         self.maxParams = {}
         
-        self.experiment = {}
-        self.sumexp = {}
-        self._organize()
+        self._experiment = None
+        self._sumexp = None
+        if self.matrix is None:
+            self._organize()
         
         # Allowed policies for purging of replicas
         self.policies = ['keep-min', 'keep-max',
@@ -816,6 +846,51 @@ class Experiment(object):
         
         self.discarded = set()
     
+    @property
+    def plates(self):
+        if self._plates is None:
+            self._plates = {}
+            for plate in self.matrix.getPlates():
+                self._addPlate(plate)
+        return self._plates
+    
+    @plates.setter
+    def plates(self, value):
+        self._plates = value
+    
+    @property
+    def experiment(self):
+        if self._experiment is None:
+            self._organize()
+        return self._experiment
+    
+    @experiment.setter
+    def experiment(self, value):
+        self._experiment = value
+    
+    @property
+    def sumexp(self):
+        if self._sumexp is None:
+            if self._isMatrix():
+                # Averages straight from the matrix
+                self._sumexp = self.matrix.getAverageWells()
+            else:
+                self._organize()
+        return self._sumexp
+    
+    @sumexp.setter
+    def sumexp(self, value):
+        self._sumexp = value
+    
+    def _isMatrix(self):
+        '''
+        Can we answer using the matrix only?
+        (i.e. no Plate object has been created and no Well object
+        has been kept by the matrix yet)
+        '''
+        return (self.matrix is not None and self._plates is None and
+                not self.matrix.isCached())
+    
     def _addPlate(self, plate):
         if plate.plate_id not in self.plates:
             self.plates[plate.plate_id] = plate
@@ -828,46 +903,60 @@ class Experiment(object):
     def _organize(self):
         '''
         Organize the whole experiment in a dictionary-based structure
+        (the averaged one is left untouched if already there)
         '''
+        experiment = {}
         for w in self.getWells(params=False):
-            if w.plate_id not in self.experiment:
-                self.experiment[w.plate_id] = {}
-                self.sumexp[w.plate_id] = {}
-            if w.well_id not in self.experiment[w.plate_id]:
-                self.experiment[w.plate_id][w.well_id] = {}
-                self.sumexp[w.plate_id][w.well_id] = {}
-            if w.strain not in self.experiment[w.plate_id][w.well_id]:
-                self.experiment[w.plate_id][w.well_id][w.strain] = {}
-                
-                fakeWell = Well(w.plate_id, w.well_id)
-                fakeWell.strain = w.strain 
-                self.sumexp[w.plate_id][w.well_id][w.strain] = fakeWell
-            
-            self.experiment[w.plate_id][w.well_id][w.strain][w.replica] = w
+            if w.plate_id not in experiment:
+                experiment[w.plate_id] = {}
+            if w.well_id not in experiment[w.plate_id]:
+                experiment[w.plate_id][w.well_id] = {}
+            if w.strain not in experiment[w.plate_id][w.well_id]:
+                experiment[w.plate_id][w.well_id][w.strain] = {}
             
+            experiment[w.plate_id][w.well_id][w.strain][w.replica] = w
+        self._experiment = experiment
+        
+        if self._sumexp is not None:
+            return
+        
+        sumexp = {}
+        for pid in experiment:
+            sumexp[pid] = {}
+            for wid in experiment[pid]:
+                sumexp[pid][wid] = {}
+                for org in experiment[pid][wid]:
+                    fakeWell = Well(pid, wid)
+                    fakeWell.strain = org
+                    sumexp[pid][wid][org] = fakeWell
+        
         # For each well, if each replica has an activity, add its value
         # to the averaged dictionary
-        for pid in self.sumexp:
-            for wid in self.sumexp[pid]:
-                for org in self.sumexp[pid][wid]:
-                    reps = list(self.experiment[pid][wid][org].keys())
+        for pid in sumexp:
+            for wid in sumexp[pid]:
+                for org in sumexp[pid][wid]:
+                    reps = list(experiment[pid][wid][org].keys())
                     
                     # Keep track of all mean parameters
                     for param in Well('phony', 'phony').params + ['activity']:
                         act = []
                         for r in reps:
-                            if getattr(self.experiment[pid][wid][org][r], param) is None:
+                            if getattr(experiment[pid][wid][org][r], param) is None:
                                 break
-                            act.append(getattr(self.experiment[pid][wid][org][r], param))
+                            act.append(getattr(experiment[pid][wid][org][r], param))
                         
                         if len(act) > 0:
                             mean = np.array(act).mean()
-                            setattr(self.sumexp[pid][wid][org], param, mean)
+                            setattr(sumexp[pid][wid][org], param, mean)
+        self._sumexp = sumexp
     
     def getMax(self):
         '''
         Get the maximum signal value of the whole experiment
         '''
+        if self._isMatrix():
+            return self.matrix.getMax()
+        
         return max([plate.getMax()
                     for plate_id, Plate in list(self.plates.items())
                     for strain, plates in list(Plate.strains.items())
@@ -964,9 +1053,8 @@ class Experiment(object):
         if params is set to False, it just gives you the wells,
         otherwise it calculates them
         '''
-        for well in self.getWells(params):
-            if well.plate_id in self.zeroPlates:
-                yield well
+        for well in self.getWells(params, plates=self.zeroPlates):
+            yield well
                 
     def getNoZeroWells(self, params=True):
         '''
@@ -974,9 +1062,10 @@ class Experiment(object):
         if params is set to False, it just gives you the wells,
         otherwise it calculates them
         '''
-        for well in self.getWells(params):
-            if well.plate_id not in self.zeroPlates:
-                yield well
+        plates = [plate_id for plate_id in self._getPlateIDs()
+                  if plate_id not in self.zeroPlates]
+        for well in self.getWells(params, plates=plates):
+            yield well
                 
     def getCategoryWells(self, params=True):
         '''
@@ -986,24 +1075,54 @@ class Experiment(object):
         '''
         for categ in self.categorder:
             plates = self.category[categ]
-            wells = []
-            for well in self.getWells(params):
-                if well.plate_id in plates:
-                    wells.append(well)
+            wells = [well for well in self.getWells(params, plates=plates)]
             yield (categ, wells)
     
-    def getWells(self, params=True):
+    def _getPlateIDs(self):
+        '''
+        Plate IDs, without creating the Plate objects
+        '''
+        if self.matrix is not None and self._plates is None:
+            return list(self.matrix.plates)
+        return list(self.plates.keys())
+    
+    def getWells(self, params=True, plates=None):
         '''
         Generator to get the single wells
         if params is set to False, it just gives you the wells,
         otherwise it calculates them
-        '''
+        if plates is provided, only the wells from those plate IDs are given
+        '''
+        if self.matrix is not None and self._plates is None:
+            # Straight from the matrix, no Plate object needed
+            if params and not (self._isMatrix() and self.matrix.isParams()):
+                # Fit all the missing wells together
+                # (the parameters are copied back to the matrix)
+                missing = [well for well in self.matrix.getWells(plates)
+                           if not well.isParams()]
+                self.matrix.update(wells=calculateWellsParams(missing))
+            
+            for well in self.matrix.getWells(plates):
+                yield well
+            return
+        
+        if plates is None:
+            plates = list(self.plates.keys())
+        
+        if params:
+            # Fit all the missing wells together
+            missing = [well for plate_id in self.plates
+                       if plate_id in plates
+                       for well in self.plates[plate_id].getWells()
+                       if not well.isParams()]
+            for well in calculateWellsParams(missing):
+                pass
+        
         for plate_id in self.plates:
+            if plate_id not in plates:
+                continue
             Plate = self.plates[plate_id]
             for well in Plate.getWells():
-                if not well.isParams() and params:
-                    well.calculateParams()
-                
                 yield well
     
     def setNoActivity(self):
@@ -1230,6 +1349,10 @@ class Experiment(object):
         '''
         Returns a set with all the distinct AV values
         '''
+        if self._isMatrix():
+            return set([int(x) if x is not None else x
+                        for x in self.matrix.getDistinctParam('activity')])
+        
         av = set()
         for w in self.getWells(False):
             av.add(w.activity)
@@ -1240,24 +1363,41 @@ class Experiment(object):
         Get the maximum activity
         Which is also the number of clusters used...
         '''
+        if self._isMatrix():
+            maxact = self.matrix.getMaxParam('activity')
+            if np.isnan(maxact):
+                return None
+            return int(maxact)
+        
         return max([w.activity for w in self.getWells(False)])
     
     def getMaxParam(self, param):
         '''
         Get the maximum value for a certain parameter
         '''
+        if self._isMatrix() and self.matrix.isParams():
+            if param == 'activity':
+                return self.getMaxActivity()
+            return self.matrix.getMaxParam(param)
+        
         return max([getattr(w, param) for w in self.getWells()])
     
     def getMinTime(self):
         '''
         Get the minimum time
         '''
+        if self._isMatrix():
+            return self.matrix.getMaxTimes().min()
+        
         return min([w.getMaxTime() for w in self.getWells(False)])
     
     def getMaxTime(self):
         '''
         Get the maximum time
         '''
+        if self._isMatrix():
+            return self.matrix.getMaxTimes().max()
+        
         return max([w.getMaxTime() for w in self.getWells(False)])
     
     def setMaxParams(self):
@@ -1490,101 +1630,96 @@ class Experiment(object):
         scalarMap.set_array(np.array(list(range(10))))
         cax = fig.add_axes([0.925, 0.2, 0.03, 0.6])
         cax.text(0.50, 1.01, 'Activity', size=10, ha='center')       
-        plt.colorbar(scalarMap, cax=cax)
+        fig.colorbar(scalarMap, cax=cax)
         
         if svg:
             ftype = 'svg'
         else:
             ftype = 'png'
         
-        plt.savefig('%s.%s'%(name,ftype))
+        fig.savefig('%s.%s'%(name,ftype))
         
         logger.info('Saved "%s" graph (%s.%s)'%(title, name, ftype))
         
-        plt.clf()
+        fig.clf()
     
     def plot(self, svg=False):
         '''
         Go for the overall plots!
         Colored according to the activity.
+        The wells are read (and smoothed) once for both figures
         '''
-        fig = plt.figure(figsize=(12,6))
-        
-        logger.debug('Plotting overall Zero wells')
-        ax = fig.add_subplot(1,2,1)
-        self._plot(self.getZeroWells(params=False), 'ZeroPlot',
-                  'Zero subtracted wells', svg, ax)
+        from ductape.common.utils import rangeColors
         
-        logger.debug('Plotting overall NoZero wells')
-        ax = fig.add_subplot(1,2,2)
-        self._plot(self.getNoZeroWells(params=False), 'NoZeroPlot',
-                   'NoZero subtracted wells', svg, ax)
+        color = rangeColors(0, self.getMaxActivity(),
+                             cm.RdYlGn(np.arange(0,256)))
         
+        fig = plt.figure(figsize=(12,6))
+        zax = fig.add_subplot(1,2,1)
+        nzax = fig.add_subplot(1,2,2)
+        
+        cfig = plt.figure(figsize=(24,12))
+        caxes = {}
+        for axid, categ in enumerate(self.categorder):
+            caxes[categ] = cfig.add_subplot(2,4,axid+1)
+        
+        # Axis --> [wells, max signal, max time]
+        stats = {}
+        for ax in [zax, nzax] + list(caxes.values()):
+            ax.set_xlabel('Hour', size='small')
+            ax.set_ylabel('Signal', size='small')
+            stats[ax] = [0, 0.0, 0.0]
+        
+        logger.debug('Plotting overall wells')
+        for w in self.getWells(params=False):
+            if w.plate_id in self.zeroPlates:
+                axes = [zax]
+            else:
+                axes = [nzax]
+            axes += [caxes[categ] for categ in self.categorder
+                     if w.plate_id in self.category[categ]]
+            
+            msig, mtime = self._plotWell(w, axes, color)
+            for ax in axes:
+                stats[ax][0] += 1
+                stats[ax][1] = max(stats[ax][1], msig)
+                stats[ax][2] = max(stats[ax][2], mtime)
+        
+        self._setAxis(zax, 'Zero subtracted wells', *stats[zax])
+        self._setAxis(nzax, 'NoZero subtracted wells', *stats[nzax])
         self._saveFigure(fig, 'Overall plot', 'Overall', svg)
-        plt.clf()
-        
-        fig = plt.figure(figsize=(24,12))
-        axid = 1
         
-        for categ, wells in self.getCategoryWells(params=False):
-            ax = fig.add_subplot(2,4,axid)
-            
-            logger.debug('Plotting overall %s wells'%categ)
-            self._plot(wells, 'CategPlot_%s'%categ,
-                   '%s'%categ, svg, ax)
-            
-            axid += 1
-        
-        self._saveFigure(fig, 'Overall plot (categories)', 'OverallCateg', svg)
+        for categ in self.categorder:
+            self._setAxis(caxes[categ], '%s'%categ, *stats[caxes[categ]])
+        self._saveFigure(cfig, 'Overall plot (categories)', 'OverallCateg',
+                         svg)
     
-    def _plot(self, iterwells, name, description='Overall plot', svg=False,
-              axis=None):
+    def _plotWell(self, w, axes, color):
         '''
-        Plot all the wells in a single plot!
-        Coloured according to the activity. 
+        Plot a single well (compressed and smoothed) on each axis
+        Returns its maximum signal and time
         '''
-        from ductape.common.utils import rangeColors
-        
-        if not axis:
-            # Figure creation
-            fig = plt.figure(figsize=(8,8))
-            ax = fig.add_subplot(111)
-        else:
-            ax = axis
-            
-        ax.set_xlabel('Hour', size='small')
-        ax.set_ylabel('Signal', size='small')
-        
-        color = rangeColors(0, self.getMaxActivity(),
-                             cm.RdYlGn(np.arange(0,256)))
+        if not w.compressed:
+            w.compress()
+        if not w.smoothed:
+            # More aggressive smooth
+            try:
+                w.smooth(30)
+            except:
+                w.smooth()
         
-        counter = 0
-        maxsig = 0.0
-        maxtime = 0.0
-        for w in iterwells:
-            counter += 1
-            
-            if not w.compressed:
-                w.compress()
-            if not w.smoothed:
-                # More aggressive smooth
-                try:
-                    w.smooth(30)
-                except:
-                    w.smooth()
-            
-            times = sorted(w.signals.keys())
-            ax.plot(times, [w.signals[t] for t in times], color=color[w.activity],
+        times = sorted(w.signals.keys())
+        signals = [w.signals[t] for t in times]
+        for ax in axes:
+            ax.plot(times, signals, color=color[w.activity],
                         rasterized=True)
-            
-            msig = max(w.signals.values())
-            if msig > maxsig:
-                maxsig = msig  
-               
-            mtime = max(w.signals.keys())
-            if mtime > maxtime:
-                maxtime = mtime
         
+        return max(w.signals.values()), max(w.signals.keys())
+    
+    def _setAxis(self, ax, description, counter, maxsig, maxtime):
+        '''
+        Set the limits and title of an axis with counter wells
+        '''
         if counter == 0:
             return
         
@@ -1596,22 +1731,6 @@ class Experiment(object):
         ax.set_aspect((x1-x0)/(y1-y0))
         
         ax.set_title('%s'%description, size='small')
-        
-        if not axis:
-            cNorm  = colors.Normalize(vmin=0, vmax=self.getMaxActivity())
-            scalarMap = cm.ScalarMappable(norm=cNorm, cmap=cm.RdYlGn)
-            scalarMap.set_array(np.array(list(range(10))))
-            cax = fig.add_axes([0.925, 0.2, 0.03, 0.6])
-            cax.text(0.50, 1.05, 'Activity', size=10, ha='center')       
-            plt.colorbar(scalarMap, cax=cax)
-            
-            if svg:
-                ftype = 'svg'
-            else:
-                ftype = 'png'
-            
-            plt.savefig('%s.%s'%(name,ftype))
-            plt.clf()
 
 class BiologParser(object):
     '''
@@ -2492,25 +2611,75 @@ class BiologPlot(CommonThread):
         self.resetSubStatus()
 
 class CalcParams(object):
-    def __init__(self, well):
-        self.well = well
+    '''
+    Calculates the parameters of a chunk of wells
+    Returns the chunk ID and the list of the wells' fitted state
+    (None if something went wrong), to be merged back with mergeParams
+    '''
+    # Well attributes changed by the parameters calculation
+    _attributes = ['max', 'min', 'height',
+                   'plateau', 'slope', 'lag',
+                   'area', 'v', 'y0',
+                   'model', 'source',
+                   'signals', 'compressed', 'smoothed']
+    
+    def __init__(self, wells, chunk_id=0):
+        self.wells = wells
+        self.chunk_id = chunk_id
     
     def __call__(self):
-        if not self.well.max:
-            try:
-                logger.debug('Calculating parameters for %s - %s'%
-                             (self.well.plate_id, self.well.well_id))
-                if self.well.isParams():
-                    self.well.calculateParams()
-                else:
-                    logger.debug('Parameters already present, ',
-                                 'skipping parameters calculation')
-            except:
-                return False
+        try:
+            logger.debug('Calculating parameters for %d wells'%
+                         len(self.wells))
+            for well in calculateWellsParams(self.wells):
+                pass
+        except Exception as e:
+            logger.debug('Parameters calculation failed (%s)'%str(e))
+            return self.chunk_id, None
         
-        return True
+        return self.chunk_id, [dict([(attr, getattr(well, attr))
+                                     for attr in self._attributes])
+                               for well in self.wells]
+    
+    @staticmethod
+    def mergeParams(wells, states):
+        '''
+        Copy the fitted states back into the original Well objects
+        '''
+        for well, state in zip(wells, states):
+            for attr, value in state.items():
+                setattr(well, attr, value)
 
-class BiologCluster(CommonThread):
+def calculateWellsParams(wells, chunk=1000):
+    '''
+    Calculates the parameters of a list of wells, fitting together all the
+    wells sharing the same time points (see fitting.fitDataBatch)
+    The wells are processed in chunks to limit the memory usage
+    NB it is a generator: each well is returned once its parameters are set
+    '''
+    from ductape.phenome.fitting import fitDataBatch
+    
+    for wells in get_span(wells, span=chunk):
+        # Group the wells by time points
+        groups = {}
+        for well in wells:
+            xdata, ydata = well.getFitData()
+            groups[tuple(xdata)] = groups.get(tuple(xdata), [])
+            groups[tuple(xdata)].append((well, ydata))
+        
+        for times, members in groups.items():
+            xdata = np.array(times)
+            params, models = fitDataBatch(xdata,
+                                          np.array([ydata
+                                                    for well, ydata in members]))
+            for (well, ydata), fitparams, model in zip(members, params, models):
+                if model == '':
+                    # No fitting was possible
+                    fitparams = [None, None, None, None, None]
+                well.setFitParams(xdata, ydata, fitparams, model)
+                yield well
+
+class BiologCluster(CommonMultiProcess):
     '''
     Class BiologCluster
     '''
@@ -2522,9 +2691,9 @@ class BiologCluster(CommonThread):
     
     def __init__(self,experiment,
                  save_fig_clusters=False, force_params=False, n_clusters=10,
-                 elbow=False,
+                 elbow=False, ncpus=1,
                  queue=queue.Queue()):
-        CommonThread.__init__(self,queue)
+        CommonMultiProcess.__init__(self,ncpus,queue)
         # Experiment
         self.exp = experiment
         
@@ -2540,24 +2709,88 @@ class BiologCluster(CommonThread):
         # Elbow test instead of clusterization?
         self.elbow = bool(elbow)
         
+        # Maximum number of wells sent to a worker process at once
+        self.chunk = 1000
+        
     def calculateParams(self):
-        wellcount = 0
-        for w in self.exp.getWells(params=False):
-            wellcount += 1
+        wells = []
+        skipped = 0
+        for well in self.exp.getWells(params=False):
+            if not well.isParams() or self.force:
+                wells.append(well)
+            else:
+                skipped += 1
         
-        self._maxsubstatus = wellcount
+        if skipped > 0:
+            logger.debug('Parameters already present for %d wells, '%skipped+
+                         'skipping parameters calculation')
         
-        for well in self.exp.getWells(params=False):
-            logger.debug('Calculating parameters for %s - %s'%
+        self._maxsubstatus = len(wells)
+        
+        if self.ncpus > 1:
+            return self.calculateParamsParallel(wells)
+        
+        for well in calculateWellsParams(wells):
+            logger.debug('Calculated parameters for %s - %s'%
                              (well.plate_id, well.well_id))
             self._substatus += 1
             self.updateStatus(sub=True)
+        
+        return True
+    
+    def _mergeChunk(self, chunks, chunk_id, states):
+        if states is None:
+            logger.warning('Parameters calculation failed for %d wells'%
+                           len(chunks[chunk_id]))
+            return False
+        
+        CalcParams.mergeParams(chunks[chunk_id], states)
+        
+        self._substatus += len(chunks[chunk_id])
+        self.updateStatus(sub=True)
+        
+        return True
+    
+    def calculateParamsParallel(self, wells):
+        '''
+        Spread the wells in chunks over ncpus worker processes
+        '''
+        # At least four chunks for each worker, to balance the load
+        span = int(np.ceil(len(wells) / float(self.ncpus * 4)))
+        span = max(1, min(span, self.chunk))
+        chunks = [chunk for chunk in get_span(wells, span=span)]
+        
+        self.initiateParallel()
+        for chunk_id, chunk in enumerate(chunks):
+            self._paralleltasks.put(CalcParams(chunk, chunk_id))
+        
+        # Poison pill to stop the workers
+        self.addPoison()
+        
+        while True:
+            if self.killed:
+                logger.debug('Exiting for a kill signal')
+                self.killParallel()
+                return
             
-            if not well.isParams() or self.force:
-                well.calculateParams()
-            else:
-                logger.debug('Parameters already present, '
-                                 'skipping parameters calculation')
+            while not self._parallelresults.empty():
+                chunk_id, states = self._parallelresults.get()
+                if not self._mergeChunk(chunks, chunk_id, states):
+                    self.killParallel()
+                    return False
+            
+            if self.isTerminated():
+                break
+            
+            self.sleeper.sleep(0.1)
+        
+        while not self._parallelresults.empty():
+            chunk_id, states = self._parallelresults.get()
+            if not self._mergeChunk(chunks, chunk_id, states):
+                self.killParallel()
+                return False
+        
+        self.killParallel()
         
         return True
     
@@ -2601,8 +2834,9 @@ def getSinglePlatesFromSignals(signals):
         plate_id, well_id, org_id, replica = (well.plate_id, well.well_id,
                                               well.org_id, well.replica)
         
-        lT = well.times.split('_')
-        lS = well.signals.split('_')
+        # Times and signals are numpy arrays
+        lT = well.times
+        lS = well.signals
         
         if plate_id not in dExp:
             dExp[plate_id] = {}
@@ -2617,9 +2851,9 @@ def getSinglePlatesFromSignals(signals):
             dExp[plate_id][org_id][replica].data[well_id] = Well(plate_id,
                                                                  well_id)
         
-        for i in range(len(lT)):
-            dExp[plate_id][org_id][replica].data[well_id].addSignal(float(lT[i]),
-                                                                    float(lS[i]))
+        for hour, signal in zip(lT.tolist(), lS.tolist()):
+            dExp[plate_id][org_id][replica].data[well_id].addSignal(hour,
+                                                                    signal)
             
         # Add the activity - if present
         if hasattr(well, "activity"):
@@ -222,3 +222,282 @@ def fitData(xdata, ydata):
                     params = [None, None, None, None, None]
     
     return params, model
+
+################################################################################
+# Batch fitting
+#
+# The following functions fit many growth curves at once: all the curves
+# must share the same time axis (xdata), while ydata is a 2-D array
+# (wells x time points)
+
+def getFlexes(x, y):
+    '''
+    Vectorized version of getFlex
+    y is a 2-D array (one curve for each row), x is the shared time axis
+    Returns an array with a guess of the flex point for each curve
+    '''
+    diffs = np.diff(y, axis=1)
+    thresholds = diffs.mean(axis=1) + diffs.std(axis=1)
+    above = diffs > thresholds[:, np.newaxis]
+    
+    flexes = np.ones(y.shape[0]) * x[-1]
+    found = above.any(axis=1)
+    flexes[found] = x[above.argmax(axis=1)[found]]
+    
+    return flexes
+
+def getPlateaus(x, y):
+    '''
+    Vectorized version of getPlateau
+    y is a 2-D array (one curve for each row), x is the shared time axis
+    Returns an array with a guess of the plateau point for each curve
+    '''
+    stds = np.diff(y, axis=1).std(axis=1)[:, np.newaxis]
+    ymax = y[:, -1][:, np.newaxis]
+    inside = np.logical_and(y > (ymax - stds), y < (ymax + stds))
+    
+    plateaus = y[:, -1].copy()
+    found = inside.any(axis=1)
+    plateaus[found] = y[found, inside.argmax(axis=1)[found]]
+    
+    return plateaus
+
+def _gompertzJacobian(x, params):
+    '''
+    Partial derivatives of the Gompertz model (wells x time points x params)
+    params is a 2-D array (one row for each curve)
+    '''
+    A, u, d = [params[:, i][:, np.newaxis] for i in range(3)]
+    z = (((u * np.e)/A) * (d - x)) + 1
+    E = np.exp(z)
+    G = np.exp(-E)
+    
+    jac = np.zeros(z.shape + (5,))
+    jac[:, :, 0] = G + (G * E * ((u * np.e)/A) * (d - x))
+    jac[:, :, 1] = - G * E * np.e * (d - x)
+    jac[:, :, 2] = - G * E * u * np.e
+    jac[:, :, 4] = 1
+    return jac
+
+def _logisticJacobian(x, params):
+    '''
+    Partial derivatives of the Logistic model (wells x time points x params)
+    params is a 2-D array (one row for each curve)
+    '''
+    A, u, d = [params[:, i][:, np.newaxis] for i in range(3)]
+    L = 1 / (1 + np.exp( ( ((4 * u)/A) * (d - x) ) + 2 ))
+    dL = L * (1 - L)
+    
+    jac = np.zeros(L.shape + (5,))
+    jac[:, :, 0] = L + (dL * ((4 * u)/A) * (d - x))
+    jac[:, :, 1] = - dL * 4 * (d - x)
+    jac[:, :, 2] = - dL * 4 * u
+    jac[:, :, 4] = 1
+    return jac
+
+def _numericJacobian(function, x, params, active):
+    '''
+    Forward differences partial derivatives (wells x time points x params)
+    (the same step used by MINPACK)
+    '''
+    y = _evaluate(function, x, params)
+    
+    jac = np.zeros(y.shape + (params.shape[1],))
+    for i in active:
+        step = np.sqrt(np.finfo(float).eps) * np.abs(params[:, i])
+        step[step == 0] = np.sqrt(np.finfo(float).eps)
+        moved = params.copy()
+        moved[:, i] += step
+        jac[:, :, i] = ((_evaluate(function, x, moved) - y) /
+                        step[:, np.newaxis])
+    return jac
+
+def _evaluate(function, x, params):
+    '''
+    Evaluate a model for many curves at once
+    '''
+    return function(x, *[params[:, i][:, np.newaxis]
+                         for i in range(params.shape[1])])
+
+# Batch fitting models: function, jacobian and fitted parameters
+# (gompertz and logistic do not use v, which is left untouched)
+batchModels = (('gompertz', gompertz, _gompertzJacobian, [0, 1, 2, 4]),
+               ('logistic', logistic, _logisticJacobian, [0, 1, 2, 4]),
+               ('richards', richards, None, [0, 1, 2, 3, 4]))
+
+def levenbergMarquardt(function, jacobian, active, xdata, ydata, p0,
+                       maxiter=1000, ftol=1.49012e-08, xtol=1.49012e-08):
+    '''
+    Batched Levenberg-Marquardt least squares fitting:
+    each row of ydata is fitted to function, starting from the same row of p0,
+    all the curves being updated at once, each one with its own damping
+    factor (updated as in Nielsen, 1999)
+    jacobian returns the partial derivatives (numeric if None), only the
+    parameters in active are fitted
+    The convergence criteria (ftol, xtol) are those of MINPACK
+    
+    Returns the fitted parameters and a boolean array of the curves that
+    converged
+    '''
+    params = np.array(p0, dtype=float)
+    n = ydata.shape[0]
+    active = np.array(active)
+    
+    residuals = _evaluate(function, xdata, params) - ydata
+    cost = (residuals ** 2).sum(axis=1)
+    
+    converged = np.zeros(n, dtype=bool)
+    # Curves still being fitted
+    running = np.isfinite(cost)
+    converged[np.logical_and(running, cost == 0)] = True
+    running[cost == 0] = False
+    damping = np.ones(n) * 1e-3
+    nu = np.ones(n) * 2
+    
+    for i in range(maxiter):
+        idx = np.nonzero(running)[0]
+        if len(idx) == 0:
+            break
+        
+        p = params[idx]
+        r = residuals[idx]
+        if jacobian is None:
+            jac = _numericJacobian(function, xdata, p, active)
+        else:
+            jac = jacobian(xdata, p)
+        jac = jac[:, :, active]
+        
+        # Normal equations, with Marquardt's scaling
+        jtj = np.einsum('ntk,ntl->nkl', jac, jac)
+        jtr = np.einsum('ntk,nt->nk', jac, r)
+        diag = np.diagonal(jtj, axis1=1, axis2=2).copy()
+        diag[diag <= 0] = 1e-12
+        system = jtj + (damping[idx][:, np.newaxis, np.newaxis] *
+                        (np.eye(len(active)) * diag[:, np.newaxis, :]))
+        
+        valid = np.isfinite(system).all(axis=(1, 2))
+        valid &= np.isfinite(jtr).all(axis=1)
+        step = np.zeros(jtr.shape)
+        if valid.any():
+            try:
+                step[valid] = np.linalg.solve(system[valid],
+                                              -jtr[valid][:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                for j in np.nonzero(valid)[0]:
+                    step[j] = np.linalg.lstsq(system[j], -jtr[j],
+                                              rcond=None)[0]
+        
+        moved = p.copy()
+        moved[:, active] += step
+        newres = _evaluate(function, xdata, moved) - ydata[idx]
+        newcost = (newres ** 2).sum(axis=1)
+        
+        better = np.logical_and(valid, np.isfinite(newcost))
+        better &= newcost < cost[idx]
+        
+        # Gain ratio: actual over predicted reduction
+        predicted = (step * (damping[idx][:, np.newaxis] * diag * step -
+                             jtr)).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = (cost[idx] - newcost) / predicted
+        gain[~np.isfinite(gain)] = 0
+        
+        # Convergence (MINPACK criteria)
+        reduction = (cost[idx] - newcost) / cost[idx]
+        small = (np.sqrt((step ** 2).sum(axis=1)) <=
+                 xtol * np.sqrt((p[:, active] ** 2).sum(axis=1)))
+        done = np.logical_and(better, reduction <= ftol)
+        done |= np.logical_and(valid, small)
+        
+        accepted = idx[better]
+        params[accepted] = moved[better]
+        residuals[accepted] = newres[better]
+        cost[accepted] = newcost[better]
+        damping[accepted] *= np.maximum(1. / 3,
+                                        1 - (2 * gain[better] - 1) ** 3)
+        nu[accepted] = 2
+        rejected = idx[~better]
+        damping[rejected] *= nu[rejected]
+        nu[rejected] *= 2
+        
+        converged[idx[done]] = True
+        running[idx[done]] = False
+        # Hopeless curves
+        running[idx[np.logical_or(~valid, damping[idx] > 1e16)]] = False
+    
+    converged &= np.isfinite(params).all(axis=1)
+    
+    return params, converged
+
+def fitDataBatch(xdata, ydata):
+    '''
+    Fits each row of ydata (wells x time points) to the first working function
+    (first Gompertz, then Logistic, then Richards), as fitData does
+    All the curves must share the same time axis (xdata)
+    
+    All the curves are fitted at once for each model (see levenbergMarquardt):
+    the curves for which the fitting fails are tried with the next model,
+    and then again on compressed and smoothed data
+    The results are close to those of fitData, but not identical: the curves
+    that MINPACK is not able to fit may get a different model
+
+    Returns a tuple with a 2-D array of parameters (plateau, slope, lag, v, y0
+    for each curve) and the list of the models used
+    If no fitting was possible for a curve its parameters are NaN and its
+    model is an empty string
+
+    Please note that the plateau may be reached outside the final time point
+    '''
+    xdata = np.array(xdata, dtype=float)
+    ydata = np.array(ydata, dtype=float)
+    if ydata.ndim != 2:
+        raise ValueError('ydata should be a 2-D array (wells x time points)')
+    
+    params = np.ones( (ydata.shape[0], 5) ) * np.nan
+    models = np.array(['' for i in range(ydata.shape[0])], dtype=object)
+    
+    # Curves not fitted yet
+    todo = np.arange(ydata.shape[0])
+    # Curves with missing values can't be fitted
+    if not np.isfinite(xdata).all():
+        todo = todo[:0]
+    todo = todo[np.isfinite(ydata[todo]).all(axis=1)]
+    
+    x = xdata
+    y = ydata[todo]
+    # Initial guesses for the output parameters
+    p0 = np.zeros( (len(todo), 5) )
+    p0[:, 0] = getPlateaus(x, y)
+    p0[:, 1] = 4.0
+    p0[:, 2] = getFlexes(x, y)
+    p0[:, 3] = 0.1
+    
+    retries = 2
+    while retries > 0 and len(todo) > 0:
+        for model, function, jacobian, active in batchModels:
+            if len(todo) == 0:
+                break
+            fitted, ok = levenbergMarquardt(function, jacobian, active,
+                                            x, y, p0)
+            params[todo[ok]] = fitted[ok]
+            models[todo[ok]] = model
+            todo, y, p0 = todo[~ok], y[~ok], p0[~ok]
+        
+        retries -= 1
+        if retries == 0 or len(todo) == 0:
+            break
+        
+        # Compress again the data
+        y = y[:, ::2]
+        if y.shape[1] <= 11:
+            window_len = y.shape[1]
+        else:
+            window_len = 11
+        y = np.array([smooth(row, window_len = window_len,
+                             window = 'blackman') for row in y])
+        x = x[::2]
+        #
+        p0[:, 0] = getPlateaus(x, y)
+        p0[:, 2] = 0
+    
+    return params, list(models)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+"""
+Matrix
+
+Phenome library
+
+Columnar (numpy-based) representation of a phenomic experiment
+"""
+from ductape.phenome.biolog import Well, SinglePlate, Plate
+import logging
+import numpy as np
+# No country for warnings
+np.seterr(all='ignore')
+#
+
+__author__ = "Marco Galardini"
+
+################################################################################
+# Log setup
+
+logger = logging.getLogger('ductape.matrix')
+
+################################################################################
+# Classes
+
+class PhenomeMatrix(object):
+    '''
+    Class PhenomeMatrix
+    Holds a whole phenomic experiment in a series of numpy arrays
+
+    times: time axis shared by all the wells
+    signals: (plate, well, strain, replica, time) array, NaN if missing
+    params: parameter --> (plate, well, strain, replica) array, NaN if missing
+    present: (plate, well, strain, replica) mask of the wells actually there
+
+    Plates, wells, strains and replicas are integer-coded, using their
+    position in the plates, wells, strains and replicas lists
+    (in order of appearance, as the Plate and SinglePlate objects)
+    Well objects are created only when requested; if cache is True they
+    are kept (so that their changes can be copied back, see update),
+    otherwise a new Well object is created at each request
+    '''
+    def __init__(self, plates=[], wells=[], strains=[], replicas=[], times=[],
+                 dtype=np.float64, cache=True):
+        self.plates = list(plates)
+        self.wells = list(wells)
+        self.strains = list(strains)
+        self.replicas = list(replicas)
+        self.times = np.array(times, dtype=np.float64)
+
+        # ID --> index
+        self._plates = dict([(x, i) for i, x in enumerate(self.plates)])
+        self._wells = dict([(x, i) for i, x in enumerate(self.wells)])
+        self._strains = dict([(x, i) for i, x in enumerate(self.strains)])
+        self._replicas = dict([(x, i) for i, x in enumerate(self.replicas)])
+
+        self.shape = (len(self.plates), len(self.wells),
+                      len(self.strains), len(self.replicas))
+
+        self.present = np.zeros(self.shape, dtype=bool)
+        self.signals = np.empty(self.shape + (len(self.times),), dtype=dtype)
+        self.signals.fill(np.nan)
+
+        # Numeric parameters (plus the activity index)
+        self.paramsList = Well('phony', 'phony').params + ['activity']
+        self.params = {}
+        for param in self.paramsList:
+            self.params[param] = np.empty(self.shape)
+            self.params[param].fill(np.nan)
+        # Fitting model and parameters source
+        self.model = np.empty(self.shape, dtype=object)
+        self.source = np.empty(self.shape, dtype=object)
+
+        # index --> Well objects (created on demand)
+        self.cache = bool(cache)
+        self._cache = {}
+
+    def __len__(self):
+        return int(self.present.sum())
+
+    def index(self, plate_id, well_id, strain, replica):
+        '''
+        Get the index of a well (as a tuple)
+        Raises a KeyError if any of the IDs is not known
+        '''
+        return (self._plates[plate_id], self._wells[well_id],
+                self._strains[strain], self._replicas[replica])
+
+    def isWell(self, plate_id, well_id, strain, replica):
+        '''
+        Is this well present?
+        '''
+        try:
+            return bool(self.present[self.index(plate_id, well_id,
+                                                strain, replica)])
+        except KeyError:
+            return False
+
+    def _setWell(self, idx, times, signals, params):
+        '''
+        Fill the arrays for a single well
+        params is a dictionary (missing/None values are allowed)
+        '''
+        self.present[idx] = True
+        cols = np.searchsorted(self.times, times)
+        self.signals[idx][cols] = signals
+
+        for param in self.paramsList:
+            value = params.get(param)
+            if value is not None:
+                self.params[param][idx] = value
+        self.model[idx] = params.get('model')
+        self.source[idx] = params.get('source')
+
+    @classmethod
+    def fromSignals(cls, signals, cache=True):
+        '''
+        Builds the matrix from the signals taken from the DB
+        (see Biolog.getAllSignals)
+        The wells taken from the DB can be used as well: only the
+        parameters are filled (see Biolog.getAllWells)
+        If cache is False the Well objects are not kept
+        '''
+        signals = list(signals)
+
+        matrix = cls(getUnique([s.plate_id for s in signals]),
+                     getUnique([s.well_id.replace(' ','')
+                                for s in signals]),
+                     getUnique([s.org_id for s in signals]),
+                     getUnique([s.replica for s in signals]),
+                     np.unique(np.concatenate([np.asarray(s.times)
+                                               for s in signals
+                                               if hasattr(s, 'times')]
+                                              or [np.array([])])),
+                     cache=cache)
+
+        others = Well('phony', 'phony').otherparams
+        for s in signals:
+            idx = matrix.index(s.plate_id, s.well_id.replace(' ',''),
+                               s.org_id, s.replica)
+            params = dict([(param, getattr(s, param, None))
+                           for param in matrix.paramsList + others])
+            if hasattr(s, 'times'):
+                times, values = np.asarray(s.times), np.asarray(s.signals)
+            else:
+                times, values = [], []
+            matrix._setWell(idx, times, values, params)
+
+        return matrix
+
+    @classmethod
+    def fromPlates(cls, plates):
+        '''
+        Builds the matrix from a list of Plate objects
+        The Well objects are kept in the cache
+        '''
+        wells = [w for plate in plates for w in plate.getWells()]
+
+        times = set()
+        for w in wells:
+            times.update(w.signals.keys())
+
+        matrix = cls(getUnique([w.plate_id for w in wells]),
+                     getUnique([w.well_id for w in wells]),
+                     getUnique([w.strain for w in wells]),
+                     getUnique([w.replica for w in wells]),
+                     sorted(times))
+
+        for w in wells:
+            idx = matrix.index(w.plate_id, w.well_id, w.strain, w.replica)
+            hours = sorted(w.signals.keys())
+            params = dict([(param, getattr(w, param))
+                           for param in matrix.paramsList + w.otherparams])
+            matrix._setWell(idx, hours, [w.signals[h] for h in hours], params)
+            matrix._cache[idx] = w
+
+        return matrix
+
+    def isCached(self):
+        '''
+        Have any Well objects been kept? (they may have been changed)
+        '''
+        return len(self._cache) > 0
+
+    def _getWell(self, idx):
+        if idx not in self._cache:
+            plate_id, well_id, strain, replica = (self.plates[idx[0]],
+                                                  self.wells[idx[1]],
+                                                  self.strains[idx[2]],
+                                                  self.replicas[idx[3]])
+            well = Well(plate_id, well_id)
+            well.strain = strain
+            well.replica = replica
+
+            signals = self.signals[idx]
+            mask = ~np.isnan(signals)
+            well.signals = dict(zip(self.times[mask].tolist(),
+                                    signals[mask].tolist()))
+
+            for param in self.paramsList:
+                value = self.params[param][idx]
+                if np.isnan(value):
+                    continue
+                if param == 'activity':
+                    # Stored as an integer
+                    setattr(well, param, int(value))
+                else:
+                    setattr(well, param, float(value))
+            well.model = self.model[idx]
+            well.source = self.source[idx]
+
+            if not self.cache:
+                return well
+            self._cache[idx] = well
+
+        return self._cache[idx]
+
+    def getWell(self, plate_id, well_id, strain, replica):
+        '''
+        Get a single Well object (None if not present)
+        '''
+        if not self.isWell(plate_id, well_id, strain, replica):
+            return None
+        return self._getWell(self.index(plate_id, well_id, strain, replica))
+
+    def getWells(self, plates=None):
+        '''
+        Generator to the Well objects
+        (same order as the Plate objects: plate, strain, replica, well)
+        If plates is provided, only the wells from those plate IDs are given
+        '''
+        present = self.present
+        if plates is not None:
+            keep = np.zeros(len(self.plates), dtype=bool)
+            keep[[self._plates[p] for p in plates if p in self._plates]] = True
+            present = np.logical_and(present,
+                                     keep[:, np.newaxis, np.newaxis, np.newaxis])
+
+        for p, s, r, w in zip(*np.nonzero(present.transpose(0, 2, 3, 1))):
+            yield self._getWell((p, w, s, r))
+
+    def getSinglePlates(self):
+        '''
+        Generator to the SinglePlate objects
+        '''
+        for p, s, r in zip(*np.nonzero(self.present.any(axis=1))):
+            splate = SinglePlate()
+            splate.plate_id = self.plates[p]
+            splate.strain = self.strains[s]
+            splate.replica = self.replicas[r]
+            for w in np.nonzero(self.present[p, :, s, r])[0]:
+                splate.data[self.wells[w]] = self._getWell((p, w, s, r))
+            yield splate
+
+    def getAverageSinglePlates(self):
+        '''
+        Generator to the SinglePlate objects holding the average activity
+        of each strain (replica is 0)
+        '''
+        average = self.getAverage('activity')
+        for p, s in zip(*np.nonzero(self.present.any(axis=3).any(axis=1))):
+            splate = SinglePlate()
+            splate.plate_id = self.plates[p]
+            splate.strain = self.strains[s]
+            splate.replica = 0
+            for w in np.nonzero(self.present[p, :, s, :].any(axis=1))[0]:
+                well = Well(self.plates[p], self.wells[w])
+                well.strain = self.strains[s]
+                if not np.isnan(average[p, w, s]):
+                    well.activity = float(average[p, w, s])
+                splate.data[self.wells[w]] = well
+            yield splate
+
+    def getPlates(self):
+        '''
+        Generator to the Plate objects
+        '''
+        dExp = {}
+        for splate in self.getSinglePlates():
+            if splate.plate_id not in dExp:
+                dExp[splate.plate_id] = Plate(splate.plate_id)
+            dExp[splate.plate_id].addData(splate.strain, splate)
+
+        for plate_id in self.plates:
+            if plate_id in dExp:
+                yield dExp[plate_id]
+
+    def update(self, signals=False, wells=None):
+        '''
+        Copy back the parameters of the Well objects
+        (and their signals too, if requested)
+        By default the Well objects kept so far are used
+        '''
+        if wells is None:
+            wells = list(self._cache.items())
+        else:
+            wells = [(self.index(well.plate_id, well.well_id,
+                                 well.strain, well.replica), well)
+                     for well in wells]
+
+        for idx, well in wells:
+            for param in self.paramsList:
+                value = getattr(well, param)
+                if value is None:
+                    value = np.nan
+                self.params[param][idx] = value
+            self.model[idx] = well.model
+            self.source[idx] = well.source
+
+            if signals:
+                self.signals[idx].fill(np.nan)
+                hours = [h for h in sorted(well.signals.keys())
+                         if h in self.times]
+                cols = np.searchsorted(self.times, hours)
+                self.signals[idx][cols] = [well.signals[h] for h in hours]
+
+    def isParams(self):
+        '''
+        Do all the wells have at least one parameter calculated?
+        '''
+        calculated = np.zeros(self.shape, dtype=bool)
+        for param in Well('phony', 'phony').params:
+            calculated |= ~np.isnan(self.params[param])
+        return bool(calculated[self.present].all())
+
+    def getMax(self):
+        '''
+        Maximum signal
+        '''
+        return np.nanmax(self.signals[self.present])
+
+    def getMaxTimes(self):
+        '''
+        Last time point of each present well
+        '''
+        last = np.where(np.isnan(self.signals),
+                        -np.inf, self.times)
+        return last.max(axis=-1)[self.present]
+
+    def getParam(self, param):
+        '''
+        Values of a parameter, for the present wells only
+        '''
+        return self.params[param][self.present]
+
+    def getMaxParam(self, param):
+        '''
+        Maximum value of a parameter
+        '''
+        return np.nanmax(self.getParam(param))
+
+    def getDistinctParam(self, param):
+        '''
+        Set of distinct values of a parameter (missing values are None)
+        '''
+        values = self.getParam(param)
+        distinct = set(np.unique(values[~np.isnan(values)]).tolist())
+        if np.isnan(values).any():
+            distinct.add(None)
+        return distinct
+
+    def getAverage(self, param):
+        '''
+        Average of a parameter over the replicas
+        Returns a (plate, well, strain) array (NaN if there are no values)
+        As in Experiment, replicas after the first missing value are ignored
+        '''
+        missing = np.logical_and(self.present,
+                                 np.isnan(self.params[param]))
+        used = np.logical_and(self.present,
+                              np.cumsum(missing, axis=3) == 0)
+
+        count = used.sum(axis=3)
+        average = np.where(used, self.params[param], 0).sum(axis=3) / count
+        average[count == 0] = np.nan
+
+        return average
+
+    def getAverageWells(self):
+        '''
+        Returns the average wells in the Experiment.sumexp structure
+        (plate_id --> well_id --> strain --> Well)
+        Parameters without any value are None
+        '''
+        averages = dict([(param, self.getAverage(param))
+                         for param in self.paramsList])
+
+        sumexp = {}
+        for p, w, s in zip(*np.nonzero(self.present.any(axis=3))):
+            plate_id, well_id, strain = (self.plates[p], self.wells[w],
+                                         self.strains[s])
+            well = Well(plate_id, well_id)
+            well.strain = strain
+            for param in self.paramsList:
+                value = averages[param][p, w, s]
+                if not np.isnan(value):
+                    setattr(well, param, value)
+
+            sumexp[plate_id] = sumexp.get(plate_id, {})
+            sumexp[plate_id][well_id] = sumexp[plate_id].get(well_id, {})
+            sumexp[plate_id][well_id][strain] = well
+
+        return sumexp
+
+################################################################################
+# Methods
+
+def getUnique(values):
+    '''
+    Distinct values, in order of appearance
+    '''
+    seen = set()
+    unique = []
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            unique.append(value)
+    return unique
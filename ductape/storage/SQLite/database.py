@@ -8,10 +8,17 @@ SQLite Database wrappers
 """
 # TODO: decorator to catch SQLite exceptions
 
-from ductape.storage.SQLite.dbstrings import dbcreate, dbboost
+from ductape.storage.SQLite.dbstrings import dbcreate, dbschema
+from ductape.storage.SQLite.dbstrings import dbindexes, dbprofiles
+from ductape.storage.SQLite.dbstrings import dbpanclass, dbmainedge
+from ductape.storage.SQLite.dbstrings import dbbiologavg
 from ductape.common.utils import get_span
 import logging
+import numpy as np
+import os
 import sqlite3
+import sys
+import threading
 import time
 
 __author__ = "Marco Galardini"
@@ -21,21 +28,350 @@ __author__ = "Marco Galardini"
 
 logger = logging.getLogger('ductape.database')
 
+################################################################################
+# Methods
+
+def packSignals(values):
+    '''
+    Transforms a list of times or signals into a binary object
+    (float64 array) to be stored in the DB
+    '''
+    return sqlite3.Binary(np.array(values, dtype=np.float64).tobytes())
+
+def unpackSignals(value):
+    '''
+    Transforms a stored times or signals column into a numpy array
+    The binary format is read without copying the data;
+    the old text format (underscore-joined values) is also supported
+    '''
+    if value is None:
+        return np.array([], dtype=np.float64)
+    if sys.version_info[0] < 3:
+        text = isinstance(value, basestring)
+    else:
+        text = isinstance(value, str)
+    if text:
+        return np.array([float(x) for x in value.split('_')],
+                        dtype=np.float64)
+    return np.frombuffer(value, dtype=np.float64)
+
+# One Row class for each distinct set of columns
+_rowClasses = {}
+# Last cursor description seen (and its Row class)
+_lastRow = (None, None)
+
+def getRowClass(description):
+    '''
+    Returns the Row class for a cursor description
+    (the classes are created once and then cached)
+    '''
+    global _lastRow
+    if description is _lastRow[0]:
+        return _lastRow[1]
+    
+    fields = tuple([field[0] for field in description])
+    klass = _rowClasses.get(fields)
+    if klass is None:
+        attrs = {'_fields': fields}
+        # Duplicated column names: the first one wins
+        for i in reversed(range(len(fields))):
+            attrs[fields[i]] = Field(i)
+        klass = type('Row', (Row,), attrs)
+        _rowClasses[fields] = klass
+    
+    _lastRow = (description, klass)
+    return klass
+
+def rowFactory(cursor, row):
+    '''
+    Row factory used by all the DB connections
+    '''
+    return tuple.__new__(getRowClass(cursor.description), row)
+
+# Connections shared by the DB objects of each process (and thread)
+_registry = threading.local()
+# Connections inherited from the parent process (never used)
+_inherited = []
+# Prepared statements kept by each connection
+cachedStatements = 256
+
+def getProfile():
+    '''
+    Returns the storage profile in use (see dbstrings.dbprofiles),
+    chosen with the DUCTAPE_DB_PROFILE environment variable
+    '''
+    name = os.environ.get('DUCTAPE_DB_PROFILE', 'default')
+    if name not in dbprofiles:
+        logger.warning('Unknown storage profile %s, using the default one'%
+                       name)
+        name = 'default'
+    return dbprofiles[name]
+
+def getConnection(dbname):
+    '''
+    Returns the connection to a DB, shared by all the DB objects
+    of the current process and thread
+    The connection is opened (and the storage profile applied) the first
+    time it is requested, so each worker process/thread gets its own
+    connection
+    '''
+    try:
+        connections = _registry.connections
+    except AttributeError:
+        connections = _registry.connections = {}
+    
+    key = os.path.abspath(dbname)
+    pid = os.getpid()
+    
+    entry = connections.get(key)
+    if entry is None or entry[0] != pid:
+        if entry is not None:
+            # Forked: the parent's connection can't be used (or closed) here
+            _inherited.append(entry[1])
+        
+        profile = getProfile()
+        connection = sqlite3.connect(dbname, timeout=profile['timeout'],
+                                     cached_statements=cachedStatements)
+        connection.row_factory = rowFactory
+        for pragma in profile['pragmas']:
+            connection.execute(pragma)
+        
+        entry = (pid, connection)
+        connections[key] = entry
+    
+    return entry[1]
+
+def closeConnection(dbname):
+    '''
+    Close the shared connection to a DB (current process and thread)
+    '''
+    connections = getattr(_registry, 'connections', {})
+    entry = connections.pop(os.path.abspath(dbname), None)
+    if entry is not None and entry[0] == os.getpid():
+        entry[1].close()
+
+def makeRow(fields, data, attrs=None):
+    '''
+    Rebuilds a Row (i.e. after pickling)
+    '''
+    row = tuple.__new__(getRowClass([(f,) for f in fields]), data)
+    if attrs:
+        row.__dict__.update(attrs)
+    return row
+
+def getWellParams(w):
+    '''
+    Returns the biolog_exp row of a Well object
+    (missing values are None)
+    '''
+    row = [w.plate_id, w.well_id, w.strain, w.replica, w.activity,
+           int(w.zero), w.min, w.max, w.height, w.plateau, w.slope,
+           w.lag, w.area, w.v, w.y0, w.model, w.source]
+    for i in range(4, len(row)):
+        if row[i] is None:
+            continue
+        if str(row[i]) in ['nan', '']:
+            row[i] = None
+        elif i in (4, 5):
+            row[i] = int(row[i])
+        elif i < 15:
+            row[i] = float(row[i])
+    return row
+
+def getWellSignals(w):
+    '''
+    Returns the biolog_exp_det row of a Well object
+    '''
+    hours = sorted(w.signals.keys())
+    return [w.plate_id, w.well_id, w.strain, w.replica,
+            packSignals(hours),
+            packSignals([w.signals[h] for h in hours])]
+
+# Organism x reaction matrices, by file name: (mtime, ReactMatrix)
+_matrices = {}
+# Tables the organism x reaction matrix is computed from
+matrixTables = set(['organism', 'protein', 'mapko', 'ko_react'])
+# Tables the "main" RPairs edges are computed from
+edgeTables = set(['reaction', 'rpair', 'rpair_react'])
+# Tables the project-wide metabolic network is computed from
+# (together with the "main" RPairs edges)
+netTables = set(['compound', 'comp_path', 'react_path'])
+
+def getMatrixFile(dbname):
+    '''
+    Returns the file holding the organism x reaction matrix of a DB
+    '''
+    return os.path.abspath(dbname) + '.reactions.npz'
+
+def getNetFile(dbname):
+    '''
+    Returns the file holding the project-wide metabolic network of a DB
+    (see ductape.kegg.net.GlobalNet)
+    '''
+    return os.path.abspath(dbname) + '.network.npz'
+
 ################################################################################
 # Classes
 
-class Row(object):
+class ReactMatrix(object):
+    '''
+    Class ReactMatrix
+    Organisms (rows) x reactions (columns) matrix, holding the number of
+    proteins of each organism mapped to each reaction (0: absent)
+    Organisms and reactions are sorted, orgIndex and reactIndex map them
+    to the matrix indexes; links holds the number of protein-reaction
+    links of each organism
+    '''
+    def __init__(self, orgs, reacts, counts, links):
+        self.orgs = list(orgs)
+        self.reacts = list(reacts)
+        self.counts = counts
+        self.links = links
+        self.presence = counts > 0
+        
+        self.orgIndex = dict([(org_id, i)
+                              for i, org_id in enumerate(self.orgs)])
+        self.reactIndex = dict([(re_id, i)
+                                for i, re_id in enumerate(self.reacts)])
+    
+    def save(self, fname):
+        '''
+        Save the matrix (the file is replaced at once)
+        '''
+        tmp = fname + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            np.savez_compressed(f, orgs=np.array(self.orgs),
+                                reacts=np.array(self.reacts),
+                                counts=self.counts, links=self.links)
+        finally:
+            f.close()
+        
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmp, fname)
+    
+    @classmethod
+    def load(cls, fname):
+        '''
+        Load a matrix saved with save()
+        '''
+        data = np.load(fname)
+        try:
+            matrix = cls([str(x) for x in data['orgs']],
+                         [str(x) for x in data['reacts']],
+                         data['counts'], data['links'])
+        finally:
+            data.close()
+        return matrix
+
+class ActivityMatrix(object):
+    '''
+    Class ActivityMatrix
+    Organisms (rows) x compounds or wells (columns) matrix, holding the
+    mean activity (NaN: not available) and the number of replicas (or
+    wells) it has been computed from
+    Organisms and columns are sorted, orgIndex and keyIndex map them
+    to the matrix indexes
+    '''
+    def __init__(self, orgs, keys, values, counts):
+        self.orgs = list(orgs)
+        self.keys = list(keys)
+        self.values = values
+        self.counts = counts
+        
+        self.orgIndex = dict([(org_id, i)
+                              for i, org_id in enumerate(self.orgs)])
+        self.keyIndex = dict([(key, i)
+                              for i, key in enumerate(self.keys)])
+    
+    @classmethod
+    def fromRows(cls, rows):
+        '''
+        Build the matrix from (org_id, key, mean activity, count) rows
+        '''
+        rows = list(rows)
+        orgs = sorted(set([x[0] for x in rows]))
+        keys = sorted(set([x[1] for x in rows]))
+        matrix = cls(orgs, keys,
+                     np.empty((len(orgs), len(keys))),
+                     np.zeros((len(orgs), len(keys)), dtype=np.int64))
+        matrix.values.fill(np.nan)
+        
+        for org_id, key, avgact, count in rows:
+            i = matrix.orgIndex[org_id]
+            j = matrix.keyIndex[key]
+            if avgact is not None:
+                matrix.values[i, j] = avgact
+            matrix.counts[i, j] = count
+        
+        return matrix
+    
+    def get(self, org_id, key):
+        '''
+        Mean activity of an organism (None if not available)
+        '''
+        i = self.orgIndex.get(org_id)
+        j = self.keyIndex.get(key)
+        if i is None or j is None or np.isnan(self.values[i, j]):
+            return None
+        return float(self.values[i, j])
+    
+    def getValues(self, orgs, keys):
+        '''
+        Mean activity of some organisms (rows) for a series of keys
+        (columns), as a numpy array (NaN if not available)
+        '''
+        values = np.empty((len(orgs), len(keys)))
+        values.fill(np.nan)
+        
+        rows = np.array([self.orgIndex.get(org_id, -1) for org_id in orgs],
+                        dtype=np.int64)
+        cols = np.array([self.keyIndex.get(key, -1) for key in keys],
+                        dtype=np.int64)
+        rfound = np.nonzero(rows >= 0)[0]
+        cfound = np.nonzero(cols >= 0)[0]
+        values[np.ix_(rfound, cfound)] = self.values[np.ix_(rows[rfound],
+                                                            cols[cfound])]
+        return values
+
+class Field(object):
+    '''
+    Class Field
+    Read-only access to a column of a Row; being a non-data descriptor,
+    attributes set on the row with the same name take precedence
+    '''
+    __slots__ = ('index',)
+    
+    def __init__(self, index):
+        self.index = index
+    
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return tuple.__getitem__(obj, self.index)
+
+class Row(tuple):
     '''
     Class Row
-    Holds all the columns as attributes
+    Holds all the columns as attributes (and as a tuple)
     Just provide the single row and its description
+    Missing columns are set to None; other attributes can be added
     '''
-    def __init__(self, data, description):
-        for field in description:
-            try:
-                self.__setattr__(field[0],data[description.index(field)])
-            except:
-                self.__setattr__(field[0],None)
+    _fields = ()
+    
+    def __new__(cls, data, description):
+        klass = getRowClass(description)
+        if type(data) is klass:
+            return data
+        
+        data = tuple(data)
+        if len(data) < len(klass._fields):
+            data += (None,) * (len(klass._fields) - len(data))
+        return tuple.__new__(klass, data)
+    
+    def __reduce__(self):
+        return (makeRow, (self._fields, tuple(self), self.__dict__ or None))
 
 class DBBase(object):
     '''
@@ -44,16 +380,21 @@ class DBBase(object):
     '''
     def __init__(self, dbname='storage'):
         self.dbname = dbname
-        self.connection = None
         self.cursor = None
         self.connect()
     
+    @property
+    def connection(self):
+        '''
+        The connection shared by all the DB objects
+        (of the current process and thread)
+        '''
+        return getConnection(self.dbname)
+    
     def connect(self):
-        self.connection = sqlite3.connect(self.dbname)
+        getConnection(self.dbname)
         
     def getCursor(self):
-        if not self.connection:
-            self.connect()
         if not self.cursor:
             self.cursor = self.connection.cursor()
     
@@ -61,9 +402,7 @@ class DBBase(object):
         if self.cursor:
             self.cursor.close()
         self.cursor = None
-        if self.connection:
-            self.connection.close()
-        self.connection = None
+        closeConnection(self.dbname)
         
     def create(self):
         '''
@@ -71,8 +410,6 @@ class DBBase(object):
         Returns True/False
         '''
         try:
-            self.boost()
-            
             with self.connection:
                 for command in dbcreate.split(';'):
                     self.connection.execute(command+';')
@@ -87,13 +424,259 @@ class DBBase(object):
 
         return True
     
-    def boost(self):
+    def getSchema(self):
+        '''
+        Get the schema version of the DB
+        (old projects have no version at all: 0 is returned)
+        '''
+        with self.connection as conn:
+            cursor = conn.execute('pragma table_info(project);')
+        if 'schema' not in [x[1] for x in cursor.fetchall()]:
+            return 0
+        
+        with self.connection as conn:
+            cursor = conn.execute('select schema from project limit 1;')
+        data = cursor.fetchall()
+        if len(data) == 0 or data[0][0] is None:
+            return 0
+        return int(data[0][0])
+    
+    def setSchema(self, version):
+        '''
+        Set the schema version of the DB
+        '''
+        with self.connection as conn:
+            conn.execute('update project set schema = ?;', [version,])
+    
+    def isUpToDate(self):
+        '''
+        Is the DB schema up to date?
+        '''
+        return self.getSchema() >= dbschema
+    
+    def upgrade(self):
+        '''
+        Bring the DB to the current schema version, one step at a time
+        Returns the number of upgrade steps performed
+        '''
+        version = self.getSchema()
+        steps = 0
+        while version < dbschema:
+            version += 1
+            logger.debug('Upgrading the DB schema to version %d'%version)
+            getattr(self, '_upgrade%d'%version)()
+            self.setSchema(version)
+            steps += 1
+        
+        return steps
+    
+    def _upgrade1(self):
         '''
-        The current connection is boosted
+        Schema version 1
+        Add the schema version to the project table
+        Signals are stored as binary objects instead of text
         '''
         with self.connection as conn:
-            conn.execute(dbboost)
+            cursor = conn.execute('pragma table_info(project);')
+            if 'schema' not in [x[1] for x in cursor.fetchall()]:
+                conn.execute('alter table project add column schema INTEGER DEFAULT (0);')
+        
+        for table in ['biolog_exp_det', 'biolog_purged_exp_det']:
+            with self.connection as conn:
+                cursor = conn.execute('''select plate_id, well_id, org_id,
+                                        replica, times, signals
+                                        from %s;'''%table)
+                rows = cursor.fetchall()
             
+            with self.connection as conn:
+                conn.executemany('''update %s
+                                set times = ?, signals = ?
+                                where plate_id = ?
+                                and well_id = ?
+                                and org_id = ?
+                                and replica = ?;'''%table,
+                                [(packSignals(unpackSignals(times)),
+                                  packSignals(unpackSignals(signals)),
+                                  plate_id, well_id, org_id, replica)
+                                 for plate_id, well_id, org_id, replica,
+                                     times, signals in rows])
+            
+
+    def _upgrade2(self):
+        '''
+        Schema version 2
+        Secondary indexes for the most used lookups and joins
+        '''
+        with self.connection as conn:
+            for command in dbindexes.split(';'):
+                conn.execute(command+';')
+            conn.execute('analyze;')
+
+    def _upgrade3(self):
+        '''
+        Schema version 3
+        Orthologous groups classification table
+        (filled from the pangenome, if present)
+        '''
+        with self.connection as conn:
+            for command in dbpanclass.split(';'):
+                conn.execute(command+';')
+        
+        Genome(self.dbname).classifyPanGenome()
+
+    def _upgrade4(self):
+        '''
+        Schema version 4
+        Main RPairs edges table
+        (filled when first needed, see version 6)
+        '''
+        with self.connection as conn:
+            for command in dbmainedge.split(';'):
+                conn.execute(command+';')
+
+    def _upgrade5(self):
+        '''
+        Schema version 5
+        Mean activity tables
+        (filled from the phenomic data, if present)
+        '''
+        with self.connection as conn:
+            for command in dbbiologavg.split(';'):
+                conn.execute(command+';')
+        
+        Biolog(self.dbname).refreshAvgActivity()
+
+    def _upgrade6(self):
+        '''
+        Schema version 6
+        Main RPairs edges state in the project table
+        (the edges are computed again when first needed)
+        '''
+        with self.connection as conn:
+            cursor = conn.execute('pragma table_info(project);')
+            if 'edges' not in [x[1] for x in cursor.fetchall()]:
+                conn.execute('alter table project add column edges INTEGER DEFAULT (0);')
+            conn.execute('delete from main_edge;')
+            conn.execute('update project set edges = 0;')
+
+    def getKeys(self, table, column):
+        '''
+        Returns the set of the distinct values of a column
+        '''
+        with self.connection as conn:
+            cursor = conn.execute('select distinct %s from %s;'%(column,
+                                                                 table))
+        return set([x[0] for x in cursor])
+    
+    def checkKeys(self, keys, table, column, name):
+        '''
+        Checks that all the keys are present in table.column
+        (the keys are loaded from the DB just once)
+        An exception is raised at the first missing key
+        '''
+        present = self.getKeys(table, column)
+        for key in keys:
+            if key not in present:
+                logger.warning('%s %s is not present yet!'%(name[0].upper() +
+                                                            name[1:], key))
+                raise Exception('This %s (%s) is not present yet!'%(name, key))
+    
+    def executeBatch(self, writes, post=None):
+        '''
+        Runs a series of (query, rows) writes
+        Depending on the storage profile, everything is written in a single
+        transaction or in short ones (batches of rows)
+        If provided, post is called with the connection after the writes,
+        in the same transaction as the last one
+        '''
+        batch = getProfile()['batch']
+        if batch is None:
+            with self.connection as conn:
+                for query, rows in writes:
+                    conn.executemany(query, rows)
+                if post is not None:
+                    post(conn)
+            return
+        
+        last = None
+        for query, rows in writes:
+            for span in get_span(rows, batch):
+                if last is not None:
+                    with self.connection as conn:
+                        conn.executemany(*last)
+                last = (query, span)
+        
+        with self.connection as conn:
+            if last is not None:
+                conn.executemany(*last)
+            if post is not None:
+                post(conn)
+    
+    def clearReactMatrix(self):
+        '''
+        Invalidate the organism x reaction matrix
+        (it will be computed again when needed)
+        '''
+        fname = getMatrixFile(self.dbname)
+        _matrices.pop(fname, None)
+        if os.path.exists(fname):
+            try:
+                os.remove(fname)
+            except OSError as e:
+                logger.warning('Could not remove %s (%s)'%(fname, e))
+    
+    def clearNet(self):
+        '''
+        Invalidate the project-wide metabolic network
+        (it will be computed again when needed)
+        '''
+        fname = getNetFile(self.dbname)
+        if os.path.exists(fname):
+            try:
+                os.remove(fname)
+            except OSError as e:
+                logger.warning('Could not remove %s (%s)'%(fname, e))
+    
+    def clearMainEdges(self):
+        '''
+        Invalidate the "main" RPairs edges
+        (they will be computed again when needed)
+        '''
+        with self.connection as conn:
+            conn.execute('delete from main_edge;')
+            conn.execute('update project set edges = 0;')
+        
+        self.clearNet()
+    
+    def bulkWrite(self, table, rows, mode='insert or ignore', columns=None):
+        '''
+        Write a series of rows (tuples) to a table
+        Returns the number of rows written
+        '''
+        rows = list(rows)
+        if len(rows) == 0:
+            return 0
+        
+        if columns is not None:
+            fields = ' (%s)'%','.join(columns)
+        else:
+            fields = ''
+        query = '%s into %s%s values (%s);'%(mode, table, fields,
+                                            ','.join(['?']*len(rows[0])))
+        
+        start = time.time()
+        self.executeBatch([(query, rows)])
+        if table in matrixTables:
+            self.clearReactMatrix()
+        if table in edgeTables:
+            self.clearMainEdges()
+        if table in netTables:
+            self.clearNet()
+        logger.debug('Written %d rows to %s (%.2fs)'%(len(rows), table,
+                                                     time.time() - start))
+        
+        return len(rows)
+    
     def query(self, sql):
         '''
         Launch a query and returns a generator with each row 
@@ -102,7 +685,7 @@ class DBBase(object):
             cursor=conn.execute(sql)
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
 class Project(DBBase):
     '''
@@ -121,6 +704,8 @@ class Project(DBBase):
         self.genome = None
         self.phenome = None
         self.pangenome = None
+        self.kegg = None
+        self.schema = None
         
         # Populate the project immediately
         self.getProject()
@@ -175,9 +760,11 @@ class Project(DBBase):
         
         with self.connection as conn:
             conn.execute('''insert into project (`name`, `description`, `kind`,
-                                                `tmp`, `creation`, `last`)
-                            values (?,?,?,?,?,?);''',
-                         (name, description, kind, tmp, creation, last,))
+                                                `tmp`, `creation`, `last`,
+                                                `schema`)
+                            values (?,?,?,?,?,?,?);''',
+                         (name, description, kind, tmp, creation, last,
+                          dbschema,))
         
     def updateLast(self):
         '''
@@ -383,7 +970,7 @@ class Organism(DBBase):
             cursor=conn.execute('select * from organism order by org_id')
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
         
     def getOrg(self, org_id):
         '''
@@ -435,6 +1022,9 @@ class Organism(DBBase):
                          (color, org_id))
         
         if not already:
+            # The groups classification depends on the number of organisms
+            Genome(self.dbname).clearPanGenomeClass()
+            self.clearReactMatrix()
             # Reset the genomic/phenomic status
             self.setGenomeStatus(org_id, 'none')
             self.setPhenomeStatus(org_id, 'none')
@@ -460,6 +1050,7 @@ class Organism(DBBase):
         
         with self.connection as conn:
             conn.execute('delete from organism where org_id=?;', (org_id,))
+        self.clearReactMatrix()
         
         oDel = Genome(self.dbname)
         oBDel = Biolog(self.dbname)
@@ -611,6 +1202,8 @@ class Genome(DBBase):
             conn.execute('delete from protein;')
             conn.execute('delete from ortholog;')
             conn.execute('delete from mapko;')
+        self.clearPanGenomeClass()
+        self.clearReactMatrix()
             
         oOrg = Organism(self.dbname)
         oOrg.resetGenomes()
@@ -630,13 +1223,11 @@ class Genome(DBBase):
         '''
         Returns False if at least one prot_id is absent
         '''
-        with self.connection as conn:
-            for prot_id in prots:
-                cursor=conn.execute('select count(*) from protein where prot_id=?;',
-                                [prot_id,])
-                if not bool(cursor.fetchall()[0][0]):
-                    logger.warning('Protein %s is not present yet!'%prot_id)
-                    return False
+        present = self.getKeys('protein', 'prot_id')
+        for prot_id in prots:
+            if prot_id not in present:
+                logger.warning('Protein %s is not present yet!'%prot_id)
+                return False
         
         return True
     
@@ -655,8 +1246,6 @@ class Genome(DBBase):
             logger.warning('Organism %s is not present yet!'%org_id)
             raise Exception('This organism (%s) is not present yet!'%org_id)
         
-        self.boost()
-        
         i = 0
         with self.connection as conn:
             for s in SeqIO.parse(open(pfile),'fasta'):
@@ -666,6 +1255,8 @@ class Genome(DBBase):
         
         logger.debug('Added %d protein to organism %s'%(i,org_id))
         
+        self.clearPanGenomeClass()
+        self.clearReactMatrix()
         self.updateStatus(org_id, 'none')
         oProj = Project(self.dbname)
         oProj.clearPanGenome()
@@ -698,7 +1289,7 @@ class Genome(DBBase):
                                 [org_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getRecords(self, org_id):
         '''
@@ -740,7 +1331,9 @@ class Genome(DBBase):
         
         with self.connection as conn:
             conn.execute('delete from protein where org_id=?;', (org_id,))
-            
+        
+        self.clearPanGenomeClass()
+        self.clearReactMatrix()
         self.delPanGenome()
         
         self.resetProject()
@@ -752,29 +1345,18 @@ class Genome(DBBase):
         Add a bunch of KO IDs mappings
         If merged, the annotation has been taken from the orthology
         '''
-        oCheck = Kegg(self.dbname)
-        
-        self.boost()
-        
+        rows = []
         for prot_id,ko_id in kos:
-            if not self.isProt(prot_id):
-                logger.warning('Protein %s is not present yet!'%prot_id)
-                raise Exception('This Protein (%s) is not present yet!'%prot_id)
-            
             if ko_id.startswith('ko:'):
                 ko_id = ko_id.lstrip('ko:')
-                
-            if not oCheck.isKO('ko:'+ko_id):
-                logger.warning('KO %s is not present yet!'%('ko:'+ko_id))
-                raise Exception('This KO (%s) is not present yet!'%('ko:'+ko_id))
+            rows.append( (prot_id,'ko:'+ko_id,int(merged),) )
         
-        with self.connection as conn:
-            for prot_id,ko_id in kos:
-                if ko_id.startswith('ko:'):
-                    ko_id = ko_id.lstrip('ko:')
-                    
-                conn.execute('insert or replace into mapko values (?,?,?);',
-                             [prot_id,'ko:'+ko_id,int(merged),])
+        oCheck = Kegg(self.dbname)
+        
+        self.checkKeys([x[0] for x in rows], 'protein', 'prot_id', 'Protein')
+        oCheck.checkKeys([x[1] for x in rows], 'ko', 'ko_id', 'KO')
+        
+        self.bulkWrite('mapko', rows, mode='insert or replace')
     
     def getKO(self, prot_id):
         with self.connection as conn:
@@ -782,18 +1364,21 @@ class Genome(DBBase):
                                 [prot_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def delKOs(self, prots):
         with self.connection as conn:
             for prot_id in prots:
                 conn.execute('delete from mapko where prot_id=?;', (prot_id,))
-                
+        
+        self.clearReactMatrix()
         self.resetProject()
         
     def delMergedKOs(self):
         with self.connection as conn:
             conn.execute('delete from mapko where indirect=1;')
+        
+        self.clearReactMatrix()
             
     def howManyMergedKOs(self):
         '''
@@ -816,27 +1401,18 @@ class Genome(DBBase):
         An exception is raised if at least one protein is missing
         '''
         # Check if all the proteins are present
-        prots = [prot_id for ps in list(orthologs.values()) for prot_id in ps]
-        for prot_id in prots:
-            if not self.isProt(prot_id):
-                logger.warning('Protein %s is not present yet!'%prot_id)
-                raise Exception('This Protein (%s) is not present yet!'%prot_id)
-        
-        self.boost()
+        rows = [(group_id,prot_id,) for group_id in orthologs
+                for prot_id in orthologs[group_id]]
+        self.checkKeys([x[1] for x in rows], 'protein', 'prot_id', 'Protein')
         
         # Go for it!
-        i = 0
-        with self.connection as conn:
-            for group_id in orthologs:
-                for prot_id in orthologs[group_id]:
-                    conn.execute('insert or replace into ortholog values (?,?);',
-                             [group_id,prot_id,])
-                i += 1
+        self.bulkWrite('ortholog', rows, mode='insert or replace')
+        self.classifyPanGenome()
         
         oProj = Project(self.dbname)
         oProj.donePanGenome()
         
-        logger.debug('Added %d orthologous groups'%(i))
+        logger.debug('Added %d orthologous groups'%(len(orthologs)))
     
     def getPanGenome(self):
         '''
@@ -846,8 +1422,7 @@ class Genome(DBBase):
         with self.connection as conn:
             cursor = conn.execute('''select * from ortholog;''')
         
-        for res in cursor:
-            obj = Row(res, cursor.description)
+        for obj in cursor:
             if obj.group_id not in pangenome:
                 pangenome[obj.group_id] = []
             pangenome[obj.group_id].append(obj.prot_id)
@@ -864,8 +1439,7 @@ class Genome(DBBase):
                                     from ortholog o, protein p
                                     where o.prot_id = p.prot_id;''')
         
-        for res in cursor:
-            obj = Row(res, cursor.description)
+        for obj in cursor:
             if obj.group_id not in pangenome:
                 pangenome[obj.group_id] = []
             pangenome[obj.group_id].append(obj.org_id)
@@ -900,28 +1474,72 @@ class Genome(DBBase):
         # TODO
         raise NotImplementedError
     
-    def _getCore(self):
+    def classifyPanGenome(self):
         '''
-        Base method to get the core genome
+        Fill the pangenome_class table: number of organisms of each
+        orthologous group and its class (core, accessory, unique)
         '''
-        # How many organisms are present?
         oCheck = Organism(self.dbname)
         nOrgs = oCheck.howMany()
         
         query = '''
-                select distinct group_id, count(distinct org_id) orgs
+                insert into pangenome_class
+                select group_id, count(distinct org_id) orgs,
+                       case when count(distinct org_id) = ? then 'core'
+                            when count(distinct org_id) = 1 then 'unique'
+                            else 'accessory' end
                 from ortholog o, protein r
                 where o.prot_id = r.prot_id
-                group by group_id
-                HAVING orgs = ?;
+                group by group_id;
                 '''
         
         with self.connection as conn:
-            cursor = conn.execute(query,
-                             [nOrgs,])
+            conn.execute('delete from pangenome_class;')
+            conn.execute(query, [nOrgs,])
+    
+    def clearPanGenomeClass(self):
+        '''
+        Invalidate the orthologous groups classification
+        (it will be computed again when needed)
+        '''
+        with self.connection as conn:
+            conn.execute('delete from pangenome_class;')
+    
+    def _getClasses(self, where, params, count=False):
+        '''
+        Base method to get the orthologous groups from the pangenome_class
+        table (filled here if it has been invalidated)
+        where: condition on the number of organisms (n_orgs)
+        '''
+        with self.connection as conn:
+            cursor = conn.execute('''select
+                                    (select max(group_id) from pangenome_class),
+                                    (select max(group_id) from ortholog);''')
+            classified, pangenome = cursor.fetchone()
+        if classified is None and pangenome is not None:
+            self.classifyPanGenome()
+        
+        if count:
+            query = 'select count(*) from pangenome_class where %s;'%where
+        else:
+            query = '''select group_id, n_orgs orgs from pangenome_class
+                       where %s;'''%where
+        
+        with self.connection as conn:
+            cursor = conn.execute(query, params)
         
         return cursor
     
+    def _getCore(self, count=False):
+        '''
+        Base method to get the core genome
+        '''
+        # How many organisms are present?
+        oCheck = Organism(self.dbname)
+        nOrgs = oCheck.howMany()
+        
+        return self._getClasses('n_orgs = ?', [nOrgs,], count)
+    
     def getCore(self):
         '''
         Returns a list of orthologous groups names belonging to the Core genome
@@ -929,21 +1547,15 @@ class Genome(DBBase):
         cursor = self._getCore()
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getLenCore(self):
         '''
         Get core genome size
         '''
-        cursor = self._getCore()
-        
-        i = 0
-        for res in cursor:
-            i += 1
-            
-        return i
+        return int(self._getCore(count=True).fetchone()[0])
     
-    def _getDisp(self):
+    def _getDisp(self, count=False):
         '''
         Base method to get the dispensable genome
         '''
@@ -951,19 +1563,7 @@ class Genome(DBBase):
         oCheck = Organism(self.dbname)
         nOrgs = oCheck.howMany()
         
-        query = '''
-                select distinct group_id, count(distinct org_id) orgs
-                from ortholog o, protein r
-                where o.prot_id = r.prot_id
-                group by group_id
-                HAVING orgs < ?;
-                '''
-        
-        with self.connection as conn:
-            cursor = conn.execute(query,
-                             [nOrgs,])
-        
-        return cursor
+        return self._getClasses('n_orgs < ?', [nOrgs,], count)
     
     def getDisp(self):
         '''
@@ -972,21 +1572,15 @@ class Genome(DBBase):
         cursor = self._getDisp()
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getLenDisp(self):
         '''
         Get dispensable genome size
         '''
-        cursor = self._getDisp()
-        
-        i = 0
-        for res in cursor:
-            i += 1
-            
-        return i
+        return int(self._getDisp(count=True).fetchone()[0])
     
-    def _getAcc(self):
+    def _getAcc(self, count=False):
         '''
         Base method to get the accessory genome
         '''
@@ -994,20 +1588,8 @@ class Genome(DBBase):
         oCheck = Organism(self.dbname)
         nOrgs = oCheck.howMany()
         
-        query = '''
-                select distinct group_id, count(distinct org_id) orgs
-                from ortholog o, protein r
-                where o.prot_id = r.prot_id
-                group by group_id
-                HAVING orgs < ?
-                and orgs > ?;
-                '''
-        
-        with self.connection as conn:
-            cursor = conn.execute(query,
-                             [nOrgs,1,])
-            
-        return cursor
+        return self._getClasses('n_orgs < ? and n_orgs > ?', [nOrgs,1,],
+                                count)
     
     def getAcc(self):
         '''
@@ -1016,37 +1598,19 @@ class Genome(DBBase):
         cursor = self._getAcc()
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getLenAcc(self):
         '''
         Get accessory genome size
         '''
-        cursor = self._getAcc()
-        
-        i = 0
-        for res in cursor:
-            i += 1
-            
-        return i
+        return int(self._getAcc(count=True).fetchone()[0])
     
-    def _getUni(self):
+    def _getUni(self, count=False):
         '''
         Base method to get the unique genome
         '''
-        query = '''
-                select distinct group_id, count(distinct org_id) orgs
-                from ortholog o, protein r
-                where o.prot_id = r.prot_id
-                group by group_id
-                HAVING orgs = ?;
-                '''
-        
-        with self.connection as conn:
-            cursor = conn.execute(query,
-                             [1,])
-        
-        return cursor
+        return self._getClasses('n_orgs = ?', [1,], count)
     
     def getUni(self):
         '''
@@ -1055,35 +1619,24 @@ class Genome(DBBase):
         cursor = self._getUni()
         
         for res in cursor:
-            yield Row(res, cursor.description)    
+            yield res    
             
     def getLenUni(self):
         '''
         Get unique genome size
         '''
-        cursor = self._getUni()
-        
-        i = 0
-        for res in cursor:
-            i += 1
-            
-        return i  
+        return int(self._getUni(count=True).fetchone()[0])
     
     def getGroupNum(self, group_id):
         '''
         Get the number of organisms having the provided ortholog
         '''
-        query = '''
-                select count(distinct org_id) num
-                from ortholog o, protein p
-                where o.prot_id = p.prot_id
-                and group_id = ?;
-                '''
-        
-        with self.connection as conn:
-            cursor=conn.execute(query,[group_id,])
+        cursor = self._getClasses('group_id = ?', [group_id,])
         
-        return int(Row(cursor.fetchall()[0], cursor.description).num)
+        data = cursor.fetchall()
+        if len(data) == 0:
+            return 0
+        return int(data[0].orgs)
         
     def delPanGenome(self):
         '''
@@ -1091,6 +1644,7 @@ class Genome(DBBase):
         '''
         with self.connection as conn:
             conn.execute('delete from ortholog')
+            conn.execute('delete from pangenome_class')
             
         self.resetProject()
         oProj = Project(self.dbname)
@@ -1101,6 +1655,11 @@ class Kegg(DBBase):
     Class Kegg
     Handles all the data about Kegg entries
     '''
+    # Rows built from the organism x reaction matrix
+    _reactNum = (('re_id',), ('num',))
+    _reactOrgs = (('re_id',), ('orgs',))
+    _orgId = (('org_id',),)
+    
     def __init__(self, dbname='storage'):
         DBBase.__init__(self, dbname)
     
@@ -1108,8 +1667,6 @@ class Kegg(DBBase):
         '''
         Remove all the KEGG data
         '''
-        self.boost()
-        
         # Delete the data
         with self.connection as conn:
             conn.execute('delete from ko;')
@@ -1122,6 +1679,11 @@ class Kegg(DBBase):
             conn.execute('delete from react_comp;')
             conn.execute('delete from react_path;')
             conn.execute('delete from rpair_react;')
+            conn.execute('delete from main_edge;')
+            conn.execute('update project set edges = 0;')
+        
+        self.clearReactMatrix()
+        self.clearNet()
         
         # "Update" the release number
         proj = Project(self.dbname)
@@ -1233,8 +1795,6 @@ class Kegg(DBBase):
         Imports the content of the file object inside the kegg tables
         In case of errors there should be a rollback
         '''
-        self.boost()
-        
         with self.connection as conn:
             conn.text_factory = str
             
@@ -1266,6 +1826,10 @@ class Kegg(DBBase):
                     
                     conn.execute(query, [str(x) for x in s[1:]])
         
+        self.clearReactMatrix()
+        self.clearNet()
+        self.buildMainEdges()
+        
         # Last step
         if release:
             proj = Project(self.dbname)
@@ -1276,12 +1840,8 @@ class Kegg(DBBase):
         Add new KOs (skipping if they are already present)
         the input is a list, so no details about this KOs are there yet
         '''
-        self.boost()
-        
-        with self.connection as conn:
-            for ko_id in ko:
-                conn.execute('insert or ignore into ko (`ko_id`) values (?);',
-                     ('ko:'+ko_id,))
+        self.bulkWrite('ko', [('ko:'+ko_id,) for ko_id in ko],
+                       columns=['`ko_id`'])
     
     def addKOs(self, ko):
         '''
@@ -1289,42 +1849,29 @@ class Kegg(DBBase):
         the input is a dictionary
         ko_id --> name, description
         '''
-        self.boost()
+        rows = []
+        for ko_id,values in ko.items():
+            name = values[0]
+            if len(values) > 1:
+                description = values[1]
+            else:
+                description = ''
+            rows.append( (ko_id,name,description,1,) )
         
-        with self.connection as conn:
-            for ko_id,values in ko.items():
-                name = values[0]
-                if len(values) > 1:
-                    description = values[1]
-                else:
-                    description = ''
-                conn.execute('insert or replace into ko values (?,?,?,?);',
-                     (ko_id,name,description,1,))
+        self.bulkWrite('ko', rows, mode='insert or replace')
     
     def addKOReacts(self, koreact):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for ko_id in koreact:
-            if not self.isKO(ko_id):
-                logger.warning('KO %s is not present yet!'
-                                %ko_id)
-                raise Exception('This KO (%s) is not present yet!'
-                                %ko_id)
-            for re_id in koreact[ko_id]:
-                if not self.isReaction(re_id):
-                    logger.warning('Reaction %s is not present yet!'
-                                %re_id)
-                    raise Exception('This reaction (%s) is not present yet!'
-                                %re_id)
-        
-        self.boost()
+        self.checkKeys(koreact, 'ko', 'ko_id', 'KO')
+        self.checkKeys(set([re_id for ko_id in koreact
+                            for re_id in koreact[ko_id]]),
+                       'reaction', 're_id', 'reaction')
         
-        with self.connection as conn:
-            for ko_id in koreact:
-                for re_id in koreact[ko_id]:
-                    conn.execute('insert or ignore into ko_react values (?,?);',
-                                 (ko_id,re_id,))
+        self.bulkWrite('ko_react', [(ko_id,re_id,)
+                                    for ko_id in koreact
+                                    for re_id in koreact[ko_id]])
     
     def getKO2Analyze(self):
         '''
@@ -1334,7 +1881,7 @@ class Kegg(DBBase):
             cursor=conn.execute('select ko_id from ko where analyzed = 0;')
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getAllIDs(self):
         '''
@@ -1490,24 +2037,23 @@ class Kegg(DBBase):
         the input is a dictionary
         re_id --> name, description, enzyme
         '''
-        self.boost()
-        
-        with self.connection as conn:
-            for re_id, values in react.items():
-                name = values[0]
+        rows = []
+        for re_id, values in react.items():
+            name = values[0]
+            
+            if len(values) > 1:
+                description = values[1]
+            else:
+                description = None
                 
-                if len(values) > 1:
-                    description = values[1]
-                else:
-                    description = None
-                    
-                if len(values) > 2:
-                    enzyme = values[2]
-                else:
-                    enzyme = None
-                    
-                conn.execute('insert or ignore into reaction values (?,?,?,?);',
-                     (re_id,name,description,enzyme,))
+            if len(values) > 2:
+                enzyme = values[2]
+            else:
+                enzyme = None
+                
+            rows.append( (re_id,name,description,enzyme,) )
+        
+        self.bulkWrite('reaction', rows)
     
     def isRPair(self, rp_id):
         '''
@@ -1523,20 +2069,50 @@ class Kegg(DBBase):
                          (str(e),rp_id))
             return True
         
-    def hasRPairMain(self, path_id):
+    def buildMainEdges(self):
         '''
-        Inspect if a pathway as at least one rpair of kind "main"
+        Fill the main_edge table: reactions with a "main" RPair
+        (the edges used by the metabolic networks queries)
+        The project keeps track of the edges being built,
+        even if there are no "main" RPairs at all
         '''
         query = '''
-                select count(*)
-                from rpair rp, rpair_react r,  reaction re, react_path p
+                insert into main_edge
+                select distinct r.re_id, co1, co2, re.name
+                from rpair rp, rpair_react r, reaction re
                 where r.rp_id = rp.rp_id
                 and r.re_id = re.re_id
-                and r.re_id=p.re_id
-                and path_id=?
                 and kind like "%main%";
                 '''
         
+        with self.connection as conn:
+            conn.execute('delete from main_edge;')
+            conn.execute(query)
+            conn.execute('update project set edges = 1;')
+    
+    def _checkMainEdges(self):
+        '''
+        Fill the main_edge table if it has been invalidated
+        '''
+        with self.connection as conn:
+            cursor = conn.execute('select edges from project;')
+            res = cursor.fetchone()
+        if res is not None and not res[0]:
+            self.buildMainEdges()
+        
+    def hasRPairMain(self, path_id):
+        '''
+        Inspect if a pathway as at least one rpair of kind "main"
+        '''
+        self._checkMainEdges()
+        
+        query = '''
+                select count(*)
+                from main_edge re, react_path p
+                where re.re_id=p.re_id
+                and path_id=?;
+                '''
+        
         with self.connection as conn:
             cursor=conn.execute(query,
                                 (path_id,))
@@ -1547,14 +2123,16 @@ class Kegg(DBBase):
         Generator to compounds to pathways association
         Only those compounds partecipating in a "main" RPair reaction are returned
         '''
+        self._checkMainEdges()
+        
         with self.connection as conn:
             cursor=conn.execute('''select distinct cp.co_id, cp.path_id
-                                    from rpair rp, comp_path cp
-                                    where kind like "%main%"
-                            and (rp.co1 = cp.co_id or rp.co2 = cp.co_id);''')
+                                    from comp_path cp
+                                    where cp.co_id in (select co1 from main_edge)
+                                    or cp.co_id in (select co2 from main_edge);''')
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
        
     def getAllRPairsReacts(self, org_id=None, path_id=None):
         '''
@@ -1562,51 +2140,41 @@ class Kegg(DBBase):
         If org_id is set, the organism specific subset is retrieved.
         If path_id is set, only those reactiomns from the desired pathway will be retrieved
         '''
+        self._checkMainEdges()
+        
         with self.connection as conn:
             if not org_id:
                 if not path_id:
-                    cursor=conn.execute('''select distinct r.re_id, co1, co2, re.name
-                                    from rpair rp, rpair_react r,  reaction re
-                                    where r.rp_id = rp.rp_id
-                                    and r.re_id = re.re_id
-                                    and kind like "%main%";''')
+                    cursor=conn.execute('''select re_id, co1, co2, name
+                                    from main_edge;''')
                 else:
-                    cursor=conn.execute('''select distinct r.re_id, co1, co2, re.name
-                                    from rpair rp, rpair_react r,  reaction re, react_path p
-                                    where r.rp_id = rp.rp_id
-                                    and r.re_id = re.re_id
-                                    and r.re_id=p.re_id
-                                    and path_id=?
-                                    and kind like "%main%";''',
+                    cursor=conn.execute('''select distinct re.re_id, co1, co2, re.name
+                                    from main_edge re, react_path p
+                                    where re.re_id=p.re_id
+                                    and path_id=?;''',
                                     [path_id,])
             else:
                 if not path_id:
                     cursor=conn.execute('''select distinct k.re_id, co1, co2, re.name
-                                    from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re
+                                    from ko_react k, mapko m, protein p, main_edge re
                                     where k.ko_id = m.ko_id
                                     and p.prot_id = m.prot_id
-                                    and k.re_id = rr.re_id
-                                    and rr.rp_id = rp.rp_id
-                                    and rr.re_id=re.re_id
-                                    and kind like "%main%"
+                                    and k.re_id = re.re_id
                                     and org_id = ?;''',
                                     [org_id,])
                 else:
                     cursor=conn.execute('''select distinct k.re_id, co1, co2, re.name
-                                    from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, react_path p
+                                    from ko_react k, mapko m, protein p, main_edge re, react_path p
                                     where k.ko_id = m.ko_id
                                     and p.prot_id = m.prot_id
-                                    and k.re_id = rr.re_id
-                                    and rr.rp_id = rp.rp_id
-                                    and rr.re_id=re.re_id
-                                    and kind like "%main%"
+                                    and k.re_id = re.re_id
                                     and org_id = ?
                                     and re.re_id=p.re_id
                                     and path_id = ?;''',
                                     [org_id,path_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def addRPairs(self, rp):
         '''
@@ -1614,113 +2182,60 @@ class Kegg(DBBase):
         the input is a dictionary
         co_id --> name, description
         '''
-        self.boost()
-        
-        with self.connection as conn:
-            for rp_id, values in rp.items():
-                co1, co2, kind = values[0], values[1], values[2]
-                conn.execute('insert or ignore into rpair values (?,?,?,?);',
-                     (rp_id,co1,co2,kind,))
+        self.bulkWrite('rpair', [(rp_id,values[0],values[1],values[2],)
+                                 for rp_id, values in rp.items()])
     
     def addReactRPairs(self, reactrpair):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for re_id in reactrpair:
-            if not self.isReaction(re_id):
-                logger.warning('Reaction %s is not present yet!'
-                                %re_id)
-                raise Exception('This reaction (%s) is not present yet!'
-                                %re_id)
-            for rp_id in reactrpair[re_id]:
-                if not self.isRPair(rp_id):
-                    logger.warning('RPair %s is not present yet!'
-                                %rp_id)
-                    raise Exception('This rpair (%s) is not present yet!'
-                                %rp_id)
-        
-        self.boost()
-        
-        with self.connection as conn:
-            for re_id in reactrpair:
-                for rp_id in reactrpair[re_id]:
-                    conn.execute('insert or ignore into rpair_react values (?,?);',
-                                 (rp_id,re_id,))
-                    
+        self.checkKeys(reactrpair, 'reaction', 're_id', 'reaction')
+        self.checkKeys(set([rp_id for re_id in reactrpair
+                            for rp_id in reactrpair[re_id]]),
+                       'rpair', 'rp_id', 'rpair')
+        
+        self.bulkWrite('rpair_react', [(rp_id,re_id,)
+                                       for re_id in reactrpair
+                                       for rp_id in reactrpair[re_id]])
+    
     def addRPairReacts(self, rpairreact):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for rp_id in rpairreact:
-            if not self.isRPair(rp_id):
-                logger.warning('RPair %s is not present yet!'
-                                %rp_id)
-                raise Exception('This rpair (%s) is not present yet!'
-                                %rp_id)
-            for re_id in rpairreact[rp_id]:
-                if not self.isReaction(re_id):
-                    logger.warning('Reaction %s is not present yet!'
-                                %re_id)
-                    raise Exception('This reaction (%s) is not present yet!'
-                                %re_id)
+        self.checkKeys(rpairreact, 'rpair', 'rp_id', 'rpair')
+        self.checkKeys(set([re_id for rp_id in rpairreact
+                            for re_id in rpairreact[rp_id]]),
+                       'reaction', 're_id', 'reaction')
         
-        self.boost()
-        
-        with self.connection as conn:
-            for rp_id in rpairreact:
-                for re_id in rpairreact[rp_id]:
-                    conn.execute('insert or ignore into rpair_react values (?,?);',
-                                 (rp_id,re_id,))
+        self.bulkWrite('rpair_react', [(rp_id,re_id,)
+                                       for rp_id in rpairreact
+                                       for re_id in rpairreact[rp_id]])
     
     def addReactComps(self, reactcomp):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for re_id in reactcomp:
-            if not self.isReaction(re_id):
-                logger.warning('Reaction %s is not present yet!'
-                                %re_id)
-                raise Exception('This reaction (%s) is not present yet!'
-                                %re_id)
-            for co_id in reactcomp[re_id]:
-                if not self.isCompound(co_id):
-                    logger.warning('Compound %s is not present yet!'
-                                %co_id)
-                    raise Exception('This compound (%s) is not present yet!'
-                                %co_id)
-        
-        self.boost()
-        
-        with self.connection as conn:
-            for re_id in reactcomp:
-                for co_id in reactcomp[re_id]:
-                    conn.execute('insert or ignore into react_comp values (?,?);',
-                                 (re_id,co_id,))
-                    
+        self.checkKeys(reactcomp, 'reaction', 're_id', 'reaction')
+        self.checkKeys(set([co_id for re_id in reactcomp
+                            for co_id in reactcomp[re_id]]),
+                       'compound', 'co_id', 'compound')
+        
+        self.bulkWrite('react_comp', [(re_id,co_id,)
+                                      for re_id in reactcomp
+                                      for co_id in reactcomp[re_id]])
+    
     def addCompReacts(self, compreact):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for co_id in compreact:
-            if not self.isCompound(co_id):
-                logger.warning('Compound %s is not present yet!'
-                                %co_id)
-                raise Exception('This compound (%s) is not present yet!'
-                                %co_id)
-            for re_id in compreact[co_id]:
-                if not self.isReaction(re_id):
-                    logger.warning('Reaction %s is not present yet!'
-                                %re_id)
-                    raise Exception('This reaction (%s) is not present yet!'
-                                %re_id)
+        self.checkKeys(compreact, 'compound', 'co_id', 'compound')
+        self.checkKeys(set([re_id for co_id in compreact
+                            for re_id in compreact[co_id]]),
+                       'reaction', 're_id', 'reaction')
         
-        self.boost()
-        
-        with self.connection as conn:
-            for co_id in compreact:
-                for re_id in compreact[co_id]:
-                    conn.execute('insert or ignore into react_comp values (?,?);',
-                                 (re_id,co_id,))
+        self.bulkWrite('react_comp', [(re_id,co_id,)
+                                      for co_id in compreact
+                                      for re_id in compreact[co_id]])
     
     def getReaction(self, re_id):
         if not self.isReaction(re_id):
@@ -1749,7 +2264,7 @@ class Kegg(DBBase):
             cursor=conn.execute(query,[org_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getAllECNumbers(self, org_id):
         '''
@@ -1792,17 +2307,16 @@ class Kegg(DBBase):
         the input is a dictionary
         co_id --> name, description
         '''
-        self.boost()
+        rows = []
+        for co_id, values in co.items():
+            name = values[0]
+            if len(values) > 1:
+                description = values[1]
+            else:
+                description = ''
+            rows.append( (co_id,name,description,) )
         
-        with self.connection as conn:
-            for co_id, values in co.items():
-                name = values[0]
-                if len(values) > 1:
-                    description = values[1]
-                else:
-                    description = ''
-                conn.execute('insert or ignore into compound values (?,?,?);',
-                     (co_id,name,description,))
+        self.bulkWrite('compound', rows)
     
     def getCompound(self, co_id):
         if not self.isCompound(co_id):
@@ -1832,7 +2346,7 @@ class Kegg(DBBase):
                                     [path_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def isCompound(self, co_id):
         '''
@@ -1854,18 +2368,17 @@ class Kegg(DBBase):
         the input is a dictionary
         path_id --> name, description
         '''
-        self.boost()
+        rows = []
+        for path_id, values in path.items():
+            name = values[0]
+            if len(values) > 1:
+                description = values[1]
+            else:
+                description = ''
+            rows.append( (path_id,name,description,) )
         
-        with self.connection as conn:
-            for path_id, values in path.items():
-                name = values[0]
-                if len(values) > 1:
-                    description = values[1]
-                else:
-                    description = ''
-                conn.execute('''insert or replace into pathway
-                                (path_id,name,description) values (?,?,?);''',
-                     (path_id,name,description,))
+        self.bulkWrite('pathway', rows, mode='insert or replace',
+                       columns=['path_id', 'name', 'description'])
     
     def addPathHtml(self, path):
         '''
@@ -1873,8 +2386,6 @@ class Kegg(DBBase):
         the input is a dictionary
         path_id --> html
         '''
-        self.boost()
-        
         with self.connection as conn:
             conn.text_factory = str
             
@@ -1888,26 +2399,14 @@ class Kegg(DBBase):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for path_id in pathreact:
-            if not self.isPathway(path_id):
-                logger.warning('Pathway %s is not present yet!'
-                                %path_id)
-                raise Exception('This pathway (%s) is not present yet!'
-                                %path_id)
-            for re_id in pathreact[path_id]:
-                if not self.isReaction(re_id):
-                    logger.warning('Reaction %s is not present yet!'
-                                %re_id)
-                    raise Exception('This reaction (%s) is not present yet!'
-                                %re_id)
-        
-        self.boost()
+        self.checkKeys(pathreact, 'pathway', 'path_id', 'pathway')
+        self.checkKeys(set([re_id for path_id in pathreact
+                            for re_id in pathreact[path_id]]),
+                       'reaction', 're_id', 'reaction')
         
-        with self.connection as conn:
-            for path_id in pathreact:
-                for re_id in pathreact[path_id]:
-                    conn.execute('insert or ignore into react_path values (?,?);',
-                                 (re_id,path_id,))
+        self.bulkWrite('react_path', [(re_id,path_id,)
+                                      for path_id in pathreact
+                                      for re_id in pathreact[path_id]])
     
     def getReactPath(self, re_id):
         '''
@@ -1921,7 +2420,7 @@ class Kegg(DBBase):
             cursor=conn.execute(query, [re_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getPathReacts(self):
         '''
@@ -1935,7 +2434,7 @@ class Kegg(DBBase):
             cursor=conn.execute(query)
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getPathComps(self, path_id=None):
         '''
@@ -1954,7 +2453,7 @@ class Kegg(DBBase):
                                        order by co_id;''',[path_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getCompPaths(self, co_id):
         '''
@@ -1967,65 +2466,36 @@ class Kegg(DBBase):
                                    order by path_id;''',[co_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
                     
     def addPathComps(self, pathcomp):
         '''
         An exception is thrown if such IDs are not present
         '''
-        for path_id in pathcomp:
-            if not self.isPathway(path_id):
-                logger.warning('Pathway %s is not present yet!'
-                                %path_id)
-                raise Exception('This pathway (%s) is not present yet!'
-                                %path_id)
-            for co_id in pathcomp[path_id]:
-                if not self.isCompound(co_id):
-                    logger.warning('Compound %s is not present yet!'
-                                %co_id)
-                    raise Exception('This compound (%s) is not present yet!'
-                                %co_id)
-        
-        self.boost()
-        
-        with self.connection as conn:
-            for path_id in pathcomp:
-                for co_id in pathcomp[path_id]:
-                    conn.execute('insert or ignore into comp_path values (?,?);',
-                                 (co_id,path_id,))
-                    
+        self.checkKeys(pathcomp, 'pathway', 'path_id', 'pathway')
+        self.checkKeys(set([co_id for path_id in pathcomp
+                            for co_id in pathcomp[path_id]]),
+                       'compound', 'co_id', 'compound')
+        
+        self.bulkWrite('comp_path', [(co_id,path_id,)
+                                     for path_id in pathcomp
+                                     for co_id in pathcomp[path_id]])
+    
     def addPathMaps(self, pathmap):
         '''
         An exception is thrown if such ID is not present
         '''
-        for path_id in pathmap:
-            if not self.isPathway(path_id):
-                logger.warning('Pathway %s is not present yet!'
-                                %path_id)
-                raise Exception('This pathway (%s) is not present yet!'
-                                %path_id)
-        
-        self.boost()
+        self.checkKeys(pathmap, 'pathway', 'path_id', 'pathway')
         
-        with self.connection as conn:
-            conn.text_factory = str
-            
-            for path_id in pathmap:
-                conn.execute('insert or ignore into pathmap (path_id, html) values (?,?);',
-                                 (path_id,'\n'.join(pathmap[path_id]),))
+        self.bulkWrite('pathmap', [(path_id,'\n'.join(pathmap[path_id]),)
+                                   for path_id in pathmap],
+                       columns=['path_id', 'html'])
     
     def addPathPics(self, pathpic):
         '''
         An exception is thrown if such ID is not present
         '''
-        for path_id in pathpic:
-            if not self.isPathway(path_id):
-                logger.warning('Pathway %s is not present yet!'
-                                %path_id)
-                raise Exception('This pathway (%s) is not present yet!'
-                                %path_id)
-        
-        self.boost()
+        self.checkKeys(pathpic, 'pathway', 'path_id', 'pathway')
         
         with self.connection as conn:
             for path_id in pathpic:
@@ -2057,8 +2527,7 @@ class Kegg(DBBase):
             conn.text_factory = str
             cursor=conn.execute(query)
             
-        for res in cursor:
-            path = Row(res, cursor.description)
+        for path in cursor:
             if not self.hasRPairMain(path.path_id):
                 continue
             yield path
@@ -2113,35 +2582,31 @@ class Kegg(DBBase):
             cursor=conn.execute(query)
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getMappedRPairsReact(self, path_id=None):
         '''
         Get all the RPairs Reacts in the pangenome
         '''
+        self._checkMainEdges()
+        
         if not path_id:
             query = '''
                     select distinct k.re_id, co1, co2, re.name
-                    from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re
+                    from ko_react k, mapko m, protein p, main_edge re
                     where k.ko_id = m.ko_id
                     and p.prot_id = m.prot_id
-                    and k.re_id = rr.re_id
-                    and rr.rp_id = rp.rp_id
-                    and rr.re_id=re.re_id
-                    and kind like "%main%"
+                    and k.re_id = re.re_id
                     '''
         else:
             query = '''
                     select distinct k.re_id, co1, co2, re.name
-                    from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, react_path p1
+                    from ko_react k, mapko m, protein p, main_edge re, react_path p1
                     where k.ko_id = m.ko_id
                     and p.prot_id = m.prot_id
-                    and k.re_id = rr.re_id
-                    and rr.rp_id = rp.rp_id
-                    and rr.re_id=re.re_id
+                    and k.re_id = re.re_id
                     and re.re_id=p1.re_id
                     and p1.path_id=?
-                    and kind like "%main%"
                     '''
     
         with self.connection as conn:
@@ -2155,8 +2620,7 @@ class Kegg(DBBase):
         for r in self.getAllReactNum():
             rnums[r.re_id] = r.num
             
-        for res in cursor:
-            r = Row(res, cursor.description)
+        for r in cursor:
             setattr(r, 'weight', rnums[r.re_id])
             yield r
     
@@ -2166,31 +2630,27 @@ class Kegg(DBBase):
         core, dispensable, accessory, unique
         note: the dispensable genome includes the accessory and the unique
         '''
+        self._checkMainEdges()
+        
         genome = Genome(self.dbname)
         
         if not path_id:
             query = '''
                     select distinct k.re_id, co1, co2, re.name, o.group_id
-                        from ko_react k, mapko m, rpair_react rr, rpair rp, reaction re, ortholog o
+                        from ko_react k, mapko m, main_edge re, ortholog o
                         where k.ko_id = m.ko_id
                         and m.prot_id = o.prot_id
-                        and k.re_id = rr.re_id
-                        and rr.rp_id = rp.rp_id
-                        and rr.re_id=re.re_id
-                        and kind like "%main%"
+                        and k.re_id = re.re_id
                     '''
         else:
             query = '''
                     select distinct k.re_id, co1, co2, re.name, o.group_id
-                    from ko_react k, mapko m, rpair_react rr, rpair rp, reaction re, ortholog o, react_path p1
+                    from ko_react k, mapko m, main_edge re, ortholog o, react_path p1
                     where k.ko_id = m.ko_id
                     and m.prot_id = o.prot_id
-                    and k.re_id = rr.re_id
-                    and rr.rp_id = rp.rp_id
-                    and rr.re_id=re.re_id
+                    and k.re_id = re.re_id
                     and re.re_id=p1.re_id
                     and p1.path_id=?
-                    and kind like "%main%"
                     '''
         
         with self.connection as conn:
@@ -2199,22 +2659,33 @@ class Kegg(DBBase):
             else:
                 cursor=conn.execute(query,[path_id,])
         
-        ocore = set([x.group_id for x in genome.getCore()])
-        odisp = set([x.group_id for x in genome.getDisp()])
-        oacc = set([x.group_id for x in genome.getAcc()])
-        ouni = set([x.group_id for x in genome.getUni()])
+        groups = (set([x.group_id for x in genome.getCore()]),
+                  set([x.group_id for x in genome.getDisp()]),
+                  set([x.group_id for x in genome.getAcc()]),
+                  set([x.group_id for x in genome.getUni()]))
             
-        rall = [Row(res, cursor.description) for res in cursor]
-
-        rcore = set([r for r in [x for x in rall if x.group_id in ocore]])
-        rdisp = set([r for r in [x for x in rall if x.group_id in odisp]])
-        racc = set([r for r in [x for x in rall if x.group_id in oacc]])
-        runi = set([r for r in [x for x in rall if x.group_id in ouni]])
+        rall = cursor.fetchall()
         
         rnums = {}
         for r in self.getAllReactNum():
             rnums[r.re_id] = r.num
         
+        return self._splitExclusiveRPairsReact(rall, groups, rnums)
+    
+    def _splitExclusiveRPairsReact(self, rall, groups, rnums):
+        '''
+        Split the RPairs Reacts of the orthologous groups between
+        core, dispensable, accessory, unique (exclusive ones only)
+        groups: core, dispensable, accessory and unique groups sets
+        rnums: re_id --> number of organisms
+        '''
+        ocore, odisp, oacc, ouni = groups
+        
+        rcore = set([r for r in [x for x in rall if x.group_id in ocore]])
+        rdisp = set([r for r in [x for x in rall if x.group_id in odisp]])
+        racc = set([r for r in [x for x in rall if x.group_id in oacc]])
+        runi = set([r for r in [x for x in rall if x.group_id in ouni]])
+        
         core = {}
         for r in rcore:
             setattr(r, 'weight', rnums[r.re_id])
@@ -2242,6 +2713,81 @@ class Kegg(DBBase):
                 set([acc[x] for x in eacc]),
                 set([uni[x] for x in euni]))
     
+    def getPathsRPairsReact(self, paths=None):
+        '''
+        Get the pangenome RPairs Reacts of all the pathways at once
+        (same as getMappedRPairsReact and getExclusiveRPairsReact)
+        Returns a dictionary path_id --> {'all':[...], 'core':set(),
+        'dispensable':set(), 'accessory':set(), 'unique':set()}
+        If paths is provided, only those pathways are returned
+        '''
+        self._checkMainEdges()
+        
+        genome = Genome(self.dbname)
+        
+        query = '''
+                select distinct p1.path_id, k.re_id, co1, co2, re.name
+                from ko_react k, mapko m, protein p, main_edge re, react_path p1
+                where k.ko_id = m.ko_id
+                and p.prot_id = m.prot_id
+                and k.re_id = re.re_id
+                and re.re_id=p1.re_id
+                '''
+        query1 = '''
+                select distinct p1.path_id, k.re_id, co1, co2, re.name, o.group_id
+                from ko_react k, mapko m, main_edge re, ortholog o, react_path p1
+                where k.ko_id = m.ko_id
+                and m.prot_id = o.prot_id
+                and k.re_id = re.re_id
+                and re.re_id=p1.re_id
+                '''
+        
+        rnums = {}
+        for r in self.getAllReactNum():
+            rnums[r.re_id] = r.num
+        
+        groups = (set([x.group_id for x in genome.getCore()]),
+                  set([x.group_id for x in genome.getDisp()]),
+                  set([x.group_id for x in genome.getAcc()]),
+                  set([x.group_id for x in genome.getUni()]))
+        
+        if paths is None:
+            paths = [x.path_id for x in self.getMappedPathways()]
+        paths = set(paths)
+        
+        # Split the rows by pathway (dropping the path_id column)
+        mapped = dict([(path_id, []) for path_id in paths])
+        exclusive = dict([(path_id, []) for path_id in paths])
+        
+        with self.connection as conn:
+            cursor=conn.execute(query)
+            description = cursor.description[1:]
+            for r in cursor:
+                if r.path_id not in paths:
+                    continue
+                row = Row(r[1:], description)
+                setattr(row, 'weight', rnums[row.re_id])
+                mapped[r.path_id].append(row)
+        
+        with self.connection as conn:
+            cursor=conn.execute(query1)
+            description = cursor.description[1:]
+            for r in cursor:
+                if r.path_id not in paths:
+                    continue
+                exclusive[r.path_id].append(Row(r[1:], description))
+        
+        result = {}
+        for path_id in paths:
+            ecore, edisp, eacc, euni = self._splitExclusiveRPairsReact(
+                                                        exclusive[path_id],
+                                                        groups, rnums)
+            result[path_id] = {'all':mapped[path_id],
+                               'core':ecore, 'dispensable':edisp,
+                               'accessory':eacc, 'unique':euni}
+        
+        return result
+    
     def getExclusiveRPairsReactMutants(self, ref_id, muts=set(), path_id=None):
         '''
         Return the RPairs Reacts in a list of mutants
@@ -2328,7 +2874,7 @@ class Kegg(DBBase):
         with self.connection as conn:
             cursor=conn.execute(query)
                         
-        rall = [Row(res, cursor.description) for res in cursor]
+        rall = cursor.fetchall()
         groups = set([x.group_id for x in genome.getCore()])
         
         for r in [x for x in rall if x.group_id in groups]:
@@ -2339,34 +2885,30 @@ class Kegg(DBBase):
         '''
         Get core genome rpairs reactions (and numerosity)
         '''
+        self._checkMainEdges()
+        
         nOrg = Organism(self.dbname).howMany()
         genome = Genome(self.dbname)
         
         if not path_id:
             query = '''
                     select distinct k.re_id, co1, co2, o.group_id, re.name
-                    from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o
+                    from ko_react k, mapko m, protein p, main_edge re, ortholog o
                     where k.ko_id = m.ko_id
                     and p.prot_id = m.prot_id
                     and p.prot_id = o.prot_id
-                    and k.re_id = rr.re_id
-                    and rr.rp_id = rp.rp_id
-                    and rr.re_id=re.re_id
-                    and kind like "%main%";
+                    and k.re_id = re.re_id;
                     '''
         else:
             query = '''
                     select distinct k.re_id, co1, co2, o.group_id, re.name
-                    from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o, react_path p1
+                    from ko_react k, mapko m, protein p, main_edge re, ortholog o, react_path p1
                     where k.ko_id = m.ko_id
                     and p.prot_id = m.prot_id
                     and p.prot_id = o.prot_id
-                    and k.re_id = rr.re_id
-                    and rr.rp_id = rp.rp_id
-                    and rr.re_id=re.re_id
+                    and k.re_id = re.re_id
                     and re.re_id=p1.re_id
-                    and p1.path_id=?
-                    and kind like "%main%";
+                    and p1.path_id=?;
                     '''
     
         with self.connection as conn:
@@ -2376,7 +2918,7 @@ class Kegg(DBBase):
                 cursor=conn.execute(query,
                                     [path_id,])
                 
-        rall = [Row(res, cursor.description) for res in cursor]
+        rall = cursor.fetchall()
         groups = set([x.group_id for x in genome.getCore()])
         
         already = set()
@@ -2404,42 +2946,38 @@ class Kegg(DBBase):
         with self.connection as conn:
             cursor=conn.execute(query)
             
-        rall = [Row(res, cursor.description) for res in cursor]
-        groups = set([x.group_id for x in genome.getDisp()])
+        rall = cursor.fetchall()
+        groups = dict([(x.group_id, x.orgs) for x in genome.getDisp()])
         
         for r in [x for x in rall if x.group_id in groups]:
-            setattr(r, 'num', genome.getGroupNum(r.group_id))
+            setattr(r, 'num', groups[r.group_id])
             yield r
     
     def getDispensableRPairsReact(self, path_id=None):
         '''
         Get dispensable genome rpairs reactions (and numerosity)
         '''
+        self._checkMainEdges()
+        
         genome = Genome(self.dbname)
         
         if not path_id:
             query = '''
                 select distinct k.re_id, co1, co2, o.group_id, re.name
-                from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o
+                from ko_react k, mapko m, protein p, main_edge re, ortholog o
                 where k.ko_id = m.ko_id
                 and p.prot_id = m.prot_id
                 and p.prot_id = o.prot_id
-                and k.re_id = rr.re_id
-                and rr.rp_id = rp.rp_id
-                and rr.re_id=re.re_id
-                and kind like "%main%";
+                and k.re_id = re.re_id;
                 '''
         else:
             query = '''
                 select distinct k.re_id, co1, co2, o.group_id, re.name
-                from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o, react_path p1
+                from ko_react k, mapko m, protein p, main_edge re, ortholog o, react_path p1
                 where k.ko_id = m.ko_id
                 and p.prot_id = m.prot_id
                 and p.prot_id = o.prot_id
-                and k.re_id = rr.re_id
-                and rr.rp_id = rp.rp_id
-                and rr.re_id=re.re_id
-                and kind like "%main%"
+                and k.re_id = re.re_id
                 and re.re_id = p1.re_id
                 and p1.path_id = ?;
                 '''
@@ -2451,14 +2989,14 @@ class Kegg(DBBase):
                 cursor=conn.execute(query,
                                     [path_id,])
             
-        rall = [Row(res, cursor.description) for res in cursor]
-        groups = set([x.group_id for x in genome.getDisp()])
+        rall = cursor.fetchall()
+        groups = dict([(x.group_id, x.orgs) for x in genome.getDisp()])
         
         # Get max organism numerosity
         rpath = {}
         for r in [x for x in rall if x.group_id in groups]:
             rpath[r.re_id+r.co1+r.co2] = rpath.get(r.re_id+r.co1+r.co2, set())
-            rpath[r.re_id+r.co1+r.co2].add(genome.getGroupNum(r.group_id))
+            rpath[r.re_id+r.co1+r.co2].add(groups[r.group_id])
         
         already = set()
         for r in [x for x in rall if x.group_id in groups]:
@@ -2485,42 +3023,38 @@ class Kegg(DBBase):
         with self.connection as conn:
             cursor=conn.execute(query)
             
-        rall = [Row(res, cursor.description) for res in cursor]
-        groups = set([x.group_id for x in genome.getAcc()])
+        rall = cursor.fetchall()
+        groups = dict([(x.group_id, x.orgs) for x in genome.getAcc()])
         
         for r in [x for x in rall if x.group_id in groups]:
-            setattr(r, 'num', genome.getGroupNum(r.group_id))
+            setattr(r, 'num', groups[r.group_id])
             yield r
     
     def getAccessoryRPairsReact(self, path_id=None):
         '''
         Get accessory genome rpairs reactions (and numerosity)
         '''
+        self._checkMainEdges()
+        
         genome = Genome(self.dbname)
         
         if not path_id:
             query = '''
                 select distinct k.re_id, co1, co2, o.group_id, re.name
-                from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o
+                from ko_react k, mapko m, protein p, main_edge re, ortholog o
                 where k.ko_id = m.ko_id
                 and p.prot_id = m.prot_id
                 and p.prot_id = o.prot_id
-                and k.re_id = rr.re_id
-                and rr.rp_id = rp.rp_id
-                and rr.re_id=re.re_id
-                and kind like "%main%";
+                and k.re_id = re.re_id;
                 '''
         else:
             query = '''
                 select distinct k.re_id, co1, co2, o.group_id, re.name
-                from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o, react_path p1
+                from ko_react k, mapko m, protein p, main_edge re, ortholog o, react_path p1
                 where k.ko_id = m.ko_id
                 and p.prot_id = m.prot_id
                 and p.prot_id = o.prot_id
-                and k.re_id = rr.re_id
-                and rr.rp_id = rp.rp_id
-                and rr.re_id=re.re_id
-                and kind like "%main%"
+                and k.re_id = re.re_id
                 and re.re_id = p1.re_id
                 and p1.path_id = ?;
                 '''
@@ -2532,14 +3066,14 @@ class Kegg(DBBase):
                 cursor=conn.execute(query,
                                     [path_id,])
             
-        rall = [Row(res, cursor.description) for res in cursor]
-        groups = set([x.group_id for x in genome.getAcc()])
+        rall = cursor.fetchall()
+        groups = dict([(x.group_id, x.orgs) for x in genome.getAcc()])
         
         # Get max organism numerosity
         rpath = {}
         for r in [x for x in rall if x.group_id in groups]:
             rpath[r.re_id+r.co1+r.co2] = rpath.get(r.re_id+r.co1+r.co2, set())
-            rpath[r.re_id+r.co1+r.co2].add(genome.getGroupNum(r.group_id))
+            rpath[r.re_id+r.co1+r.co2].add(groups[r.group_id])
         
         already = set()
         for r in [x for x in rall if x.group_id in groups]:
@@ -2565,7 +3099,7 @@ class Kegg(DBBase):
         with self.connection as conn:
             cursor=conn.execute(query)
             
-        rall = [Row(res, cursor.description) for res in cursor]
+        rall = cursor.fetchall()
         groups = set([x.group_id for x in genome.getUni()])
         
         for r in [x for x in rall if x.group_id in groups]:
@@ -2576,31 +3110,27 @@ class Kegg(DBBase):
         '''
         Get unique genome rpairs reactions (and numerosity)
         '''
+        self._checkMainEdges()
+        
         genome = Genome(self.dbname)
         
         if not path_id:
             query = '''
                 select distinct k.re_id, co1, co2, o.group_id, re.name
-                from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o
+                from ko_react k, mapko m, protein p, main_edge re, ortholog o
                 where k.ko_id = m.ko_id
                 and p.prot_id = m.prot_id
                 and p.prot_id = o.prot_id
-                and k.re_id = rr.re_id
-                and rr.rp_id = rp.rp_id
-                and rr.re_id=re.re_id
-                and kind like "%main%";
+                and k.re_id = re.re_id;
                 '''
         else:
             query = '''
                 select distinct k.re_id, co1, co2, o.group_id, re.name
-                from ko_react k, mapko m, protein p, rpair_react rr, rpair rp, reaction re, ortholog o, react_path p1
+                from ko_react k, mapko m, protein p, main_edge re, ortholog o, react_path p1
                 where k.ko_id = m.ko_id
                 and p.prot_id = m.prot_id
                 and p.prot_id = o.prot_id
-                and k.re_id = rr.re_id
-                and rr.rp_id = rp.rp_id
-                and rr.re_id=re.re_id
-                and kind like "%main%"
+                and k.re_id = re.re_id
                 and re.re_id = p1.re_id
                 and p1.path_id = ?;
                 '''
@@ -2612,54 +3142,113 @@ class Kegg(DBBase):
                 cursor=conn.execute(query,
                                     [path_id,])
             
-        rall = [Row(res, cursor.description) for res in cursor]
+        rall = cursor.fetchall()
         groups = set([x.group_id for x in genome.getUni()])
         
-        already = set()
-        for r in [x for x in rall if x.group_id in groups]:
-            if r.re_id+r.co1+r.co2 in already:
-                continue
-            already.add(r.re_id+r.co1+r.co2)
-            setattr(r, 'weight', 1)
-            yield r
-            
+        already = set()
+        for r in [x for x in rall if x.group_id in groups]:
+            if r.re_id+r.co1+r.co2 in already:
+                continue
+            already.add(r.re_id+r.co1+r.co2)
+            setattr(r, 'weight', 1)
+            yield r
+            
+    def getReactMatrix(self):
+        '''
+        Get the organism x reaction matrix (see ReactMatrix)
+        The matrix is saved next to the DB and computed again only
+        after the proteins, KO mappings, KO reactions or organisms change
+        '''
+        fname = getMatrixFile(self.dbname)
+        try:
+            mtime = os.path.getmtime(fname)
+        except OSError:
+            mtime = None
+        
+        if mtime is not None:
+            cached = _matrices.get(fname)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            
+            try:
+                matrix = ReactMatrix.load(fname)
+                _matrices[fname] = (mtime, matrix)
+                return matrix
+            except Exception as e:
+                logger.debug('Could not load %s (%s)'%(fname, e))
+        
+        start = time.time()
+        matrix = self._buildReactMatrix()
+        logger.debug('Organism x reaction matrix: %d x %d (%.2fs)'%
+                     (len(matrix.orgs), len(matrix.reacts),
+                      time.time() - start))
+        
+        try:
+            matrix.save(fname)
+            _matrices[fname] = (os.path.getmtime(fname), matrix)
+        except (IOError, OSError) as e:
+            logger.debug('Could not save %s (%s)'%(fname, e))
+        
+        return matrix
+    
+    def _buildReactMatrix(self):
+        '''
+        Compute the organism x reaction matrix from the DB
+        '''
+        organism = Organism(self.dbname)
+        orgs = sorted([org.org_id for org in organism.getAll()])
+        orgIndex = dict([(org_id, i) for i, org_id in enumerate(orgs)])
+        
+        query = '''
+                select org_id, k.re_id, count(distinct p.prot_id) num,
+                       count(*) links
+                from protein p, mapko m, ko_react k
+                where p.prot_id=m.prot_id
+                and m.ko_id=k.ko_id
+                group by org_id, k.re_id;
+                '''
+        
+        with self.connection as conn:
+            cursor=conn.execute(query)
+        rall = [x for x in cursor if x.org_id in orgIndex]
+        
+        reacts = sorted(set([x.re_id for x in rall]))
+        reactIndex = dict([(re_id, i) for i, re_id in enumerate(reacts)])
+        
+        counts = np.zeros((len(orgs), len(reacts)), dtype=np.int32)
+        links = np.zeros(len(orgs), dtype=np.int64)
+        for r in rall:
+            counts[orgIndex[r.org_id], reactIndex[r.re_id]] = r.num
+            links[orgIndex[r.org_id]] += r.links
+        
+        return ReactMatrix(orgs, reacts, counts, links)
+    
     def getOrgReact(self, org_id):
         '''
         Get reactions from a defined organism (and numerosity)
         '''
-        query = '''
-                select distinct re_id, count(distinct p.prot_id) num
-                from ko_react k, mapko m, protein p
-                where k.ko_id = m.ko_id
-                and p.prot_id = m.prot_id
-                and org_id = ?
-                group by re_id
-                order by num DESC;
-                '''
+        matrix = self.getReactMatrix()
+        if org_id not in matrix.orgIndex:
+            return
         
-        with self.connection as conn:
-            cursor=conn.execute(query,[org_id,])
-            
-        for res in cursor:
-            yield Row(res, cursor.description)
-            
+        row = matrix.counts[matrix.orgIndex[org_id]]
+        idx = np.nonzero(row)[0]
+        idx = idx[np.argsort(-row[idx], kind='mergesort')]
+        
+        for i in idx:
+            yield Row((matrix.reacts[i], int(row[i])), self._reactNum)
+    
     def getReactOrg(self, re_id):
         '''
         Get organism(s) from a defined reaction
         '''
-        query = '''
-                select distinct org_id
-                from ko_react k, mapko m, protein p
-                where k.ko_id = m.ko_id
-                and p.prot_id = m.prot_id
-                and re_id = ?
-                '''
+        matrix = self.getReactMatrix()
+        if re_id not in matrix.reactIndex:
+            return
         
-        with self.connection as conn:
-            cursor=conn.execute(query,[re_id,])
-            
-        for res in cursor:
-            yield Row(res, cursor.description)
+        column = matrix.presence[:, matrix.reactIndex[re_id]]
+        for i in np.nonzero(column)[0]:
+            yield Row((matrix.orgs[i],), self._orgId)
             
     def getReferenceReact(self, mut_id, ref_id):
         '''
@@ -2683,7 +3272,7 @@ class Kegg(DBBase):
             cursor=conn.execute(query,[ref_id,mut_id,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getExclusiveReactions(self, orgs=set()):
         '''
@@ -2701,35 +3290,19 @@ class Kegg(DBBase):
                     logger.warning('Organism %s is not present yet!'%org_id)
                     raise Exception('This Organism (%s) is not present yet!'%org_id)
         
-        react = {}
+        matrix = self.getReactMatrix()
         
-        for org_id in orgs:
-            query = '''
-                    select distinct re_id
-                    from protein p, mapko m, ko_react k
-                    where org_id=?
-                    and p.prot_id=m.prot_id
-                    and m.ko_id=k.ko_id;
-                    '''
-            
-            with self.connection as conn:
-                cursor=conn.execute(query,[org_id,])
-            
-                r = set()
-                for res in cursor:
-                    r.add(res[0])
-                react[org_id] = r
+        orgs = list(orgs)
+        presence = matrix.presence[[matrix.orgIndex[org_id]
+                                    for org_id in orgs]]
+        # Reactions present in just one of these organisms
+        exclusive = presence.sum(axis=0) == 1
         
         out = {}
-        
-        # Thanks to @balpha for this one
-        # http://stackoverflow.com/a/2042394/1237531
-        from itertools import combinations
-        all_orgs = set(react.keys())
-        for i in combinations(react, len(react)-1):
-            this_orgs = set(i)
-            org_id = all_orgs.difference(this_orgs).pop()
-            out[org_id] = react[org_id].difference(*[react[x] for x in this_orgs])            
+        for i, org_id in enumerate(orgs):
+            out[org_id] = set([matrix.reacts[j]
+                               for j in np.nonzero(presence[i] &
+                                                   exclusive)[0]])
            
         return out
     
@@ -2813,7 +3386,7 @@ class Kegg(DBBase):
         acc = set([x.group_id for x in genome.getAcc()])
         uni = set([x.group_id for x in genome.getUni()])
             
-        rall = [Row(res, cursor.description) for res in cursor]
+        rall = cursor.fetchall()
 
         rcore = set([r.re_id for r in [x for x in rall if x.group_id in core]])
         rdisp = set([r.re_id for r in [x for x in rall if x.group_id in disp]])
@@ -2850,7 +3423,7 @@ class Kegg(DBBase):
             with self.connection as conn:
                 cursor=conn.execute(query)
             
-            rall = [Row(res, cursor.description) for res in cursor]
+            rall = cursor.fetchall()
             if pangenome == 'core':
                 groups = set([x.group_id for x in genome.getCore()])
                 
@@ -2905,7 +3478,7 @@ class Kegg(DBBase):
             with self.connection as conn:
                 cursor=conn.execute(query)
             
-            rall = [Row(res, cursor.description) for res in cursor]
+            rall = cursor.fetchall()
             if pangenome == 'core':
                 groups = set([x.group_id for x in genome.getCore()])
                 
@@ -2941,13 +3514,10 @@ class Kegg(DBBase):
         is returned
         '''
         if org_id:
-            query = '''
-                select count(k.re_id)
-                from mapko m, protein p, ko_react k
-                where m.prot_id = p.prot_id
-                and org_id = ?
-                and m.ko_id = k.ko_id
-                '''
+            matrix = self.getReactMatrix()
+            if org_id not in matrix.orgIndex:
+                return 0
+            return int(matrix.links[matrix.orgIndex[org_id]])
         elif pangenome in ['core', 'dispensable', 'accessory', 'unique']:
             genome = Genome(self.dbname)
             
@@ -2961,7 +3531,7 @@ class Kegg(DBBase):
             with self.connection as conn:
                 cursor=conn.execute(query)
             
-            rall = [Row(res, cursor.description) for res in cursor]
+            rall = cursor.fetchall()
             if pangenome == 'core':
                 groups = set([x.group_id for x in genome.getCore()])
                 
@@ -2979,18 +3549,7 @@ class Kegg(DBBase):
             return len(pairs)    
 
         else:
-            query = '''
-                    select count(k.re_id)
-                    from mapko m, ko_react k
-                    where m.ko_id = k.ko_id
-                    '''
-            
-        with self.connection as conn:
-            if org_id:
-                cursor=conn.execute(query,[org_id,])
-            else:
-                cursor=conn.execute(query)
-        return int(cursor.fetchall()[0][0])
+            return int(self.getReactMatrix().links.sum())
     
     def howManyUniqueReactions(self, org_id=None, pangenome=''):
         '''
@@ -2999,13 +3558,10 @@ class Kegg(DBBase):
         is returned
         '''
         if org_id:
-            query = '''
-                    select count(distinct k.re_id)
-                    from mapko m, protein p, ko_react k
-                    where m.prot_id = p.prot_id
-                    and org_id = ?
-                    and m.ko_id = k.ko_id
-                    '''
+            matrix = self.getReactMatrix()
+            if org_id not in matrix.orgIndex:
+                return 0
+            return int(matrix.presence[matrix.orgIndex[org_id]].sum())
         elif pangenome in ['core', 'dispensable', 'accessory', 'unique']:
             genome = Genome(self.dbname)
             
@@ -3019,7 +3575,7 @@ class Kegg(DBBase):
             with self.connection as conn:
                 cursor=conn.execute(query)
             
-            rall = [Row(res, cursor.description) for res in cursor]
+            rall = cursor.fetchall()
             if pangenome == 'core':
                 groups = set([x.group_id for x in genome.getCore()])
                 
@@ -3036,18 +3592,7 @@ class Kegg(DBBase):
             return len(reacts)
             
         else:
-            query = '''
-                    select count(distinct k.re_id)
-                    from mapko m, ko_react k
-                    where m.ko_id = k.ko_id
-                    '''
-            
-        with self.connection as conn:
-            if org_id:
-                cursor=conn.execute(query,[org_id,])
-            else:
-                cursor=conn.execute(query)
-        return int(cursor.fetchall()[0][0])
+            return len(self.getReactMatrix().reacts)
     
     def howManyPathways(self, org_id=None, pangenome=''):
         '''
@@ -3079,7 +3624,7 @@ class Kegg(DBBase):
             with self.connection as conn:
                 cursor=conn.execute(query)
             
-            rall = [Row(res, cursor.description) for res in cursor]
+            rall = cursor.fetchall()
             if pangenome == 'core':
                 groups = set([x.group_id for x in genome.getCore()])
                 
@@ -3142,7 +3687,7 @@ class Kegg(DBBase):
             with self.connection as conn:
                 cursor=conn.execute(query)
             
-            rall = [Row(res, cursor.description) for res in cursor]
+            rall = cursor.fetchall()
             if pangenome == 'core':
                 groups = set([x.group_id for x in genome.getCore()])
                 
@@ -3157,7 +3702,7 @@ class Kegg(DBBase):
                 
             paths = set([r.path_id for r in [x for x in rall if x.group_id in groups]])
             for p in paths:
-                yield Row([p], ['path_id'])
+                yield Row([p], [('path_id',)])
         
         else:
             query = '''
@@ -3175,85 +3720,47 @@ class Kegg(DBBase):
                 cursor=conn.execute(query)
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
-    def getConservedReactions(self, path_id=None):
+    def _getReactionsByOrgs(self, path_id, conserved):
         '''
-        Get the reactions that are present in each organism
-        This does not consider the orthologs but just the reaction IDs
+        Base method for the conserved/variable reactions
+        (present in all the organisms or not)
         '''
-        # How many organisms are present?
-        oCheck = Organism(self.dbname)
-        nOrgs = oCheck.howMany()
+        matrix = self.getReactMatrix()
         
-        if path_id is None:
-            query = '''
-                    select distinct re_id, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k
-                    where p.prot_id=m.prot_id
-                    and m.ko_id=k.ko_id
-                    group by re_id
-                    having orgs=?
-                    '''
-            
-            with self.connection as conn:
-                cursor=conn.execute(query,[nOrgs,])
+        norgs = matrix.presence.sum(axis=0)
+        if conserved:
+            mask = norgs == len(matrix.orgs)
         else:
-            query = '''
-                    select distinct k.re_id, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k, react_path r
-                    where p.prot_id=m.prot_id
-                    and m.ko_id=k.ko_id
-                    and k.re_id=r.re_id
-                    and path_id=?
-                    group by k.re_id
-                    having orgs=?
-                    '''
-            
+            mask = norgs < len(matrix.orgs)
+        
+        if path_id is not None:
             with self.connection as conn:
-                cursor=conn.execute(query,[path_id, nOrgs,])
-            
-        for res in cursor:
-            yield Row(res, cursor.description)
+                cursor=conn.execute('''select re_id from react_path
+                                       where path_id=?;''',[path_id,])
+            inpath = np.zeros(len(matrix.reacts), dtype=bool)
+            for res in cursor:
+                if res.re_id in matrix.reactIndex:
+                    inpath[matrix.reactIndex[res.re_id]] = True
+            mask &= inpath
+        
+        for i in np.nonzero(mask)[0]:
+            yield Row((matrix.reacts[i], int(norgs[i])), self._reactOrgs)
+    
+    def getConservedReactions(self, path_id=None):
+        '''
+        Get the reactions that are present in each organism
+        This does not consider the orthologs but just the reaction IDs
+        '''
+        return self._getReactionsByOrgs(path_id, True)
             
     def getVariableReactions(self, path_id=None):
         '''
         Get the reactions that are differentially present in each organism
         This does not consider the orthologs but just the reaction IDs
         '''
-        # How many organisms are present?
-        oCheck = Organism(self.dbname)
-        nOrgs = oCheck.howMany()
-        
-        if path_id is None:
-            query = '''
-                    select distinct re_id, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k
-                    where p.prot_id=m.prot_id
-                    and m.ko_id=k.ko_id
-                    group by re_id
-                    having orgs<?
-                    '''
-            
-            with self.connection as conn:
-                cursor=conn.execute(query,[nOrgs,])
-        else:
-            query = '''
-                    select distinct k.re_id, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k, react_path r
-                    where p.prot_id=m.prot_id
-                    and m.ko_id=k.ko_id
-                    and k.re_id=r.re_id
-                    and path_id=?
-                    group by k.re_id
-                    having orgs<?
-                    '''
-            
-            with self.connection as conn:
-                cursor=conn.execute(query,[path_id, nOrgs,])
-            
-        for res in cursor:
-            yield Row(res, cursor.description)
+        return self._getReactionsByOrgs(path_id, False)
             
     def getConservedRPairsReact(self, path_id=None):
         '''
@@ -3267,7 +3774,8 @@ class Kegg(DBBase):
         if path_id is None:
             query = '''
                     select k.re_id, co1, co2, re.name, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k, rpair_react rr, rpair rp, reaction re
+                    from protein p, mapko m, ko_react k, rpair_react rr,
+                    rpair rp, reaction re
                     where p.prot_id=m.prot_id
                     and m.ko_id=k.ko_id
                     and rr.re_id=k.re_id
@@ -3282,7 +3790,8 @@ class Kegg(DBBase):
         else:
             query = '''
                     select k.re_id, co1, co2, re.name, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k, rpair_react rr, rpair rp, reaction re, react_path r
+                    from protein p, mapko m, ko_react k, rpair_react rr,
+                    rpair rp, reaction re, react_path r
                     where p.prot_id=m.prot_id
                     and m.ko_id=k.ko_id
                     and rr.re_id=k.re_id
@@ -3298,7 +3807,7 @@ class Kegg(DBBase):
                 cursor=conn.execute(query,[path_id, nOrgs,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getVariableRPairsReact(self, path_id=None):
         '''
@@ -3312,7 +3821,8 @@ class Kegg(DBBase):
         if path_id is None:
             query = '''
                     select k.re_id, co1, co2, re.name, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k, rpair_react rr, rpair rp, reaction re
+                    from protein p, mapko m, ko_react k, rpair_react rr,
+                    rpair rp, reaction re
                     where p.prot_id=m.prot_id
                     and m.ko_id=k.ko_id
                     and rr.re_id=k.re_id
@@ -3327,7 +3837,8 @@ class Kegg(DBBase):
         else:
             query = '''
                     select k.re_id, co1, co2, re.name, count(distinct org_id) orgs
-                    from protein p, mapko m, ko_react k, rpair_react rr, rpair rp, reaction re, react_path r
+                    from protein p, mapko m, ko_react k, rpair_react rr,
+                    rpair rp, reaction re, react_path r
                     where p.prot_id=m.prot_id
                     and m.ko_id=k.ko_id
                     and rr.re_id=k.re_id
@@ -3343,7 +3854,7 @@ class Kegg(DBBase):
                 cursor=conn.execute(query,[path_id, nOrgs,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
 class Biolog(DBBase):
     '''
@@ -3370,6 +3881,8 @@ class Biolog(DBBase):
         with self.connection as conn:
             conn.execute('delete from biolog_exp;')
             conn.execute('delete from biolog_exp_det;')
+            conn.execute('delete from biolog_avg;')
+            conn.execute('delete from biolog_co_avg;')
             conn.execute('delete from biolog_purged_exp;')
             conn.execute('delete from biolog_purged_exp_det;')
             
@@ -3404,8 +3917,6 @@ class Biolog(DBBase):
         Used when first create the database and to add custom plates
         In case of errors there should be a rollback
         '''
-        self.boost()
-        
         with self.connection as conn:
             for l in open(infile):
                 if l.lstrip().startswith('#'):continue
@@ -3423,6 +3934,8 @@ class Biolog(DBBase):
                 query = '''insert or replace into biolog values (%s);'''%(values)
                 
                 conn.execute(query, s)
+            
+            self._refreshAvgActivity(conn)
     
     def create(self):
         '''
@@ -3473,7 +3986,7 @@ class Biolog(DBBase):
             cursor=conn.execute('select distinct plate_id from biolog order by plate_id;')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getPlateWells(self, plate_id):
         '''
@@ -3486,7 +3999,7 @@ class Biolog(DBBase):
                                    order by well_id;''',[plate_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description).well_id
+            yield res.well_id
     
     def getPlate(self, plate_id):
         with self.connection as conn:
@@ -3494,7 +4007,7 @@ class Biolog(DBBase):
                                 [plate_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getWells(self):
         with self.connection as conn:
@@ -3502,7 +4015,7 @@ class Biolog(DBBase):
                                    from biolog order by well_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getWell(self, plate_id, well_id):
         '''
@@ -3528,7 +4041,7 @@ class Biolog(DBBase):
                                 order by plate_id, well_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def isMulti(self, plate_id, well_id):
         '''
@@ -3565,7 +4078,7 @@ class Biolog(DBBase):
                                 [plate_id, mywell.chemical, 1, 2, 3, 4,])
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getCategs(self, active=False):
         '''
@@ -3574,15 +4087,16 @@ class Biolog(DBBase):
         with self.connection as conn:
             if active:
                 cursor=conn.execute('''select distinct category
-                                    from biolog b, biolog_exp e
-                                    where b.plate_id = e.plate_id
+                                    from biolog b
+                                    where exists (select 1 from biolog_avg a
+                                        where a.plate_id = b.plate_id)
                                     order by b.plate_id;''')
             else:
                 cursor=conn.execute('''select distinct category
                                     from biolog order by plate_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getAll(self):
         with self.connection as conn:
@@ -3590,7 +4104,7 @@ class Biolog(DBBase):
                                 order by plate_id, well_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getPlateCategs(self):
         with self.connection as conn:
@@ -3598,7 +4112,7 @@ class Biolog(DBBase):
                                 from biolog order by plate_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getCategByPlate(self, plate_id):
         with self.connection as conn:
@@ -3618,7 +4132,7 @@ class Biolog(DBBase):
                                 [category,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getByCo(self, co_id):
         with self.connection as conn:
@@ -3627,7 +4141,7 @@ class Biolog(DBBase):
                                 [co_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
         
     def getCos(self):
         with self.connection as conn:
@@ -3636,7 +4150,7 @@ class Biolog(DBBase):
                                 order by co_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getCosByPlate(self, plate_id):
         with self.connection as conn:
@@ -3647,7 +4161,7 @@ class Biolog(DBBase):
                                 [plate_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getCosByCateg(self, category):
         with self.connection as conn:
@@ -3658,7 +4172,7 @@ class Biolog(DBBase):
                                 [category,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getAllCo(self):
         with self.connection as conn:
@@ -3667,7 +4181,7 @@ class Biolog(DBBase):
                                 order by plate_id, well_id;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getAllCoByCateg(self, category):
         with self.connection as conn:
@@ -3678,7 +4192,45 @@ class Biolog(DBBase):
                                 [category,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
+    
+    def _checkWells(self, explist):
+        '''
+        Checks plates, wells and organisms of a series of Well objects
+        (the known IDs are loaded just once)
+        '''
+        plates = self.getKeys('biolog', 'plate_id')
+        wells = self.getKeys('biolog', 'well_id')
+        orgs = self.getKeys('organism', 'org_id')
+        
+        for w in explist:
+            if w.plate_id not in plates:
+                logger.warning('Plate %s is not known!'%w.plate_id)
+                raise Exception('This plate (%s) is not known!'%w.plate_id)
+            if w.well_id not in wells:
+                logger.warning('Well %s is not known!'%w.well_id)
+                raise Exception('This well (%s) is not known!'%w.well_id)
+            if w.strain not in orgs:
+                logger.warning('Organism %s is not present yet!'%w.strain)
+                raise Exception('This organism (%s) is not present yet!'%w.strain)
+    
+    def _appendReplicas(self, explist):
+        '''
+        Renumbers the replicas of a series of Well objects,
+        so that they are appended to those already present
+        (same as adding howManyReplicasByWell to each replica)
+        '''
+        with self.connection as conn:
+            cursor = conn.execute('''select plate_id, well_id, org_id,
+                                          count(distinct replica)
+                                   from biolog_exp
+                                   group by plate_id, well_id, org_id;''')
+            replicas = dict([((x[0], x[1], x[2]), int(x[3]))
+                             for x in cursor])
+        
+        for w in explist:
+            key = (w.plate_id, w.well_id, w.strain)
+            w.replica = int(w.replica) + replicas.get(key, 0)
     
     def addWells(self, explist, clustered=True, replace=False, imported=False):
         '''
@@ -3688,98 +4240,74 @@ class Biolog(DBBase):
         If replace = True, we are merely updating a well
         Checks are performed
         '''
-        
         query = '''insert or replace into biolog_exp 
                             (plate_id, well_id, org_id, replica, activity, 
                             zero, min, max, height, plateau, slope, lag,
                             area, v, y0, model, source)
-                            values '''
+                            values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
         query1a = '''insert or replace into biolog_exp 
                             (plate_id, well_id, org_id, replica, 
                             zero)
-                            values '''
+                            values (?,?,?,?,?);'''
         
         query1 = '''insert or replace into biolog_exp_det
                         (plate_id, well_id, org_id, replica, times, signals)
-                        values '''
+                        values (?,?,?,?,?,?);'''
         
-        oCheck = Organism(self.dbname)
+        self._checkWells(explist)
         for w in explist:
-            if not self.isPlate(w.plate_id):
-                logger.warning('Plate %s is not known!'%w.plate_id)
-                raise Exception('This plate (%s) is not known!'%w.plate_id)
-            if not self.isWell(w.well_id):
-                logger.warning('Well %s is not known!'%w.well_id)
-                raise Exception('This well (%s) is not known!'%w.well_id)
-            if not oCheck.isOrg(w.strain):
-                logger.warning('Organism %s is not present yet!'%w.strain)
-                raise Exception('This organism (%s) is not present yet!'%w.strain)
             if w.activity is None and clustered and not imported:
                 logger.warning('Parameters extraction not yet performed!')
                 raise Exception('Parameters extraction not yet performed!')
         
         if not clustered and not replace:
             # Correct the replica
-            for w in explist:
-                rep = self.howManyReplicasByWell(w.plate_id, w.well_id,
-                                                 w.strain)
-                w.replica = int(w.replica) + rep
-        
-        self.boost()
-        
-        with self.connection as conn:
-            if clustered:
-                blist = []
-                for w in explist:
-                    bstr = ('''('%s','%s','%s',%s,'''
-                            %(w.plate_id,w.well_id,w.strain,w.replica))
-                    for param in [w.activity,int(w.zero),w.min,w.max,
-                                  w.height,w.plateau,w.slope,w.lag,
-                                  w.area,w.v,w.y0]:
-                        if param is None or str(param) == 'nan':
-                            bstr += ' null,'
-                        else:
-                            bstr += ' %s,'%param
-                    if w.model is None:
-                        bstr += ' null,'
-                    else:
-                        bstr += ''' '%s','''%w.model
-                    if w.source is None:
-                        bstr += ' null)'
-                    else:
-                        bstr += ''' '%s')'''%w.source
-                    blist.append(bstr)
-            else:
-                blist = ['''('%s','%s','%s','%s','%s')'''
-                         %(w.plate_id,w.well_id,w.strain,w.replica,int(w.zero))
-                         for w in explist]
-            
-            blist1 = []
-            for w in explist:
-                blist1 = blist1 + ['''('%s', '%s', '%s', '%s', '%s', '%s')'''
-                  %(w.plate_id,w.well_id,w.strain,w.replica,
-                   '_'.join([str(x) for x in sorted(w.signals.keys())]),
-                   '_'.join([str(w.signals[h]) for h in sorted(w.signals.keys())]))]                
-            
-            if clustered:
-                for bs in get_span(blist, span=1):
-                    insert = query + ', '.join(bs)+';'
-                    conn.execute(insert)
-            else:
-                for bs in get_span(blist, span=1):
-                    insert = query1a + ', '.join(bs)+';'
-                    conn.execute(insert)
-                
-                for bs in get_span(blist1, span=1):
-                    insert = query1 + ', '.join(bs)+';'
-                    conn.execute(insert)
-            
-            conn.execute('''update biolog_exp
-                            set model = null where model = '';''')
-            conn.execute('''update biolog_exp
-                            set source = null where source = '';''')
-            conn.commit()
-            
+            self._appendReplicas(explist)
+        
+        keys = [(w.plate_id, w.well_id, w.strain) for w in explist]
+        refresh = lambda conn: self._refreshAvgActivity(conn, keys)
+        
+        if clustered:
+            self.executeBatch([(query, [getWellParams(w) for w in explist])],
+                              post=refresh)
+        else:
+            self.executeBatch([(query1a, [(w.plate_id, w.well_id, w.strain,
+                                           w.replica, int(w.zero))
+                                          for w in explist]),
+                               (query1, [getWellSignals(w)
+                                         for w in explist])],
+                              post=refresh)
+    
+    def importWells(self, explist):
+        '''
+        Input: a series of Well objects (i.e. parsed from phenomic files)
+        Bulk version of addWells, to be used when importing new data:
+        plates, wells and organisms are checked against the DB just once,
+        replicas are appended to those already present and everything
+        is written at once
+        The parameters are stored too, if present
+        '''
+        query = '''insert or replace into biolog_exp 
+                            (plate_id, well_id, org_id, replica, activity, 
+                            zero, min, max, height, plateau, slope, lag,
+                            area, v, y0, model, source)
+                            values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);'''
+        
+        query1 = '''insert or replace into biolog_exp_det
+                        (plate_id, well_id, org_id, replica, times, signals)
+                        values (?,?,?,?,?,?);'''
+        
+        self._checkWells(explist)
+        
+        # Correct the replicas
+        self._appendReplicas(explist)
+        
+        keys = [(w.plate_id, w.well_id, w.strain) for w in explist]
+        self.executeBatch([(query, [getWellParams(w) for w in explist]),
+                           (query1, [getWellSignals(w) for w in explist])],
+                          post=lambda conn: self._refreshAvgActivity(conn,
+                                                                     keys))
+    
     def updateSignals(self, explist):
         '''
         Replaces the signals in the db with the ones provided
@@ -3791,14 +4319,12 @@ class Biolog(DBBase):
                    and org_id = ?
                    and replica = ?'''
         
-        self.boost()
+        rows = []
+        for w in explist:
+            row = getWellSignals(w)
+            rows.append(row[4:] + row[:4])
         
-        with self.connection as conn:
-            for w in explist:
-                conn.execute(query, 
-                             ['_'.join([str(x) for x in sorted(w.signals.keys())]),
-                              '_'.join([str(w.signals[h]) for h in sorted(w.signals.keys())]),
-                              w.plate_id, w.well_id, w.strain, w.replica])
+        self.executeBatch([(query, rows)])
     
     def delWellsParams(self, wells):
         '''
@@ -3837,12 +4363,13 @@ class Biolog(DBBase):
                 logger.warning('Organism %s is not present yet!'%w.strain)
                 raise Exception('This organism (%s) is not present yet!'%w.strain)
         
-        self.boost()
-        
         with self.connection as conn:
             for w in wells:
                 conn.execute(query,
                               [w.plate_id,w.well_id,w.strain,w.replica,])
+            
+            self._refreshAvgActivity(conn, [(w.plate_id, w.well_id, w.strain)
+                                            for w in wells])
     
     def delWells(self, explist):
         '''
@@ -3859,6 +4386,9 @@ class Biolog(DBBase):
                             where plate_id=? and well_id=? and org_id=?
                             and replica=?;''',
                             [w.plate_id,w.well_id,w.strain,w.replica,])
+            
+            self._refreshAvgActivity(conn, [(w.plate_id, w.well_id, w.strain)
+                                            for w in explist])
             conn.commit()
                 
     def delOrg(self, org_id):
@@ -3874,6 +4404,14 @@ class Biolog(DBBase):
                         where org_id=?;''',
                         [org_id,])
             
+            conn.execute('''delete from biolog_avg 
+                        where org_id=?;''',
+                        [org_id,])
+            
+            conn.execute('''delete from biolog_co_avg 
+                        where org_id=?;''',
+                        [org_id,])
+            
             conn.execute('''delete from biolog_purged_exp 
                         where org_id=?;''',
                         [org_id,])
@@ -3905,8 +4443,7 @@ class Biolog(DBBase):
                                    order by activity;''',[plate_id,])
         
         act = {}
-        for res in cursor:
-            a = Row(res, cursor.description)
+        for a in cursor:
             act[a.activity] = a.howmany
             
         return act
@@ -3925,8 +4462,7 @@ class Biolog(DBBase):
                                    [org_id,])
         
         act = {}
-        for res in cursor:
-            a = Row(res, cursor.description)
+        for a in cursor:
             act[a.activity] = a.howmany
             
         return act
@@ -3970,8 +4506,7 @@ class Biolog(DBBase):
                                        order by activity;''')
         
         act = {}
-        for res in cursor:
-            a = Row(res, cursor.description)
+        for a in cursor:
             act[a.activity] = a.howmany
             
         return act
@@ -4019,8 +4554,7 @@ class Biolog(DBBase):
                                        [org_id,])
         
         act = {}
-        for res in cursor:
-            a = Row(res, cursor.description)
+        for a in cursor:
             act[a.activity] = a.howmany
             
         return act
@@ -4041,8 +4575,7 @@ class Biolog(DBBase):
                                    [categ,])
         
         act = {}
-        for res in cursor:
-            a = Row(res, cursor.description)
+        for a in cursor:
             act[a.activity] = a.howmany
             
         return act
@@ -4064,8 +4597,7 @@ class Biolog(DBBase):
                                    [categ,org_id,])
         
         act = {}
-        for res in cursor:
-            a = Row(res, cursor.description)
+        for a in cursor:
             act[a.activity] = a.howmany
             
         return act
@@ -4085,11 +4617,11 @@ class Biolog(DBBase):
         Get the average activity for a particular experiment
         '''
         with self.connection as conn:
-            cursor=conn.execute('''select avg(activity) from biolog_exp  
-                                   where org_id=?
-                                   and plate_id=?
-                                   and well_id=?;''',
-                                  [org_id,plate_id, well_id,])
+            cursor=conn.execute('''select avgact from biolog_avg
+                                   where plate_id=?
+                                   and well_id=?
+                                   and org_id=?;''',
+                                  [plate_id, well_id, org_id,])
         
         try:
             return float(cursor.fetchall()[0][0])      
@@ -4102,15 +4634,159 @@ class Biolog(DBBase):
         Returns one record for each organism
         '''
         with self.connection as conn:
-            cursor=conn.execute('''select org_id, avg(activity) avgact
-                                   from biolog_exp  
+            cursor=conn.execute('''select org_id, avgact
+                                   from biolog_avg
                                    where plate_id=?
                                    and well_id=?
-                                   group by org_id;''',
+                                   order by org_id;''',
                                   [plate_id, well_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
+    
+    def _filterBy(self, column, values):
+        '''
+        SQL condition (and its arguments) restricting column to values
+        (None: no restriction)
+        '''
+        if values is None:
+            return '', []
+        values = sorted(set(values))
+        return ('and %s in (%s)'%(column, ','.join(['?']*len(values))),
+                values)
+    
+    def getWellActivityMatrix(self, category=None, co_ids=None, orgs=None):
+        '''
+        Organisms x wells ((plate_id, well_id) tuples) matrix of the mean
+        activity (see ActivityMatrix), with a single query
+        Only the wells of a category, of some compounds and/or of some
+        organisms can be requested
+        '''
+        cos, coargs = self._filterBy('b.co_id', co_ids)
+        orgs, orgargs = self._filterBy('a.org_id', orgs)
+        if category is None:
+            categ, categargs = '', []
+        else:
+            categ, categargs = 'and b.category = ?', [category]
+        
+        with self.connection as conn:
+            cursor=conn.execute('''select a.org_id, a.plate_id, a.well_id,
+                                          a.avgact, a.replicas
+                                   from biolog b, biolog_avg a
+                                   where b.plate_id = a.plate_id
+                                   and b.well_id = a.well_id
+                                   %s %s %s;'''%(categ, cos, orgs),
+                                   categargs + coargs + orgargs)
+            
+        return ActivityMatrix.fromRows([(x[0], (x[1], x[2]), x[3], x[4])
+                                        for x in cursor])
+    
+    def getCoActivityMatrix(self, category=None, co_ids=None, orgs=None):
+        '''
+        Organisms x compounds matrix of the mean activity (the mean of the
+        mean activity of each well, see ActivityMatrix), with a single query
+        Only the compounds of a category, some compounds and/or some
+        organisms can be requested
+        '''
+        cos, coargs = self._filterBy('co_id', co_ids)
+        orgs, orgargs = self._filterBy('org_id', orgs)
+        
+        with self.connection as conn:
+            if category is None:
+                cursor=conn.execute('''select org_id, co_id,
+                                           sum(avgact * wells) / sum(wells),
+                                           sum(wells)
+                                       from biolog_co_avg
+                                       where 1 %s %s
+                                       group by org_id, co_id;'''%(cos, orgs),
+                                       coargs + orgargs)
+            else:
+                cursor=conn.execute('''select org_id, co_id, avgact, wells
+                                       from biolog_co_avg
+                                       where category = ?
+                                       %s %s;'''%(cos, orgs),
+                                       [category] + coargs + orgargs)
+            
+        return ActivityMatrix.fromRows(cursor)
+    
+    def refreshAvgActivity(self, keys=None):
+        '''
+        Compute again the mean activity tables (biolog_avg, biolog_co_avg)
+        for the (plate_id, well_id, org_id) keys that have changed
+        (None: all of them)
+        '''
+        with self.connection as conn:
+            self._refreshAvgActivity(conn, keys)
+    
+    def _refreshAvgActivity(self, conn, keys=None):
+        '''
+        Compute again the mean activity tables, using an open transaction
+        (see refreshAvgActivity)
+        '''
+        start = time.time()
+        
+        if keys is not None:
+            keys = set(keys)
+            # Many changes: faster to start from scratch
+            if len(keys) > 10000:
+                keys = None
+        
+        if keys is None:
+            conn.execute('delete from biolog_avg;')
+            conn.execute('''insert into biolog_avg
+                            select plate_id, well_id, org_id,
+                                   avg(activity), count(*)
+                            from biolog_exp
+                            group by plate_id, well_id, org_id;''')
+            conn.execute('delete from biolog_co_avg;')
+            conn.execute('''insert into biolog_co_avg
+                            select b.co_id, b.category, a.org_id,
+                                   avg(a.avgact), count(*)
+                            from biolog b, biolog_avg a
+                            where b.plate_id = a.plate_id
+                            and b.well_id = a.well_id
+                            and b.co_id is not null
+                            and a.avgact is not null
+                            group by b.co_id, b.category, a.org_id;''')
+        else:
+            conn.executemany('''delete from biolog_avg
+                                where plate_id = ?
+                                and well_id = ?
+                                and org_id = ?;''', keys)
+            conn.executemany('''insert into biolog_avg
+                                select plate_id, well_id, org_id,
+                                       avg(activity), count(*)
+                                from biolog_exp
+                                where plate_id = ?
+                                and well_id = ?
+                                and org_id = ?
+                                group by plate_id, well_id, org_id;''',
+                             keys)
+            
+            cursor = conn.execute('''select plate_id, well_id, co_id
+                                    from biolog
+                                    where co_id is not null;''')
+            wells = dict([((x[0], x[1]), x[2]) for x in cursor])
+            cos = set([(wells[(p, w)], o) for p, w, o in keys
+                       if (p, w) in wells])
+            conn.executemany('''delete from biolog_co_avg
+                                where co_id = ?
+                                and org_id = ?;''', cos)
+            conn.executemany('''insert into biolog_co_avg
+                                select b.co_id, b.category, a.org_id,
+                                       avg(a.avgact), count(*)
+                                from biolog b, biolog_avg a
+                                where b.co_id = ?
+                                and a.org_id = ?
+                                and b.plate_id = a.plate_id
+                                and b.well_id = a.well_id
+                                and a.avgact is not null
+                                group by b.co_id, b.category, a.org_id;''',
+                             cos)
+        
+        logger.debug('Mean activities computed again (%s, %.2fs)'%
+                     ('all' if keys is None else '%d wells'%len(keys),
+                      time.time() - start))
     
     def getReplicas(self, plate_id, well_id, org_id):
         with self.connection as conn:
@@ -4120,7 +4796,7 @@ class Biolog(DBBase):
                         [plate_id,well_id,org_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getActiveByPlate(self, plate_id, activity):
         '''
@@ -4133,7 +4809,7 @@ class Biolog(DBBase):
                         [plate_id,activity,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getAllActive(self, activity):
         '''
@@ -4145,7 +4821,7 @@ class Biolog(DBBase):
                         [activity,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def howManyActive(self,activity):
         '''
@@ -4265,7 +4941,7 @@ class Biolog(DBBase):
                                    order by plate_id, well_id, org_id, replica;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getDistinctWells(self, replica=False):
         '''
@@ -4282,7 +4958,7 @@ class Biolog(DBBase):
                                         order by plate_id, well_id;''')                
         
         for res in cursor:
-            yield Row(res, cursor.description)        
+            yield res        
     
     def getOrgDistinctWells(self, org_id):
         '''
@@ -4295,7 +4971,7 @@ class Biolog(DBBase):
                                    order by plate_id, well_id;''',[org_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)        
+            yield res        
     
     def getOrgWells(self, org_id):
         '''
@@ -4309,7 +4985,7 @@ class Biolog(DBBase):
                                    replica;''',[org_id,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def maxSignal(self):
         '''
@@ -4345,7 +5021,7 @@ class Biolog(DBBase):
                                         [activity, izero, howmany,])
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getAllActivity(self):
         '''
@@ -4357,7 +5033,7 @@ class Biolog(DBBase):
                                    from biolog_exp b;''')
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getAllSignals(self):
         '''
@@ -4376,8 +5052,10 @@ class Biolog(DBBase):
                                    and b.org_id=b1.org_id
                                    and b.replica=b1.replica;''')
         
-        for res in cursor:
-            yield Row(res, cursor.description)
+        for r in cursor:
+            r.times = unpackSignals(r.times)
+            r.signals = unpackSignals(r.signals)
+            yield r
     
     def getAllSignalsNoParams(self):
         '''
@@ -4399,8 +5077,10 @@ class Biolog(DBBase):
                                        and v=null and y0=null
                                        and model=null and source=null);''')
         
-        for res in cursor:
-            yield Row(res, cursor.description)
+        for r in cursor:
+            r.times = unpackSignals(r.times)
+            r.signals = unpackSignals(r.signals)
+            yield r
       
     def getParamsSources(self):
         '''
@@ -4414,7 +5094,7 @@ class Biolog(DBBase):
             cursor=conn.execute(query)
         
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def getZeroSubtractablePlates(self):
         '''
@@ -4429,7 +5109,7 @@ class Biolog(DBBase):
             cursor=conn.execute(query)
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
             
     def getControlWells(self):
         '''
@@ -4447,8 +5127,7 @@ class Biolog(DBBase):
         with self.connection as conn:
             cursor=conn.execute(query)
             
-        for res in cursor:
-            r = Row(res, cursor.description)
+        for r in cursor:
             yield r.plate_id, r.well_id
             
     def getControlPairs(self):
@@ -4467,8 +5146,7 @@ class Biolog(DBBase):
         with self.connection as conn:
             cursor=conn.execute(query)
             
-        for res in cursor:
-            r = Row(res, cursor.description)
+        for r in cursor:
             yield r.plate_id, r.well_id, r.zero_well_id
     
     def getZeroSubtractableSignals(self):
@@ -4476,18 +5154,18 @@ class Biolog(DBBase):
         Get all the signals that can be zero-subtracted
         '''
         with self.connection as conn:
-            cursor=conn.execute('''select * from biolog_exp where zero = 0;''')
+            cursor=conn.execute('''select b1.*
+                                   from biolog_exp_det b1, biolog_exp b
+                                   where b.plate_id=b1.plate_id
+                                   and b.well_id=b1.well_id
+                                   and b.org_id=b1.org_id
+                                   and b.replica=b1.replica
+                                   and b.zero = 0;''')
         
-        notYet = [Row(res, cursor.description) for res in cursor]
-        for well in notYet:
-            with self.connection as conn:
-                cursor=conn.execute('''select * from biolog_exp_det
-                                    where plate_id=? and well_id=? and org_id=?
-                                    and replica=?;''',
-                                    [well.plate_id,well.well_id,
-                                     well.org_id,well.replica,])
-            for res in cursor:
-                yield Row(res, cursor.description)
+        for r in cursor:
+            r.times = unpackSignals(r.times)
+            r.signals = unpackSignals(r.signals)
+            yield r
                 
     def atLeastOneZeroSubtracted(self):
         '''
@@ -4537,7 +5215,7 @@ class Biolog(DBBase):
                                                  from compound);''')
             
         for res in cursor:
-            yield Row(res, cursor.description)
+            yield res
     
     def atLeastOnePurged(self):
         '''
@@ -4562,8 +5240,6 @@ class Biolog(DBBase):
         Get a list of biolog_ids and move them to the
         "purged wells" zone
         '''
-        self.boost()
-        
         with self.connection as conn:
             for w in wells:
                 cursor = conn.execute('''select * from biolog_exp_det
@@ -4598,6 +5274,9 @@ class Biolog(DBBase):
                                 and well_id = ?
                                 and org_id = ?
                                 and replica = ?;''',[p,w,o,r,])
+            
+            self._refreshAvgActivity(conn, [(w[0], w[1], w[2])
+                                            for w in wells])
         
     def restoreDiscardedWells(self, plates=[], replica=None):
         '''
@@ -4605,9 +5284,8 @@ class Biolog(DBBase):
         '''
         import copy
         
-        self.boost()
-        
         restored = 0
+        keys = set()
         
         with self.connection as conn:
             if replica is None:
@@ -4627,6 +5305,7 @@ class Biolog(DBBase):
                         continue
                     
                 restored += 1
+                keys.add((well.plate_id, well.well_id, well.org_id))
                 
                 conn.execute('''insert into biolog_exp_det
                         values (?,?,?,?,?,?);''',[well.plate_id, well.well_id,
@@ -4659,4 +5338,7 @@ class Biolog(DBBase):
                                 and org_id = ?
                                 and replica = ?;''',[well.plate_id, well.well_id,
                                                   well.org_id, well.replica,])
+            
+            self._refreshAvgActivity(conn, keys)
+        
         return restored
@@ -1,4 +1,23 @@
 dbboost='''PRAGMA cache_size = 20000;'''
+# Storage profiles (chosen with the DUCTAPE_DB_PROFILE environment variable)
+# default: rollback journal, each write in a single transaction
+# concurrent: WAL journal (kept by the project once set), so that read-only
+#             commands can run during long jobs; writes are split in short
+#             transactions of "batch" rows
+dbprofiles={'default':{'pragmas':[dbboost],
+                       'timeout':5,
+                       'batch':None},
+            'concurrent':{'pragmas':['PRAGMA journal_mode = WAL;',
+                                     'PRAGMA synchronous = NORMAL;',
+                                     'PRAGMA busy_timeout = 60000;',
+                                     'PRAGMA mmap_size = 268435456;',
+                                     'PRAGMA cache_size = -65536;',
+                                     'PRAGMA temp_store = MEMORY;'],
+                          'timeout':60,
+                          'batch':5000}}
+# Version of the storage schema (stored in the project table)
+# Each bump needs an upgrade step (see database.DBBase.upgrade)
+dbschema=6
 dbcreate='''
 CREATE TABLE project (
     "name" TEXT NOT NULL,
@@ -10,7 +29,9 @@ CREATE TABLE project (
     "genome" TEXT,
     "phenome" TEXT,
     "pangenome" INTEGER   DEFAULT (0),
-    "kegg" REAL
+    "kegg" REAL,
+    "schema" INTEGER   DEFAULT (0),
+    "edges" INTEGER   DEFAULT (0)
 );
 CREATE TABLE organism (
     "org_id" TEXT NOT NULL,
@@ -128,8 +149,8 @@ CREATE TABLE biolog_exp_det (
     "well_id" TEXT NOT NULL,
     "org_id" TEXT NOT NULL,
     "replica" INTEGER NOT NULL,
-    "times" TEXT,
-    "signals" TEXT
+    "times" BLOB,
+    "signals" BLOB
 );
 CREATE TABLE biolog_purged_exp (
     "plate_id" TEXT NOT NULL,
@@ -155,8 +176,8 @@ CREATE TABLE biolog_purged_exp_det (
     "well_id" TEXT NOT NULL,
     "org_id" TEXT NOT NULL,
     "replica" INTEGER NOT NULL,
-    "times" TEXT,
-    "signals" TEXT
+    "times" BLOB,
+    "signals" BLOB
 );
 CREATE UNIQUE INDEX project_id ON project(name ASC);
 CREATE UNIQUE INDEX "organism_id" on organism (org_id ASC);
@@ -180,3 +201,71 @@ CREATE UNIQUE INDEX "biologexpdet_id" on biolog_exp_det (plate_id ASC, well_id A
 CREATE UNIQUE INDEX "biologpurgedexp_id" on biolog_purged_exp (plate_id ASC, well_id ASC, org_id ASC, replica ASC);
 CREATE UNIQUE INDEX "biologpurgedexpdet_id" on biolog_purged_exp_det (plate_id ASC, well_id ASC, org_id ASC, replica ASC);
 '''
+# Secondary (covering) indexes, for the lookups and joins not starting
+# with the unique keys (added in schema version 2)
+dbindexes='''
+CREATE INDEX IF NOT EXISTS "protein_org" on protein (org_id ASC, prot_id ASC);
+CREATE INDEX IF NOT EXISTS "mapko_ko" on mapko (ko_id ASC, prot_id ASC);
+CREATE INDEX IF NOT EXISTS "ortholog_prot" on ortholog (prot_id ASC, group_id ASC);
+CREATE INDEX IF NOT EXISTS "koreact_re" on ko_react (re_id ASC, ko_id ASC);
+CREATE INDEX IF NOT EXISTS "reactcomp_co" on react_comp (co_id ASC, re_id ASC);
+CREATE INDEX IF NOT EXISTS "reactpath_path" on react_path (path_id ASC, re_id ASC);
+CREATE INDEX IF NOT EXISTS "comppath_path" on comp_path (path_id ASC, co_id ASC);
+CREATE INDEX IF NOT EXISTS "rpairreact_re" on rpair_react (re_id ASC, rp_id ASC);
+CREATE INDEX IF NOT EXISTS "biolog_co" on biolog (co_id ASC, plate_id ASC, well_id ASC);
+CREATE INDEX IF NOT EXISTS "biologexp_org" on biolog_exp (org_id ASC, plate_id ASC, well_id ASC, activity);
+'''
+dbcreate += dbindexes
+# Classification of the orthologous groups (number of organisms and
+# core/accessory/unique), filled when the pangenome is added
+# (added in schema version 3)
+dbpanclass='''
+CREATE TABLE IF NOT EXISTS "pangenome_class" (
+    "group_id" TEXT NOT NULL,
+    "n_orgs" INTEGER NOT NULL,
+    "class" TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "pangenomeclass_id" on pangenome_class (group_id ASC);
+CREATE INDEX IF NOT EXISTS "pangenomeclass_orgs" on pangenome_class (n_orgs ASC, group_id ASC);
+'''
+dbcreate += dbpanclass
+# Reactions with a "main" RPair (the edges of the metabolic networks),
+# filled when the KEGG data is imported (added in schema version 4)
+dbmainedge='''
+CREATE TABLE IF NOT EXISTS "main_edge" (
+    "re_id" TEXT NOT NULL,
+    "co1" TEXT,
+    "co2" TEXT,
+    "name" TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "mainedge_id" on main_edge (re_id ASC, co1 ASC, co2 ASC, name ASC);
+CREATE INDEX IF NOT EXISTS "mainedge_co1" on main_edge (co1 ASC);
+CREATE INDEX IF NOT EXISTS "mainedge_co2" on main_edge (co2 ASC);
+'''
+dbcreate += dbmainedge
+# Mean activity of each well (over the replicas) and of each compound
+# (over its wells), for each organism; kept up to date by the methods
+# changing the biolog_exp table, and the wells of each category
+# (added in schema version 5)
+dbbiologavg='''
+CREATE TABLE IF NOT EXISTS "biolog_avg" (
+    "plate_id" TEXT NOT NULL,
+    "well_id" TEXT NOT NULL,
+    "org_id" TEXT NOT NULL,
+    "avgact" REAL,
+    "replicas" INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "biolog_co_avg" (
+    "co_id" TEXT NOT NULL,
+    "category" TEXT,
+    "org_id" TEXT NOT NULL,
+    "avgact" REAL NOT NULL,
+    "wells" INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "biologavg_id" on biolog_avg (plate_id ASC, well_id ASC, org_id ASC);
+CREATE INDEX IF NOT EXISTS "biologavg_org" on biolog_avg (org_id ASC, plate_id ASC, well_id ASC, avgact);
+CREATE UNIQUE INDEX IF NOT EXISTS "biologcoavg_id" on biolog_co_avg (co_id ASC, category ASC, org_id ASC);
+CREATE INDEX IF NOT EXISTS "biologcoavg_org" on biolog_co_avg (org_id ASC, category ASC, co_id ASC);
+CREATE INDEX IF NOT EXISTS "biolog_categ" on biolog (category ASC, plate_id ASC, well_id ASC, co_id);
+'''
+dbcreate += dbbiologavg
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Benchmark of the CommonMultiProcess per-task overhead
+
+"spawn": workers spawned and killed for each batch of tasks (old serialBBH)
+"pool": persistent pool fed through submit()/wait()
+
+Usage: benchmark_pool.py [ncpus] [batches] [tasks per batch]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.common.commonmultiprocess import CommonMultiProcess, Consumer
+import time
+
+__author__ = "Marco Galardini"
+
+class Dummy(object):
+    '''
+    A task doing nothing (pure overhead)
+    '''
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self):
+        return (self.value, 'dummy', True)
+
+class OldConsumer(Consumer):
+    '''
+    Consumer with the per-task sleep that was used before
+    '''
+    def run(self):
+        while True:
+            next_task = self.task_queue.get()
+            self.sleeper.sleep(0.01)
+            if next_task is None:
+                break
+            answer = next_task()
+            self.result_queue.put(answer)
+        return
+
+class Spawn(CommonMultiProcess):
+    def initiateParallel(self):
+        self._parallel = [OldConsumer(self._paralleltasks,
+                                      self._parallelresults)
+                          for x in range(self.ncpus)]
+        for consumer in self._parallel:
+            consumer.start()
+
+    def batch(self, tasks):
+        results = []
+        self.initiateParallel()
+        for obj in tasks:
+            self._paralleltasks.put(obj)
+        self.addPoison()
+        while True:
+            while not self._parallelresults.empty():
+                results.append(self._parallelresults.get())
+            if self.isTerminated():
+                break
+            self.sleeper.sleep(0.01)
+        while not self._parallelresults.empty():
+            results.append(self._parallelresults.get())
+        self.killParallel()
+        return results
+
+class Pool(CommonMultiProcess):
+    def batch(self, tasks):
+        futures = [self.submit(obj) for obj in tasks]
+        self.wait(futures)
+        return [f.result() for f in futures]
+
+def bench(obj, batches, size):
+    start = time.time()
+    for i in range(batches):
+        res = obj.batch([Dummy(j) for j in range(size)])
+        assert len(res) == size
+    if hasattr(obj, 'stopPool'):
+        obj.stopPool()
+    return time.time() - start
+
+if __name__ == '__main__':
+    ncpus = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    batches = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    ntasks = batches * size
+    print('%d batches of %d tasks, %d workers'%(batches, size, ncpus))
+    for name, obj in (('spawn', Spawn(ncpus)), ('pool', Pool(ncpus))):
+        elapsed = bench(obj, batches, size)
+        print('%s\t%.3fs\t%.3fms per task'%(name, elapsed,
+                                              elapsed / ntasks * 1000))
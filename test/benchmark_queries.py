@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Query planner benchmark of the SQLite storage
+
+A synthetic (large) project is created, then each read method of the
+database classes is called: the SQL statements it issues are timed and
+checked with "EXPLAIN QUERY PLAN", reporting the full table scans
+
+A baseline can be saved (-s) and later used to catch the methods
+that started to scan whole tables (-c, exit code 1)
+
+Usage: benchmark_queries.py [-o orgs] [-p proteins] [-s|-c baseline.json]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.storage.SQLite.database import DBBase, Project, Organism, Genome
+from ductape.storage.SQLite.database import Kegg, Biolog, packSignals
+import argparse
+import inspect
+import json
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import types
+
+__author__ = "Marco Galardini"
+
+# Methods with side effects or not issuing queries
+skip = set(['getCursor', 'getKeys', 'getRecords', 'getRandomWells'])
+# Methods needing specific arguments
+override = {'getMutReference': {'org_id': 'M000'}}
+
+def getOptions():
+    parser = argparse.ArgumentParser(description='SQLite query benchmark')
+    parser.add_argument('-o', metavar='orgs', type=int, default=10,
+                        dest='orgs', help='Number of organisms [Default: 10]')
+    parser.add_argument('-p', metavar='proteins', type=int, default=2000,
+                        dest='prots',
+                        help='Proteins per organism [Default: 2000]')
+    parser.add_argument('-d', metavar='db', default=None, dest='db',
+                        help='Keep the synthetic project in this file')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-s', metavar='baseline', default=None, dest='save',
+                       help='Save the full table scans as baseline')
+    group.add_argument('-c', metavar='baseline', default=None, dest='check',
+                       help='Check the full table scans against a baseline')
+    return parser.parse_args()
+
+def populate(dbname, norgs, nprots, seed=42):
+    '''
+    Fill a new project with random (but consistent) data
+    Returns the IDs to be used as methods arguments
+    '''
+    rand = random.Random(seed)
+
+    DBBase(dbname).create()
+    Project(dbname).addProject(name='benchmark')
+
+    orgs = ['O%03d'%i for i in range(norgs)]
+    oOrg = Organism(dbname)
+    for org_id in orgs:
+        oOrg.addOrg(org_id, name=org_id)
+    oOrg.addOrg('M000', name='M000', mutant=True, reference=orgs[0],
+                mkind='deletion')
+
+    nko = max(100, nprots * 2)
+    kos = ['ko:K%05d'%i for i in range(nko)]
+    reacts = ['rn:R%05d'%i for i in range(int(nko * 1.2))]
+    comps = ['cpd:C%05d'%i for i in range(nko)]
+    paths = ['path:map%05d'%i for i in range(300)]
+    rpairs = ['rp:RP%05d'%i for i in range(len(reacts))]
+
+    db = DBBase(dbname)
+    db.bulkWrite('protein', [('%s_%05d'%(org_id, i), org_id, '', 'MAAA')
+                             for org_id in orgs for i in range(nprots)])
+    db.bulkWrite('mapko', [('%s_%05d'%(org_id, i), rand.choice(kos), 0)
+                           for org_id in orgs for i in range(nprots)
+                           if rand.random() < 0.6])
+    # Orthologous groups: same protein index, random subset of organisms
+    # (the other proteins are in singleton groups)
+    db.bulkWrite('ortholog', [('g%05d'%i, '%s_%05d'%(org_id, i))
+                              if rand.random() < 0.8 else
+                              ('u%s_%05d'%(org_id, i), '%s_%05d'%(org_id, i))
+                              for i in range(nprots) for org_id in orgs])
+
+    db.bulkWrite('ko', [(ko_id, ko_id, '', 1) for ko_id in kos])
+    db.bulkWrite('reaction', [(re_id, re_id, '', '') for re_id in reacts])
+    db.bulkWrite('compound', [(co_id, co_id, '') for co_id in comps])
+    db.bulkWrite('pathway', [(path_id, path_id, '', '')
+                             for path_id in paths])
+    db.bulkWrite('rpair', [(rp_id, rand.choice(comps), rand.choice(comps),
+                            rand.choice(['main', 'trans', 'leave']))
+                           for rp_id in rpairs])
+    db.bulkWrite('ko_react', [(ko_id, re_id) for ko_id in kos
+                              for re_id in rand.sample(reacts,
+                                                       rand.randint(1, 3))])
+    db.bulkWrite('react_comp', [(re_id, co_id) for re_id in reacts
+                                for co_id in rand.sample(comps,
+                                                        rand.randint(2, 4))])
+    react_path = [(re_id, path_id) for re_id in reacts
+                  for path_id in rand.sample(paths, rand.randint(1, 3))]
+    db.bulkWrite('react_path', react_path)
+    db.bulkWrite('comp_path', [(co_id, path_id)
+                               for co_id, path_id in zip(comps,
+                                    [x[1] for x in react_path])])
+    db.bulkWrite('rpair_react', [(rp_id, re_id)
+                                 for rp_id, re_id in zip(rpairs, reacts)])
+
+    wells = list(db.query('select plate_id, well_id from biolog;'))
+    times = packSignals(range(0, 48, 4))
+    signals = packSignals([10.0] * 12)
+    db.bulkWrite('biolog_exp', [(w.plate_id, w.well_id, org_id, replica,
+                                 rand.randint(0, 9), 1) +
+                                (None,) * 11
+                                for org_id in orgs for w in wells
+                                for replica in (1, 2)])
+    db.bulkWrite('biolog_exp_det', [(w.plate_id, w.well_id, org_id, replica,
+                                     times, signals)
+                                    for org_id in orgs for w in wells
+                                    for replica in (1, 2)])
+    with db.connection as conn:
+        conn.execute('analyze;')
+
+    categ = list(db.query('select category from biolog limit 1;'))[0]
+
+    return {'org_id': orgs[0], 'mut_id': 'M000', 'ref_id': orgs[0],
+            'orgs': set(orgs[:3]), 'muts': set(['M000']),
+            'prot_id': '%s_%05d'%(orgs[0], 0),
+            'prots': ['%s_%05d'%(orgs[0], i) for i in range(100)],
+            'group_id': 'g00000', 'ko_id': kos[0], 're_id': reacts[0],
+            'co_id': comps[0], 'path_id': paths[0], 'rp_id': rpairs[0],
+            'plate_id': wells[0].plate_id, 'well_id': wells[0].well_id,
+            'replica': 1, 'activity': 5, 'categ': categ.category,
+            'category': categ.category, 'howmany': 10, 'zero': True,
+            'nonzero': True, 'active': True, 'merged': False,
+            'pangenome': False, 'onlymain': False}
+
+def getScans(conn, statement):
+    '''
+    Returns the tables fully scanned by this statement
+    '''
+    scans = set()
+    for row in conn.execute('explain query plan ' + statement):
+        m = re.match(r'^SCAN (TABLE )?([^ (]\S*)(?: AS \S+)?$', row[-1])
+        if m is not None:
+            scans.add(m.group(2))
+    return scans
+
+def run(dbname, args):
+    '''
+    Call each read method: returns method --> (time, statements, scans)
+    '''
+    explain = sqlite3.connect(dbname)
+
+    report = {}
+    for cls in (Project, Organism, Genome, Kegg, Biolog):
+        obj = cls(dbname)
+        statements = []
+        obj.connection.set_trace_callback(statements.append)
+
+        for name, func in inspect.getmembers(cls, inspect.isfunction):
+            if not name.startswith(('get', 'is', 'has', 'how', 'are')):
+                continue
+            if name in skip:
+                continue
+            params = list(inspect.signature(func).parameters.values())[1:]
+            if len([p for p in params if p.name not in args
+                    and p.default is inspect.Parameter.empty]) > 0:
+                continue
+            kwargs = dict([(p.name, args[p.name]) for p in params
+                           if p.name in args])
+            kwargs.update(override.get(name, {}))
+
+            del statements[:]
+            start = time.time()
+            try:
+                res = getattr(obj, name)(**kwargs)
+                if isinstance(res, types.GeneratorType):
+                    res = list(res)
+            except Exception as e:
+                print('%s.%s failed (%s)'%(cls.__name__, name, e))
+                continue
+            elapsed = time.time() - start
+
+            queries = [x for x in statements
+                       if x.lstrip().lower().startswith(('select', 'with'))]
+            scans = set()
+            for statement in queries:
+                scans.update(getScans(explain, statement))
+
+            report['%s.%s'%(cls.__name__, name)] = (elapsed, len(queries),
+                                                   sorted(scans))
+
+    return report
+
+if __name__ == '__main__':
+    options = getOptions()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbname = options.db
+        if dbname is None:
+            dbname = os.path.join(tmpdir, 'benchmark.db')
+        elif os.path.exists(dbname):
+            os.remove(dbname)
+
+        start = time.time()
+        args = populate(dbname, options.orgs, options.prots)
+        print('Synthetic project: %d organisms, %d proteins each (%.1fs)'%
+              (options.orgs, options.prots, time.time() - start))
+
+        report = run(dbname, args)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    total = 0
+    for method in sorted(report, key=lambda x: -report[x][0]):
+        elapsed, queries, scans = report[method]
+        total += elapsed
+        print('%-45s %8.3fs %3d queries  %s'%(method, elapsed, queries,
+                                               ' '.join(scans)))
+    print('%d methods, %.2fs'%(len(report), total))
+
+    if options.save:
+        json.dump(dict([(k, v[2]) for k, v in report.items()]),
+                  open(options.save, 'w'), indent=1, sort_keys=True)
+
+    if options.check:
+        baseline = json.load(open(options.check))
+        regressions = 0
+        for method in sorted(report):
+            new = set(report[method][2]) - set(baseline.get(method, []))
+            if len(new) > 0:
+                print('REGRESSION: %s now scans %s'%(method, ' '.join(new)))
+                regressions += 1
+        if regressions > 0:
+            sys.exit(1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Blast DB cache eviction tests
+
+Usage: test_blastcache.py (or python -m unittest test_blastcache)
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.genome.blast import BlastDBCache
+import shutil
+import tempfile
+import unittest
+
+__author__ = "Marco Galardini"
+
+MB = 1024 * 1024
+
+def builder(size):
+    '''
+    Fake makeblastdb, writing a DB of the requested size (bytes)
+    '''
+    def build(out):
+        f = open(out + '.pin', 'wb')
+        f.write(b'\0' * size)
+        f.close()
+        return True
+    return build
+
+class TestEviction(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path, True)
+    
+    def exists(self, db):
+        return os.path.exists(db + '.pin')
+    
+    def test_bigger_than_cache(self):
+        '''A DB over the maximum size is kept'''
+        cache = BlastDBCache(self.path, maxsize=1)
+        db = cache.putDB('big', builder(2 * MB), expected=2 * MB)
+        self.assertTrue(self.exists(db))
+        self.assertEqual(cache.getDB('big'), db)
+    
+    def test_same_run(self):
+        '''DBs used by the current run are never evicted'''
+        cache = BlastDBCache(self.path, maxsize=1)
+        first = cache.putDB('first', builder(MB // 2 + 1))
+        second = cache.putDB('second', builder(MB // 2 + 1))
+        self.assertTrue(self.exists(first))
+        self.assertTrue(self.exists(second))
+    
+    def test_previous_run(self):
+        '''Least recently used DBs from the previous runs are evicted first'''
+        old = BlastDBCache(self.path, maxsize=1)
+        older = old.putDB('older', builder(MB // 3))
+        newer = old.putDB('newer', builder(MB // 3))
+        os.utime(os.path.join(self.path, 'older', 'done'), (1, 1))
+        os.utime(os.path.join(self.path, 'newer', 'done'), (2, 2))
+        
+        cache = BlastDBCache(self.path, maxsize=1)
+        db = cache.putDB('new', builder(MB // 3), expected=MB // 2)
+        self.assertTrue(self.exists(db))
+        self.assertFalse(self.exists(older))
+        self.assertTrue(self.exists(newer))
+    
+    def test_used_from_previous_run(self):
+        '''A cached DB requested by this run is protected as well'''
+        old = BlastDBCache(self.path, maxsize=1)
+        reused = old.putDB('reused', builder(MB // 2))
+        os.utime(os.path.join(self.path, 'reused', 'done'), (1, 1))
+        
+        cache = BlastDBCache(self.path, maxsize=1)
+        self.assertEqual(cache.getDB('reused'), reused)
+        os.utime(os.path.join(self.path, 'reused', 'done'), (1, 1))
+        db = cache.putDB('new', builder(MB // 2 + 1), expected=MB // 2 + 1)
+        self.assertTrue(self.exists(db))
+        self.assertTrue(self.exists(reused))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Batch curve fitting tests: the batch engine should give results close
+to those of the serial one (fitting.fitData)
+
+Usage: test_fitting.py (or python -m unittest test_fitting)
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.phenome.biolog import BiologParser, Experiment
+from ductape.phenome.biolog import calculateWellsParams
+from ductape.phenome.fitting import fitDataBatch
+from ductape.phenome.fitting import getFlex, getFlexes, getPlateau, getPlateaus
+import numpy as np
+import unittest
+
+__author__ = "Marco Galardini"
+
+infile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'input', 'Rm1021.yml')
+
+# Minimum fraction of wells that should agree with the serial fitting
+# (the two engines may choose a different model for the curves
+# MINPACK is not able to fit)
+agreement = 0.9
+
+def getPlates():
+    parser = BiologParser(infile)
+    parser.parse()
+    return parser.plates
+
+def getActivity(plates):
+    '''
+    Clusterize the wells (with a fixed random seed)
+    '''
+    np.random.seed(42)
+    Experiment(plates=plates).clusterize()
+    return np.array([well.activity
+                     for plate in plates for well in plate.getWells()])
+
+class TestBatchFitting(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Same wells, fitted one by one and in batch
+        cls.serial = getPlates()
+        for plate in cls.serial:
+            for well in plate.getWells():
+                well.calculateParams()
+        
+        cls.batch = getPlates()
+        list(calculateWellsParams([well for plate in cls.batch
+                                   for well in plate.getWells()]))
+        
+        cls.pairs = [(swell, bwell)
+                     for splate, bplate in zip(cls.serial, cls.batch)
+                     for swell, bwell in zip(splate.getWells(),
+                                             bplate.getWells())]
+    
+    def test_guesses(self):
+        '''Vectorized initial guesses'''
+        xdata = self.pairs[0][0].getFitData()[0]
+        ydata = np.array([swell.getFitData()[1] for swell, bwell in self.pairs])
+        
+        self.assertTrue((getPlateaus(xdata, ydata) ==
+                         [getPlateau(xdata, y) for y in ydata]).all())
+        self.assertTrue((getFlexes(xdata, ydata) ==
+                         [getFlex(xdata, y) for y in ydata]).all())
+    
+    def test_missing(self):
+        '''Curves with missing values are not fitted'''
+        xdata, ydata = self.pairs[0][0].getFitData()
+        ydata = np.array([ydata, ydata])
+        ydata[1][3] = np.nan
+        
+        params, models = fitDataBatch(xdata, ydata)
+        self.assertNotEqual(models[0], '')
+        self.assertEqual(models[1], '')
+        self.assertTrue(np.isnan(params[1]).all())
+    
+    def test_parameters(self):
+        '''Plateau, slope and lag close to those of fitData'''
+        close = 0
+        for swell, bwell in self.pairs:
+            xdata, ydata = swell.getFitData()
+            # 1% of the signal range (of the time span for the lag)
+            scale = max(ydata.max() - ydata.min(), 1.0)
+            tolerance = np.array([scale, scale, xdata.max()]) * 0.01
+            
+            sparams = np.array([swell.plateau, swell.slope, swell.lag], float)
+            bparams = np.array([bwell.plateau, bwell.slope, bwell.lag], float)
+            if (abs(sparams - bparams) <= tolerance).all():
+                close += 1
+        
+        self.assertTrue(close >= agreement * len(self.pairs),
+                        '%d/%d wells' % (close, len(self.pairs)))
+    
+    def test_activity(self):
+        '''Activity within one level of the one from fitData'''
+        diff = abs(getActivity(self.serial) - getActivity(self.batch))
+        
+        close = (diff <= 1).sum()
+        self.assertTrue(close >= agreement * len(self.pairs),
+                        '%d/%d wells' % (close, len(self.pairs)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+KEGG cache tests
+
+Usage: test_keggcache.py (or python -m unittest test_keggcache)
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.kegg.cache import KeggCache
+import shutil
+import tempfile
+import unittest
+
+__author__ = "Marco Galardini"
+
+# Nothing listens here: the network always fails
+URL = 'http://127.0.0.1:9/rest/get/cpd:C00001'
+
+class TestExpired(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = KeggCache(os.path.join(self.path, 'cache.db'), ttl=1)
+        self.cache.put(URL, b'water')
+        # Older than the TTL
+        conn = self.cache._connect()
+        with conn:
+            conn.execute('update cache set created=0;')
+    
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.path, True)
+    
+    def test_miss(self):
+        '''An entry past the TTL is a miss, but it is kept'''
+        self.assertEqual(self.cache.get(URL), None)
+        self.assertEqual(self.cache.get(URL, ignoreTTL=True), b'water')
+    
+    def test_fallback(self):
+        '''An entry past the TTL is used when the network fails'''
+        self.assertEqual(self.cache.fetch(URL, timeout=1), b'water')
+        self.assertEqual(self.cache.fetch(URL, timeout=1, live=True),
+                         b'water')
+    
+    def test_missing(self):
+        '''Without a cached entry the network error is raised'''
+        self.assertRaises(Exception, self.cache.fetch, URL + '0', timeout=1)
+
+if __name__ == '__main__':
+    unittest.main()
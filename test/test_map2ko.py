@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""
+Local KO search scheduling tests
+
+Usage: test_map2ko.py (or python -m unittest test_map2ko)
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.genome.map2KO import LocalSearch
+import unittest
+
+__author__ = "Marco Galardini"
+
+class TestThreads(unittest.TestCase):
+    def test_all_cpus(self):
+        '''The running slices use all the available CPUs'''
+        for ncpus in range(1, 65):
+            search = LocalSearch('query', 'target', ncpus=ncpus)
+            threads = [search.getThreads(i) for i in range(search.jobs)]
+            self.assertEqual(sum(threads), ncpus)
+            self.assertTrue(max(threads) - min(threads) <= 1)
+    
+    def test_rounds(self):
+        '''Each round of jobs gets the same threads'''
+        search = LocalSearch('query', 'target', ncpus=7, threads=2)
+        self.assertEqual(search.jobs, 3)
+        self.assertEqual([search.getThreads(i) for i in range(6)],
+                         [3, 2, 2, 3, 2, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+PhenomeMatrix tests: the Experiment wrapping a matrix should give its
+wells without creating the Plate objects
+
+Usage: test_matrix.py (or python -m unittest test_matrix)
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from ductape.phenome.biolog import BiologParser, Experiment
+from ductape.phenome.matrix import PhenomeMatrix
+import unittest
+
+__author__ = "Marco Galardini"
+
+infile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'input', 'Rm1021.yml')
+
+class Row(object):
+    pass
+
+def getRows(wells=96):
+    '''
+    Signals as taken from the DB, for two strains (the first one with
+    two replicas) and two plates (the second one being a copy of the first)
+    '''
+    parser = BiologParser(infile)
+    parser.parse()
+    
+    rows = []
+    for plate_id in ('PM01', 'PM02A'):
+        for org_id, replica in (('A', 1), ('A', 2), ('B', 1)):
+            for plate in parser.plates:
+                for well in list(plate.getWells())[:wells]:
+                    row = Row()
+                    row.plate_id = plate_id
+                    row.well_id = well.well_id
+                    row.org_id = org_id
+                    row.replica = replica
+                    row.times = sorted(well.signals.keys())
+                    row.signals = [well.signals[h] for h in row.times]
+                    rows.append(row)
+    return rows
+
+def getIDs(wells):
+    return [(w.plate_id, w.well_id, w.strain, w.replica) for w in wells]
+
+class TestExperiment(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = getRows()
+    
+    def setUp(self):
+        self.matrix = PhenomeMatrix.fromSignals(self.rows, cache=False)
+        self.exp = Experiment(matrix=self.matrix,
+                              category={'carbon': set(['PM01']),
+                                        'nitrogen': set(['PM02A'])},
+                              categorder=['carbon', 'nitrogen'],
+                              zeroPlates=['PM01'])
+    
+    def test_order(self):
+        '''Same wells (and order) as the Plate objects'''
+        wells = getIDs(self.exp.getWells(False))
+        plates = getIDs([w for plate in self.matrix.getPlates()
+                         for w in plate.getWells()])
+        self.assertEqual(wells, plates)
+        self.assertEqual(len(wells), len(self.rows))
+    
+    def test_matrix(self):
+        '''No Plate object is created, no Well object is kept'''
+        wells = getIDs(self.exp.getWells(False))
+        zero = getIDs(self.exp.getZeroWells(False))
+        nozero = getIDs(self.exp.getNoZeroWells(False))
+        categs = dict([(categ, getIDs(wells))
+                       for categ, wells in self.exp.getCategoryWells(False)])
+        
+        self.assertEqual(zero, [x for x in wells if x[0] == 'PM01'])
+        self.assertEqual(nozero, [x for x in wells if x[0] != 'PM01'])
+        self.assertEqual(categs['carbon'], zero)
+        self.assertEqual(categs['nitrogen'], nozero)
+        
+        self.assertTrue(self.exp._plates is None)
+        self.assertFalse(self.matrix.isCached())
+        self.assertTrue(self.exp._isMatrix())
+    
+    def test_cache(self):
+        '''The kept Well objects are always the same'''
+        matrix = PhenomeMatrix.fromSignals(self.rows)
+        exp = Experiment(matrix=matrix)
+        wells = list(exp.getWells(False))
+        for w1, w2 in zip(wells, exp.getWells(False)):
+            self.assertTrue(w1 is w2)
+        self.assertTrue(matrix.isCached())
+        self.assertFalse(exp._isMatrix())
+    
+    def test_params(self):
+        '''The calculated parameters are stored in the matrix'''
+        matrix = PhenomeMatrix.fromSignals(getRows(wells=4), cache=False)
+        exp = Experiment(matrix=matrix)
+        self.assertFalse(matrix.isParams())
+        
+        for well in exp.getWells():
+            self.assertTrue(well.isParams())
+        self.assertTrue(matrix.isParams())
+        for well in exp.getWells(False):
+            self.assertTrue(well.isParams())
+
+if __name__ == '__main__':
+    unittest.main()